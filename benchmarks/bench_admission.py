@@ -0,0 +1,92 @@
+"""
+Simulates a class-start stampede: ``--students`` launches arrive within ``--ramp``
+seconds.  Each is authenticated for real, then waits for one of ``--spawn-slots``
+spawner slots for ``--spawn-seconds``, as a server start would.  A student gives up
+after ``--deadline`` seconds, but work the hub has already started carries on.
+
+The stampede is run without admission control, then through AdmissionController,
+and the launches that finished within the deadline, timed out or were turned away
+with a 503 are counted.
+
+    python benchmarks/bench_admission.py --students 300 --spawn-slots 10 --spawn-seconds 0.5
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from launches import use_temp_databases, launch_handler
+
+use_temp_databases()
+
+from ltiauthenticator.admission import AdmissionController, Overloaded
+from ltiauthenticator.lti import LTIAuthenticator
+
+
+async def stampede(authenticator, admission, args):
+    spawner = asyncio.Semaphore(args.spawn_slots)
+    handlers = [launch_handler('stampede-%d' % i) for i in range(args.students)]
+    outcomes = {'ok': 0, 'timed out': 0, 'shed': 0}
+    latencies = []
+    # how long the students who did not get in waited to find out
+    failures = []
+
+    async def launch(handler, delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        try:
+            await admission.acquire()
+        except Overloaded:
+            outcomes['shed'] += 1
+            failures.append(time.perf_counter() - start)
+            return
+        try:
+            assert await authenticator.authenticate(handler)
+            async with spawner:
+                await asyncio.sleep(args.spawn_seconds)
+        finally:
+            admission.release()
+        elapsed = time.perf_counter() - start
+        if elapsed > args.deadline:
+            outcomes['timed out'] += 1
+            failures.append(args.deadline)
+        else:
+            outcomes['ok'] += 1
+            latencies.append(elapsed)
+
+    random.seed(0)
+    await asyncio.gather(*(launch(handler, random.uniform(0, args.ramp)) for handler in handlers))
+    return outcomes, latencies, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=300, help="Launches in the stampede")
+    parser.add_argument('--ramp', type=float, default=2.0, help="Seconds over which the launches arrive")
+    parser.add_argument('--spawn-slots', type=int, default=10, help="Servers that can start at once")
+    parser.add_argument('--spawn-seconds', type=float, default=0.5, help="Seconds a server takes to start")
+    parser.add_argument('--deadline', type=float, default=10.0, help="Seconds before a student gives up")
+    parser.add_argument('--max-in-flight', type=int, default=20)
+    parser.add_argument('--max-queued', type=int, default=200)
+    parser.add_argument('--queue-timeout', type=float, default=8.0)
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    authenticator = LTIAuthenticator()
+    print('%d launches over %.1fs, %d spawn slots of %.2fs, %.0fs deadline'
+          % (args.students, args.ramp, args.spawn_slots, args.spawn_seconds, args.deadline))
+    print('%-28s %8s %10s %8s %12s %14s' % ('', 'ok', 'timed out', 'shed', 'ok p50 (s)', 'failed p50 (s)'))
+    for name, admission in [('no admission control', AdmissionController(max_in_flight=0)),
+                            ('AdmissionController', AdmissionController(args.max_in_flight, args.max_queued,
+                                                                        args.queue_timeout))]:
+        outcomes, latencies, failures = asyncio.run(stampede(authenticator, admission, args))
+        p50 = statistics.median(latencies) if latencies else float('nan')
+        failed_p50 = statistics.median(failures) if failures else float('nan')
+        print('%-28s %8d %10d %8d %12.2f %14.2f'
+              % (name, outcomes['ok'], outcomes['timed out'], outcomes['shed'], p50, failed_p50))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Microbenchmarks for the stages of an LTI launch.
+
+Each stage is timed on its own against a temporary SQLite database holding 1k, 10k
+and 100k existing users (and as many stored nonces), then the whole of
+LTIAuthenticator.authenticate is timed with correctly signed launches.
+
+    python benchmarks/bench_auth.py
+    python benchmarks/bench_auth.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_auth.py --compare benchmarks/baseline.json
+
+With ``--compare``, the exit status is 1 if any stage's median got slower than the
+baseline by more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+
+from launches import (use_temp_databases, signed_launch, launch_handler, Timings, print_table,
+                      KEY, LAUNCH_URL)
+
+use_temp_databases()
+
+from oauthlib.oauth1 import SignatureOnlyEndpoint
+
+from ltiauthenticator.authenticator_db import TimestampNonce
+from ltiauthenticator.lti import LTIAuthenticator
+from ltiauthenticator.lti_validator import LTIValidator
+from ltiauthenticator.nonce_cache import NonceCache
+from ltiauthenticator.roster import import_roster
+
+authenticator = LTIAuthenticator()
+lti_db = authenticator.lti_db
+
+
+def grow_population(size):
+    """
+    Adds users and stored nonces until there are ``size`` of each
+    """
+    import_roster(lti_db, (('bench-user-%d' % i, 'bench-course') for i in range(size)), chunk_size=5000)
+
+    nonces_db = authenticator.nonce_cache.nonces_db
+    have = nonces_db.count()
+    now = int(time.time())
+    rows = [{'username': KEY, 'timestamp': now - 3600, 'nonce': 'old-%d' % i} for i in range(have, size)]
+    if rows:
+        nonces_db.db.execute(TimestampNonce.__table__.insert(), rows)
+        nonces_db.db.commit()
+
+
+def bench_population(size, iterations):
+    grow_population(size)
+    user_ids = ['bench-user-%d' % random.randrange(size) for _ in range(iterations)]
+    results = {}
+
+    # Signature checks, with a fresh in-memory nonce cache so only oauthlib and the validator are measured
+    endpoint = SignatureOnlyEndpoint(LTIValidator(nonce_cache=NonceCache()))
+    launches = [signed_launch(user_id) for user_id in user_ids]
+    timings = Timings('signature')
+    for body, headers in launches:
+        with timings:
+            valid, _ = endpoint.validate_request(LAUNCH_URL, 'POST', body, headers)
+        assert valid
+    results['validate_request'] = timings.summary()
+
+    nonces_db = authenticator.nonce_cache.nonces_db
+    now = int(time.time())
+    timings = Timings('nonce_db')
+    for _ in range(iterations):
+        with timings:
+            nonces_db.check_valid_timestamp_and_nonce(now, uuid.uuid4().hex)
+    results['check_valid_timestamp_and_nonce'] = timings.summary()
+
+    cache = NonceCache()
+    timings = Timings('nonce_cache')
+    for _ in range(iterations):
+        with timings:
+            cache.check_and_add(KEY, now, uuid.uuid4().hex)
+    results['NonceCache.check_and_add'] = timings.summary()
+
+    timings = Timings('get_user')
+    for user_id in user_ids:
+        with timings:
+            lti_db.get_user(user_id)
+    results['get_user'] = timings.summary()
+
+    lti_db.invalidate_user()
+    for state in ('cold', 'warm'):
+        timings = Timings('lookup_user')
+        for user_id in user_ids:
+            with timings:
+                lti_db.lookup_user(user_id)
+        results['lookup_user (%s)' % state] = timings.summary()
+
+    timings = Timings('add_user')
+    for _ in range(iterations):
+        user_id = 'bench-new-%s' % uuid.uuid4().hex
+        with timings:
+            lti_db.add_user(user_id)
+    results['add_user'] = timings.summary()
+
+    timings = Timings('session')
+    for user_id in user_ids:
+        with timings:
+            lti_db.add_or_update_user_session(KEY, user_id, 'sourcedid-%d' % random.randrange(5),
+                                              'http://lms.invalid/outcomes', 'bench-link')
+    results['add_or_update_user_session'] = timings.summary()
+
+    handlers = [launch_handler(user_id) for user_id in user_ids]
+
+    async def authenticate_all():
+        timings = Timings('authenticate')
+        for handler in handlers:
+            start = time.perf_counter()
+            name = await authenticator.authenticate(handler)
+            timings.add(time.perf_counter() - start)
+            assert name
+        return timings
+
+    results['LTIAuthenticator.authenticate'] = asyncio.run(authenticate_all()).summary()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints how each stage's median moved against the baseline
+    :return: True if nothing got slower than the tolerance allows
+    """
+    ok = True
+    print('\nCompared with baseline (p50, negative is faster)')
+    for size, stages in results.items():
+        for stage, summary in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if not before:
+                continue
+            change = (summary['p50_us'] - before['p50_us']) / before['p50_us']
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                ok = False
+            print('%8s users  %-32s %+7.1f%%%s' % (size, stage, change * 100, flag))
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Existing user counts to benchmark at")
+    parser.add_argument('--iterations', type=int, default=1000, help="Operations timed per stage")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results to PATH as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="Compare the results with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Fraction a median may slow down by before --compare fails")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    random.seed(0)
+    results = {}
+    for size in sorted(args.users):
+        results[str(size)] = bench_population(size, args.iterations)
+        print_table('%d existing users' % size, results[str(size)])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('\nBaseline written to %s' % args.save_baseline)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
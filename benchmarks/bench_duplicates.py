@@ -0,0 +1,64 @@
+"""
+Sends bursts of duplicate launches, as double clicks and LMS re-posts produce: each
+of ``--users`` new users launches ``--copies`` times at once, each copy separately
+signed.  Reports how many users were created, how many copies failed and the database
+queries made, first with every copy mapping the user itself, then with the copies
+coalesced by LTIAuthenticator.authenticate.
+
+    python benchmarks/bench_duplicates.py --users 200 --copies 3
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from launches import use_temp_databases, launch_handler
+
+use_temp_databases()
+
+from ltiauthenticator.lti import LTIAuthenticator
+from ltiauthenticator.lti_db import LtiUser
+
+
+async def burst(authenticator, handlers, coalesce):
+
+    async def launch(handler):
+        if coalesce:
+            return await authenticator.authenticate(handler)
+        launch = authenticator._authenticate(handler)
+        return await authenticator.run_db(launch, authenticator._map_user, launch.user_id)
+
+    return await asyncio.gather(*(launch(handler) for handler in handlers), return_exceptions=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help="Users launching")
+    parser.add_argument('--copies', type=int, default=3, help="Copies of each launch sent at once")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    print('%d users, %d copies of each launch at once' % (args.users, args.copies))
+    print('%-12s %8s %8s %8s %8s %8s' % ('', 'seconds', 'failed', 'users', 'queries', 'shared'))
+    for name, coalesce in [('every copy', False), ('coalesced', True)]:
+        authenticator = LTIAuthenticator()
+        db = authenticator.lti_db
+        before = db.db.query(LtiUser).count()
+        db.db.commit()
+        handlers = [launch_handler('%s-%d' % (name.replace(' ', '-'), u))
+                    for u in range(args.users) for _ in range(args.copies)]
+
+        start = time.perf_counter()
+        names = asyncio.run(burst(authenticator, handlers, coalesce))
+        elapsed = time.perf_counter() - start
+
+        failed = sum(1 for result in names if isinstance(result, Exception) or not result)
+        created = db.db.query(LtiUser).count() - before
+        db.db.commit()
+        queries = sum(handler._lti_launch.db_queries for handler in handlers)
+        print('%-12s %8.2f %8d %8d %8d %8d'
+              % (name, elapsed, failed, created, queries, authenticator.single_flight.shared))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Enrols students into an nbgrader Gradebook against a local stand-in Hub, first the
+way enroll.py does it in every spawned server (a Python process per student, opening
+the Gradebook and adding one student), then through the enrollment queue and a single
+EnrollmentWorker applying batches, and reports the time each took.
+
+    python benchmarks/bench_enrollment.py --students 500 --processes 20
+
+Starting a process per student is slow, so only ``--processes`` of them are timed and
+the total is extrapolated from their mean.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from launches import ROOT
+from standins import FakeHub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=500, help="Students to enrol")
+    parser.add_argument('--processes', type=int, default=20, help="enroll.py runs to time")
+    parser.add_argument('--batch-size', type=int, default=200, help="Worker batch size")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    from ltiauthenticator.enrollment import EnrollmentWorker, enrollment_queue, enrollment_record
+    from ltiauthenticator.group_sync import GroupSync
+    from ltiauthenticator.nbgrader import SubAuthPlugin
+
+    tmp = tempfile.mkdtemp(prefix='bench-enrollment-')
+    results = {}
+
+    with FakeHub() as hub:
+        env = dict(os.environ, JUPYTERHUB_API_URL=hub.api_url, JUPYTERHUB_API_TOKEN=hub.token,
+                   JUPYTERHUB_USER='admin', GRADEBOOK_DB='sqlite:///%s/processes.db' % tmp, COURSE='bench',
+                   FIRST_NAME='First', LAST_NAME='Last', PYTHONPATH=ROOT)
+        env.pop('ENROLLMENT_QUEUED', None)
+        start = time.perf_counter()
+        for i in range(args.processes):
+            subprocess.run([sys.executable, os.path.join(ROOT, 'enroll.py')], env=dict(env, USERNAME='proc-%d' % i),
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        per_student = (time.perf_counter() - start) / args.processes
+        results['enroll.py per spawn (extrapolated)'] = per_student * args.students
+
+    with FakeHub() as hub:
+        os.environ.update(JUPYTERHUB_API_URL=hub.api_url, JUPYTERHUB_API_TOKEN=hub.token, JUPYTERHUB_USER='admin')
+        SubAuthPlugin.group_sync = GroupSync(flush_delay=0)
+        queue = enrollment_queue('sqlite:///%s/queue.db' % tmp)
+        queue.put_many([enrollment_record('student-%d' % i, 'bench', 'First', 'Last')
+                        for i in range(args.students)])
+        worker = EnrollmentWorker(queue=queue, gradebook_url='sqlite:///%s/worker.db' % tmp,
+                                  batch_size=args.batch_size)
+        start = time.perf_counter()
+        worker.run(once=True)
+        results['EnrollmentWorker'] = time.perf_counter() - start
+        assert worker.applied == args.students and queue.depth() == 0
+        assert len(hub.groups['nbgrader-bench']) == args.students
+
+    print('%d students' % args.students)
+    print('%-40s %10s %12s' % ('', 'seconds', 'students/s'))
+    for name, elapsed in results.items():
+        print('%-40s %10.2f %12.1f' % (name, elapsed, args.students / elapsed))
+
+
+if __name__ == '__main__':
+    main()
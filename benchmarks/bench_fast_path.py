@@ -0,0 +1,116 @@
+"""
+Compares the memory allocated, and the time taken, by the launch path's lookups
+done through the ORM, as LtiDB and NoncesDB used to, and through their prebuilt Core
+statements: a user and their courses, a user's latest session, and whether a nonce
+has been seen.  Each lookup is traced with tracemalloc on its own, and the peak it
+allocated above what was already in use is averaged.
+
+    python benchmarks/bench_fast_path.py --users 500
+"""
+import argparse
+import logging
+import os
+import time
+import tracemalloc
+import uuid
+
+from launches import use_temp_databases
+
+use_temp_databases()
+
+from ltiauthenticator.authenticator_db import NoncesDB, TimestampNonce
+from ltiauthenticator.lti_db import LtiDB, LtiUser, LtiUserSession
+
+
+def orm_user(lti_db, user_id):
+    user = lti_db.db.query(LtiUser).filter(LtiUser.user_id == user_id).one()
+    return user.unix_name, user.course_names
+
+
+def core_user(lti_db, user_id):
+    record = lti_db.get_user(user_id)
+    return record.unix_name, record.courses
+
+
+def orm_session(lti_db, user_id):
+    return lti_db.db.query(LtiUserSession).filter(
+        LtiUserSession.user_id == user_id, LtiUserSession.key == 'benchkey',
+        LtiUserSession.resource_link_id == 'link').order_by(LtiUserSession.id.desc()).first()
+
+
+def core_session(lti_db, user_id):
+    return lti_db.get_user_session(user_id, 'benchkey', 'link')
+
+
+def orm_nonce(nonces_db, nonce, since):
+    return len(nonces_db.db.query(TimestampNonce).filter(
+        TimestampNonce.nonce == nonce, TimestampNonce.timestamp >= since).all()) == 0
+
+
+def core_nonce(nonces_db, nonce, since):
+    return nonces_db.check_valid_timestamp_and_nonce(since, nonce)
+
+
+def measure(fn, db, args):
+    """
+    :return: (mean bytes allocated at the peak of each call, mean seconds per call)
+    """
+    for arg in args[:20]:
+        fn(db, *arg)
+    db.db.rollback()
+
+    peaks = 0
+    tracemalloc.start()
+    for arg in args:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn(db, *arg)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks += peak - before
+        # the ORM's identity map would otherwise keep every instance alive
+        db.db.rollback()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for arg in args:
+        fn(db, *arg)
+        db.db.rollback()
+    elapsed = time.perf_counter() - start
+    return peaks / len(args), elapsed / len(args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help="Users, each with two courses and a session")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    lti_db = LtiDB(os.environ['LTI_DB'])
+    nonces_db = NoncesDB(os.environ['NONCES_DB'])
+    user_ids = ['fast-%d' % u for u in range(args.users)]
+    lti_db.import_users([(user_id, course) for user_id in user_ids for course in ('course-a', 'course-b')])
+    for user_id in user_ids:
+        lti_db.add_or_update_user_session('benchkey', user_id, 'link:%s' % user_id, 'http://lms.invalid/outcomes',
+                                          'link')
+    now = int(time.time())
+    nonces = [uuid.uuid4().hex for _ in user_ids]
+    for nonce in nonces:
+        nonces_db.add_nonce('bench', now, nonce)
+
+    print('%d users' % args.users)
+    print('%-10s %-5s %12s %12s' % ('lookup', 'path', 'bytes/call', 'us/call'))
+    cases = [
+        ('user', lti_db, orm_user, core_user, [(user_id,) for user_id in user_ids]),
+        ('session', lti_db, orm_session, core_session, [(user_id,) for user_id in user_ids]),
+        # half the nonces have been seen, half are new
+        ('nonce', nonces_db, orm_nonce, core_nonce,
+         [(nonce, now - 60) for nonce in nonces[::2]] + [(uuid.uuid4().hex, now - 60) for _ in nonces[::2]]),
+    ]
+    for name, db, orm, core, calls in cases:
+        for path, fn in (('orm', orm), ('core', core)):
+            allocated, seconds = measure(fn, db, calls)
+            print('%-10s %-5s %12.0f %12.1f' % (name, path, allocated, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
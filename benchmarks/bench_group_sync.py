@@ -0,0 +1,67 @@
+"""
+Enrols a course worth of students into JupyterHub groups against a local stand-in
+Hub, first the way nbgrader's JupyterHubAuthPlugin does it (list every group, then
+one POST per student), then through SubAuthPlugin's coalesced GroupSync, and reports
+the API calls and time each took.
+
+    python benchmarks/bench_group_sync.py --students 500 --groups 50
+"""
+import argparse
+import logging
+import os
+import time
+
+import launches  # noqa: puts the repository on sys.path
+from standins import FakeHub
+
+
+def populate(hub, groups, members):
+    for g in range(groups):
+        hub.groups['nbgrader-other-%d' % g] = set('other-%d-%d' % (g, m) for m in range(members))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=500, help="Students to enrol")
+    parser.add_argument('--groups', type=int, default=50, help="Other groups already on the Hub")
+    parser.add_argument('--members', type=int, default=200, help="Members of each other group")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    from nbgrader.auth.jupyterhub import JupyterHubAuthPlugin
+    from ltiauthenticator.group_sync import GroupSync
+    from ltiauthenticator.nbgrader import SubAuthPlugin
+
+    students = ['student-%d' % i for i in range(args.students)]
+    results = {}
+    for name, plugin in [('nbgrader JupyterHubAuthPlugin', JupyterHubAuthPlugin()),
+                         ('SubAuthPlugin + GroupSync', SubAuthPlugin())]:
+        with FakeHub() as hub:
+            os.environ['JUPYTERHUB_API_URL'] = hub.api_url
+            os.environ['JUPYTERHUB_API_TOKEN'] = hub.token
+            os.environ['JUPYTERHUB_USER'] = 'admin'
+            populate(hub, args.groups, args.members)
+            SubAuthPlugin.group_sync = GroupSync(flush_delay=0)
+
+            start = time.perf_counter()
+            for student in students:
+                plugin.add_student_to_course(student, 'bench')
+            # a second round, as if every student launched again
+            for student in students:
+                plugin.add_student_to_course(student, 'bench')
+            if isinstance(plugin, SubAuthPlugin):
+                plugin.flush_groups()
+            elapsed = time.perf_counter() - start
+
+            assert hub.groups['nbgrader-bench'] == set(students)
+            results[name] = (len(hub.calls), elapsed)
+
+    print('%d students, enrolled twice, with %d other groups of %d members on the Hub'
+          % (args.students, args.groups, args.members))
+    print('%-32s %10s %10s' % ('', 'API calls', 'seconds'))
+    for name, (calls, elapsed) in results.items():
+        print('%-32s %10d %10.2f' % (name, calls, elapsed))
+
+
+if __name__ == '__main__':
+    main()
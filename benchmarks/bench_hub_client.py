@@ -0,0 +1,84 @@
+"""
+Makes a run of JupyterHub API requests against a local stand-in Hub, first one at a
+time through nbgrader's ``_query_jupyterhub_api``, then through HubAPIClient, both
+one at a time and concurrently with ``request_many``, and reports the time and TCP
+connections each took.  Finally checks that a request answered with 503 twice is
+retried and succeeds.
+
+    python benchmarks/bench_hub_client.py --requests 500 --concurrency 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import launches  # noqa: puts the repository on sys.path
+from standins import FakeHub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500, help="Requests to make")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once")
+    parser.add_argument('--pool-size', type=int, default=4, help="Connections kept open")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    from nbgrader.auth.jupyterhub import _query_jupyterhub_api
+    from ltiauthenticator.hub_client import HubAPIClient
+
+    calls = [('POST', '/groups/bench-%d/users' % (i % 50), {'users': ['student-%d' % i]})
+             for i in range(args.requests)]
+
+    def nbgrader_serial(hub):
+        for method, path, data in calls:
+            _query_jupyterhub_api(method=method, api_path=path, post_data=data)
+
+    def client_serial(hub):
+        client = HubAPIClient(hub.api_url, hub.token, pool_size=args.pool_size)
+        for call in calls:
+            client.request(*call)
+        client.close()
+
+    def client_concurrent(hub):
+        client = HubAPIClient(hub.api_url, hub.token, pool_size=args.pool_size,
+                              max_concurrency=args.concurrency)
+        results = asyncio.run(client.request_many(calls))
+        client.close()
+        assert not [r for r in results if isinstance(r, Exception)]
+
+    results = {}
+    for name, run in [('nbgrader _query_jupyterhub_api', nbgrader_serial),
+                      ('HubAPIClient.request', client_serial),
+                      ('HubAPIClient.request_many', client_concurrent)]:
+        with FakeHub() as hub:
+            os.environ['JUPYTERHUB_API_URL'] = hub.api_url
+            os.environ['JUPYTERHUB_API_TOKEN'] = hub.token
+            os.environ['JUPYTERHUB_USER'] = 'admin'
+            hub.groups.update(('bench-%d' % g, set()) for g in range(50))
+            start = time.perf_counter()
+            run(hub)
+            elapsed = time.perf_counter() - start
+            assert sum(len(users) for users in hub.groups.values()) == args.requests
+            results[name] = (len(hub.peers), elapsed)
+
+    print('%d requests' % args.requests)
+    print('%-32s %12s %10s %10s' % ('', 'connections', 'seconds', 'req/s'))
+    for name, (connections, elapsed) in results.items():
+        print('%-32s %12d %10.2f %10.0f' % (name, connections, elapsed, args.requests / elapsed))
+
+    # The stand-in logs the 503s it is told to send
+    logging.getLogger('tornado.access').disabled = True
+    with FakeHub() as hub:
+        hub.groups['bench'] = set()
+        hub.fail_next = 2
+        client = HubAPIClient(hub.api_url, hub.token, backoff=0.01)
+        client.request('POST', '/groups/bench/users', {'users': ['retried']})
+        client.close()
+        assert hub.groups['bench'] == {'retried'}
+        print('\nRetried after %d 503 responses and succeeded' % (len(hub.calls) - 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Times importing the package and its authenticator modules with ``python -X importtime``,
+each in a fresh interpreter, and checks that importing them has no side effects.
+
+For every module it reports the best cumulative import time over ``--repeat`` runs.
+It fails (exit status 1) if:
+
+* a module imports a dependency it should only load on first use, such as nbgrader
+  from the authenticators, or anything at all from the bare package import, or
+* an import creates files, e.g. a SQLite database in the working directory, or
+* with ``--compare``, an import got slower than the baseline by more than ``--tolerance``
+  and by more than a millisecond.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --save-baseline benchmarks/import_baseline.json
+    python benchmarks/bench_import.py --compare benchmarks/import_baseline.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from launches import ROOT
+
+HEAVY = ('jupyterhub', 'oauthenticator', 'nbgrader', 'sqlalchemy', 'tornado', 'requests', 'lti', 'oauthlib')
+
+# module -> top-level packages it must not import
+TARGETS = {
+    'ltiauthenticator': HEAVY,
+    'ltiauthenticator.lti': ('nbgrader', 'lti'),
+    'ltiauthenticator.nbgrader_authenticator': ('nbgrader', 'lti'),
+}
+
+
+def import_time(module):
+    """
+    Imports a module in a fresh interpreter, in an empty working directory
+    :return: A tuple of the cumulative microseconds, the set of modules imported and the files created
+    """
+    env = dict((k, v) for k, v in os.environ.items()
+               if k not in ('LTI_DB', 'NONCES_DB', 'ENROLLMENT_QUEUE_DB'))
+    env['PYTHONPATH'] = ROOT
+    with tempfile.TemporaryDirectory(prefix='bench-import-') as cwd:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                                cwd=cwd, env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        created = sorted(os.listdir(cwd))
+
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative = int(total)
+    return cumulative, imported, created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help="Imports timed per module; the best is kept")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results to PATH as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="Compare the results with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Fraction an import may slow down by before --compare fails")
+    args = parser.parse_args(argv)
+
+    ok = True
+    results = {}
+    print('%-44s %12s' % ('module', 'import ms'))
+    for module, forbidden in TARGETS.items():
+        best = None
+        for _ in range(args.repeat):
+            cumulative, imported, created = import_time(module)
+            best = cumulative if best is None else min(best, cumulative)
+        results[module] = best
+        print('%-44s %12.1f' % (module, best / 1000.0))
+
+        leaked = sorted(name for name in imported if name.split('.')[0] in forbidden)
+        if leaked:
+            ok = False
+            print('    FAIL imports %s' % ', '.join(sorted(set(name.split('.')[0] for name in leaked))))
+        if created:
+            ok = False
+            print('    FAIL created %s' % ', '.join(created))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('\nBaseline written to %s' % args.save_baseline)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\nCompared with baseline (negative is faster)')
+        for module, best in results.items():
+            before = baseline.get(module)
+            if not before:
+                continue
+            change = (best - before) / before
+            flag = ''
+            # A sub-millisecond import is all noise
+            if change > args.tolerance and best - before > 1000:
+                flag = '  REGRESSION'
+                ok = False
+            print('%-44s %+7.1f%%%s' % (module, change * 100, flag))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Sends an assignment's grades back to a local stand-in LMS Outcomes service, which
+checks every signature and answers after ``--latency`` seconds as a real LMS would.
+
+The grades are streamed out of a temporary nbgrader Gradebook holding ``--students``
+graded submissions, first one request at a time, then ``--concurrency`` at once, and
+the throughput and connections used are reported.  Finally some requests are made to
+fail, and the grades are shown to be queued and then delivered by a retry.
+
+    python benchmarks/bench_outcomes.py --students 2000 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import time
+
+from launches import use_temp_databases, KEY, SECRET
+
+directory = use_temp_databases()
+
+from standins import FakeOutcomes
+
+
+def build_gradebook(url, course, assignment, students):
+    from nbgrader.api import Gradebook
+
+    with Gradebook(url, course) as gb:
+        gb.add_assignment(assignment)
+        gb.add_notebook('problems', assignment)
+        gb.add_grade_cell('answer', 'problems', assignment, max_score=10, cell_type='code')
+        for i, student in enumerate(students):
+            gb.add_student(student)
+            submission = gb.add_submission(assignment, student)
+            grade = submission.notebooks[0].grades[0]
+            grade.manual_score = i % 11
+        gb.db.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=2000, help="Grades to send")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the LMS takes to answer")
+    parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once")
+    parser.add_argument('--rate', type=float, default=1000.0, help="Requests a second to the LMS")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    from nbgrader.api import Gradebook
+    from ltiauthenticator.credentials import CredentialRegistry
+    from ltiauthenticator.durable_queue import DurableQueue
+    from ltiauthenticator.lti_db import LtiDB
+    from ltiauthenticator.outcomes import OutcomesClient, gradebook_grades, QUEUE_NAME
+    from ltiauthenticator.roster import import_roster
+
+    lti_db = LtiDB(os.environ['LTI_DB'])
+    credentials = CredentialRegistry(lti_db, {KEY: SECRET})
+    gradebook_url = 'sqlite:///' + os.path.join(directory, 'gradebook.db')
+    queue = DurableQueue('sqlite:///' + os.path.join(directory, 'outcomes.db'), QUEUE_NAME)
+
+    with FakeOutcomes({KEY: SECRET}, latency=args.latency) as lms:
+        user_ids = ['lms-user-%d' % i for i in range(args.students)]
+        import_roster(lti_db, ((user_id, 'bench') for user_id in user_ids), chunk_size=5000)
+        students = [lti_db.lookup_user(user_id).unix_name for user_id in user_ids]
+        for user_id in user_ids:
+            lti_db.add_or_update_user_session(KEY, user_id, 'ps1:%s' % user_id, lms.outcomes_url, 'ps1-link')
+        start = time.perf_counter()
+        build_gradebook(gradebook_url, 'bench', 'ps1', students)
+        print('Built a Gradebook of %d submissions in %.1fs\n' % (args.students, time.perf_counter() - start))
+
+        results = {}
+        for concurrency in (1, args.concurrency):
+            lms.scores.clear()
+            lms.peers.clear()
+            client = OutcomesClient(credentials, max_concurrency=concurrency, pool_size=concurrency,
+                                    rate=args.rate)
+            with Gradebook(gradebook_url, 'bench') as gb:
+                report = client.send_all(gradebook_grades(gb, 'ps1', lti_db, 'ps1-link'), queue)
+            client.close()
+            assert report['sent'] == args.students and len(lms.scores) == args.students, report
+            results['%d in flight' % concurrency] = (report, len(lms.peers))
+
+        print('%d grades, LMS latency %dms' % (args.students, args.latency * 1000))
+        print('%-16s %10s %12s %12s' % ('', 'seconds', 'grades/s', 'connections'))
+        for name, (report, connections) in results.items():
+            print('%-16s %10.2f %12.0f %12d' % (name, report['seconds'], report['grades_per_sec'], connections))
+
+        # The stand-in logs the 503s it is told to send
+        logging.getLogger('tornado.access').disabled = True
+        lms.scores.clear()
+        lms.fail_next = 10
+        client = OutcomesClient(credentials, max_concurrency=4, retries=0)
+        with Gradebook(gradebook_url, 'bench') as gb:
+            report = client.send_all(gradebook_grades(gb, 'ps1', lti_db, 'ps1-link'), queue, retry_delay=0)
+        retried = client.retry(queue)
+        client.close()
+        assert len(lms.scores) == args.students and queue.depth() == 0
+        print('\n%d grades failed and were queued, then all %d were delivered by the retry'
+              % (report['queued'], retried['sent']))
+
+
+if __name__ == '__main__':
+    main()
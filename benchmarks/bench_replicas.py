@@ -0,0 +1,131 @@
+"""
+Routes LtiDB reads to a read replica that lags behind the primary.  Both are SQLite
+files; a background thread copies the primary over the replica every ``--lag``
+seconds.  Each of ``--users`` launches maps its user, stores its session and reads
+the session back, on the DBExecutor like a real launch.  The users then launch again.
+
+Reported for each round: how many reads went to each database and how many
+read-backs missed the launch's own write, first reading back in the same request
+(which stickiness sends to the primary once the launch has written), then in a new
+request, which shows the lag the stickiness is hiding.
+
+    python benchmarks/bench_replicas.py --users 500 --lag 0.2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from launches import use_temp_databases
+
+directory = use_temp_databases()
+
+from ltiauthenticator.db_executor import DBExecutor
+from ltiauthenticator.lti_db import LtiDB
+from ltiauthenticator.routing import request_scope
+
+PRIMARY = os.path.join(directory, 'lti.db')
+REPLICA = os.path.join(directory, 'replica.db')
+
+
+class Replicator(threading.Thread):
+    """
+    Copies the primary over the replica every ``lag`` seconds
+    """
+
+    def __init__(self, lag):
+        super().__init__(daemon=True)
+        self.lag = lag
+        self.copies = 0
+        self._stopping = threading.Event()
+
+    def copy(self):
+        source = sqlite3.connect(PRIMARY)
+        target = sqlite3.connect(REPLICA, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        self.copies += 1
+
+    def run(self):
+        while not self._stopping.wait(self.lag):
+            self.copy()
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def launch(db, user_id, round_number):
+    """
+    What a launch does to the LtiDB
+    :return: True if the session read back is the one just stored
+    """
+    record = db.lookup_user(user_id)
+    if record is None:
+        db.add_user(user_id)
+    sourcedid = 'link:%s:%d' % (user_id, round_number)
+    db.add_or_update_user_session('benchkey', user_id, sourcedid, 'http://lms.invalid/outcomes', 'link')
+    return read_back(db, user_id, sourcedid)
+
+
+def read_back(db, user_id, sourcedid):
+    session = db.get_user_session(user_id, 'benchkey', 'link')
+    return session is not None and session.lis_result_sourcedid == sourcedid
+
+
+async def run_round(db, executor, users, round_number, same_request):
+
+    async def one(user_id):
+        with request_scope():
+            if same_request:
+                return await executor.run(launch, db, user_id, round_number)
+            await executor.run(launch, db, user_id, round_number)
+        with request_scope():
+            return await executor.run(read_back, db, user_id, 'link:%s:%d' % (user_id, round_number))
+
+    return await asyncio.gather(*(one(user_id) for user_id in users))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help="Users launching")
+    parser.add_argument('--lag', type=float, default=0.2, help="Seconds between copies to the replica")
+    parser.add_argument('--threads', type=int, default=8, help="DBExecutor threads")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    # create the schema, then the replica as a copy of it
+    LtiDB('sqlite:///' + PRIMARY)
+    replicator = Replicator(args.lag)
+    replicator.copy()
+    replicator.start()
+    executor = DBExecutor(args.threads)
+
+    print('%d users, replica copied every %.2fs' % (args.users, args.lag))
+    print('%-10s %-14s %8s %8s %8s %8s' % ('round', 'read back in', 'seconds', 'primary', 'replica', 'stale'))
+    try:
+        for same_request in (True, False):
+            for round_number in (1, 2):
+                # a fresh LtiDB each time, so every read-back is a miss in the user and session caches
+                db = LtiDB('sqlite:///' + PRIMARY, replica_urls=['sqlite:///' + REPLICA])
+                users = ['%s-%d' % ('same' if same_request else 'new', u) for u in range(args.users)]
+                start = time.perf_counter()
+                fresh = asyncio.run(run_round(db, executor, users, round_number, same_request))
+                elapsed = time.perf_counter() - start
+                print('%-10s %-14s %8.2f %8d %8d %8d'
+                      % ('first' if round_number == 1 else 'returning',
+                         'same request' if same_request else 'new request', elapsed,
+                         db.reads['primary'], db.reads['replica'], fresh.count(False)))
+    finally:
+        replicator.stop()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
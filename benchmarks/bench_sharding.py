@@ -0,0 +1,82 @@
+"""
+Checks the consistent hash ring, then rebalances real shards.
+
+First ``--keys`` user_ids are placed on rings of ``--shards`` and one more shard,
+reporting how evenly they spread and what fraction move: about 1/(N+1) should.
+Then ``--users`` users are imported into ``--shards`` SQLite shards, a shard is
+added, and ``lti-maintenance rebalance`` is run on them, after which every user must
+be found on the shard the ring gives them, with their unix name unchanged.
+
+    python benchmarks/bench_sharding.py --shards 3 --users 20000
+"""
+import argparse
+import logging
+import os
+import time
+
+from launches import use_temp_databases
+
+directory = use_temp_databases()
+
+from ltiauthenticator.maintenance import rebalance_shards
+from ltiauthenticator.sharding import HashRing, ShardedLtiDB, shard_name
+
+
+def shard_urls(count):
+    return ['sqlite:///' + os.path.join(directory, 'shard%d.db' % n) for n in range(count)]
+
+
+def ring_report(shards, keys):
+    before = HashRing(shard_name(n) for n in range(shards))
+    after = HashRing(shard_name(n) for n in range(shards + 1))
+    user_ids = ['user-%d' % n for n in range(keys)]
+    placed = dict((user_id, before.node_for(user_id)) for user_id in user_ids)
+    counts = {}
+    moved = 0
+    for user_id in user_ids:
+        node = after.node_for(user_id)
+        counts[node] = counts.get(node, 0) + 1
+        if node != placed[user_id]:
+            moved += 1
+    mean = keys / float(shards + 1)
+    print('%d keys, %d -> %d shards: %.1f%% moved (ideal %.1f%%), largest shard %.2fx the mean'
+          % (keys, shards, shards + 1, 100.0 * moved / keys, 100.0 / (shards + 1), max(counts.values()) / mean))
+
+
+def rebalance_report(shards, users, batch_size):
+    sharded = ShardedLtiDB(shard_urls(shards))
+    user_ids = ['rebalance-%d' % n for n in range(users)]
+    sharded.import_users([(user_id, 'course-%d' % (n % 7)) for n, user_id in enumerate(user_ids)])
+    for user_id in user_ids[::10]:
+        sharded.add_or_update_user_session('benchkey', user_id, 'link:%s' % user_id,
+                                           'http://lms.invalid/outcomes', 'link')
+    names = dict((user_id, sharded.get_user(user_id).unix_name) for user_id in user_ids)
+
+    grown = ShardedLtiDB(shard_urls(shards + 1))
+    start = time.perf_counter()
+    moved = rebalance_shards(grown, batch_size)
+    elapsed = time.perf_counter() - start
+
+    lost = sum(1 for user_id in user_ids
+               if getattr(grown.get_user(user_id), 'unix_name', None) != names[user_id])
+    sessions = sum(1 for user_id in user_ids[::10] if grown.get_user_session(user_id, 'benchkey', 'link') is None)
+    print('%d users, %d -> %d shards: moved %d (%.1f%%) in %.2fs, %d users and %d sessions not found after'
+          % (users, shards, shards + 1, sum(moved.values()), 100.0 * sum(moved.values()) / users, elapsed,
+             lost, sessions))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=3, help="Shards before one is added")
+    parser.add_argument('--keys', type=int, default=100000, help="Keys placed on the ring")
+    parser.add_argument('--users', type=int, default=20000, help="Users rebalanced between real shards")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Users read per rebalance batch")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    ring_report(args.shards, args.keys)
+    rebalance_report(args.shards, args.users, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
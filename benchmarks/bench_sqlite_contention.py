@@ -0,0 +1,109 @@
+"""
+Runs ``--writers`` processes, each storing ``--launches`` launches as fast as it can
+(a nonce, a new user and their session, the writes of a first launch), against fresh
+SQLite files.  Reports the launches stored per second and how many failed with
+``database is locked``, for SQLite's default settings, the concurrent profile, and the
+concurrent profile with the nonces kept in the LTI database.
+
+    python benchmarks/bench_sqlite_contention.py --writers 8 --launches 200
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+from launches import use_temp_databases
+
+use_temp_databases()
+
+from sqlalchemy.exc import OperationalError
+
+from ltiauthenticator.authenticator_db import NoncesDB
+from ltiauthenticator.engines import EngineRegistry
+from ltiauthenticator.lti_db import LtiDB
+
+PROFILES = [
+    # name, sqlite_profile, one file for both stores
+    ('default', 'default', False),
+    ('concurrent', 'concurrent', False),
+    ('merged', 'concurrent', True),
+]
+
+
+def writer(lti_url, nonces_url, profile, launches, start, results):
+    logging.disable(logging.CRITICAL)
+    registry = EngineRegistry.instance()
+    registry.dispose()
+    registry.sqlite_profile = profile
+    lti_db = LtiDB(lti_url)
+    nonces_db = NoncesDB(nonces_url)
+    start.wait()
+
+    stored = locked = 0
+    for _ in range(launches):
+        user_id = uuid.uuid4().hex
+        try:
+            nonces_db.add_nonce(user_id, int(time.time()), uuid.uuid4().hex)
+            lti_db.add_user(user_id)
+            lti_db.add_or_update_user_session('benchkey', user_id, 'link:%s' % user_id,
+                                              'http://lms.invalid/outcomes', 'link')
+            stored += 1
+        except (OperationalError, ValueError) as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+            lti_db.db.rollback()
+            nonces_db.db.rollback()
+    results.put((stored, locked))
+
+
+def run(name, profile, merged, writers, launches):
+    directory = tempfile.mkdtemp(prefix='lti-contention-')
+    lti_url = 'sqlite:///' + os.path.join(directory, 'lti.db')
+    nonces_url = lti_url if merged else 'sqlite:///' + os.path.join(directory, 'timestamp.db')
+
+    # create the schemas before the writers race to
+    registry = EngineRegistry.instance()
+    registry.sqlite_profile = profile
+    LtiDB(lti_url)
+    NoncesDB(nonces_url)
+    registry.dispose()
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(lti_url, nonces_url, profile, launches, start, results))
+                 for _ in range(writers)]
+    for process in processes:
+        process.start()
+    # let every writer connect before timing
+    time.sleep(1)
+    began = time.perf_counter()
+    start.set()
+    totals = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - began
+    for process in processes:
+        process.join()
+
+    stored = sum(s for s, _ in totals)
+    locked = sum(l for _, l in totals)
+    print('%-12s %8.2f %8d %8d %10.1f' % (name, elapsed, stored, locked, stored / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8, help="Concurrent writer processes")
+    parser.add_argument('--launches', type=int, default=200, help="Launches stored by each writer")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    print('%d writers, %d launches each' % (args.writers, args.launches))
+    print('%-12s %8s %8s %8s %10s' % ('profile', 'seconds', 'stored', 'locked', 'launches/s'))
+    for name, profile, merged in PROFILES:
+        run(name, profile, merged, args.writers, args.launches)
+
+
+if __name__ == '__main__':
+    main()
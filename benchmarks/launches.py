@@ -0,0 +1,129 @@
+"""
+Shared helpers for the benchmarks: synthetic, correctly signed LTI launches and the
+bits of a Tornado request handler that the authenticators look at.
+
+Import this before ``ltiauthenticator``: it puts the repository on ``sys.path`` and
+``use_temp_databases`` has to set the database URLs before the package reads them.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from oauthlib.oauth1 import Client, SIGNATURE_TYPE_BODY
+from tornado.httputil import HTTPHeaders
+
+KEY = 'benchkey'
+SECRET = 'benchsecret'
+LAUNCH_URL = 'http://localhost/hub/login'
+
+
+def use_temp_databases(directory=None):
+    """
+    Points the LTI and nonce databases, and the consumer key, at throwaway values
+    :return: The directory holding the database files
+    """
+    directory = directory or tempfile.mkdtemp(prefix='lti-bench-')
+    os.environ['LTI_DB'] = 'sqlite:///' + os.path.join(directory, 'lti.db')
+    os.environ['NONCES_DB'] = 'sqlite:///' + os.path.join(directory, 'timestamp.db')
+    os.environ['LTI_KEY'] = KEY
+    os.environ['LTI_SECRET'] = SECRET
+    for var in ['JUPYTERHUB_API_URL', 'JUPYTERHUB_API_TOKEN', 'GRADEBOOK_DB', 'MONGO_PW']:
+        os.environ.setdefault(var, 'bench')
+    return directory
+
+
+def launch_params(user_id, course='bench-course', resource_link_id='bench-link', **extra):
+    params = {
+        'lti_message_type': 'basic-lti-launch-request',
+        'lti_version': 'LTI-1p0',
+        'user_id': user_id,
+        'roles': 'Learner',
+        'custom_course': course,
+        'resource_link_id': resource_link_id,
+        'lis_person_name_given': 'Bench',
+        'lis_person_name_family': 'Mark',
+        'lis_outcome_service_url': 'http://lms.invalid/outcomes',
+        'lis_result_sourcedid': '%s:%s' % (resource_link_id, user_id),
+    }
+    params.update(extra)
+    return params
+
+
+def signed_launch(user_id, key=KEY, secret=SECRET, url=LAUNCH_URL, **params):
+    """
+    :return: A tuple of (body, headers) for a launch signed as the LMS would sign it
+    """
+    client = Client(key, client_secret=secret, signature_type=SIGNATURE_TYPE_BODY,
+                    nonce=uuid.uuid4().hex, timestamp=str(int(time.time())))
+    _, headers, body = client.sign(url, 'POST', body=urlencode(launch_params(user_id, **params)),
+                                   headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    return body, headers
+
+
+class FakeRequest(object):
+
+    def __init__(self, body, headers):
+        self.method = 'POST'
+        self.body = body.encode('utf-8')
+        self.headers = HTTPHeaders(headers)
+        self.protocol = 'http'
+        self.host = 'localhost'
+        self.uri = '/hub/login'
+
+
+class FakeHandler(object):
+    """
+    Just enough of a RequestHandler for LTIAuthenticator.authenticate
+    """
+
+    def __init__(self, body, headers):
+        self.request = FakeRequest(body, headers)
+
+
+def launch_handler(user_id, **params):
+    return FakeHandler(*signed_launch(user_id, **params))
+
+
+class Timings(object):
+    """
+    Collects the duration of each operation in a stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self._start)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        total = sum(samples)
+        return {
+            'ops': len(samples),
+            'ops_per_sec': len(samples) / total if total else 0.0,
+            'p50_us': statistics.median(samples) * 1e6,
+            'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+        }
+
+
+def print_table(title, results):
+    print('\n%s' % title)
+    print('%-32s %10s %12s %12s' % ('stage', 'ops/sec', 'p50 (us)', 'p99 (us)'))
+    for stage, summary in results.items():
+        print('%-32s %10.0f %12.1f %12.1f' % (stage, summary['ops_per_sec'], summary['p50_us'], summary['p99_us']))
@@ -0,0 +1,241 @@
+"""
+Local stand-ins for the external services the authenticator talks to, so the code
+that calls them can be exercised and timed without a real Hub or LMS.
+
+Each stand-in runs a Tornado application on its own IOLoop in a background thread.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from xml.etree import ElementTree
+
+from oauthlib.oauth1.rfc5849 import signature
+
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+
+class StandIn(object):
+    """
+    Runs a Tornado application on a free local port in a background thread
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.port = None
+        self._loop = None
+        self._thread = None
+
+    def handlers(self):
+        raise NotImplementedError
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def start(self):
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            server = HTTPServer(web.Application(self.handlers()))
+            server.add_sockets(sockets)
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _HubHandler(web.RequestHandler):
+
+    def initialize(self, hub):
+        self.hub = hub
+
+    def prepare(self):
+        self.hub.calls.append((self.request.method, self.request.path))
+        self.hub.peers.add(self.request.connection.stream.socket.getpeername())
+        if self.hub.fail_next > 0:
+            self.hub.fail_next -= 1
+            raise web.HTTPError(503)
+        if self.request.headers.get('Authorization') != 'token %s' % self.hub.token:
+            raise web.HTTPError(403)
+
+    def write_group(self, name):
+        self.write({'kind': 'group', 'name': name, 'users': sorted(self.hub.groups[name])})
+
+
+class _GroupsHandler(_HubHandler):
+
+    def get(self):
+        self.write(json.dumps([{'kind': 'group', 'name': name, 'users': sorted(users)}
+                               for name, users in sorted(self.hub.groups.items())]))
+
+
+class _GroupHandler(_HubHandler):
+
+    def get(self, name):
+        if name not in self.hub.groups:
+            raise web.HTTPError(404)
+        self.write_group(name)
+
+    def post(self, name):
+        if name in self.hub.groups:
+            raise web.HTTPError(409)
+        self.hub.groups[name] = set()
+        self.set_status(201)
+        self.write_group(name)
+
+
+class _GroupUsersHandler(_HubHandler):
+
+    def post(self, name):
+        if name not in self.hub.groups:
+            raise web.HTTPError(404)
+        self.hub.groups[name].update(json.loads(self.request.body)['users'])
+        self.write_group(name)
+
+
+class FakeHub(StandIn):
+    """
+    The group endpoints of the JupyterHub REST API, served at ``url + '/hub/api'``
+    """
+
+    def __init__(self, token='standin-token'):
+        super().__init__()
+        self.token = token
+        self.groups = {}
+        # The client (address, port) pairs seen, one per connection
+        self.peers = set()
+        # How many of the next requests to answer with 503
+        self.fail_next = 0
+
+    def handlers(self):
+        args = {'hub': self}
+        return [
+            (r'/hub/api/groups', _GroupsHandler, args),
+            (r'/hub/api/groups/([^/]+)', _GroupHandler, args),
+            (r'/hub/api/groups/([^/]+)/users', _GroupUsersHandler, args),
+        ]
+
+    @property
+    def api_url(self):
+        return self.url + '/hub/api'
+
+
+OUTCOMES_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<imsx_POXEnvelopeResponse xmlns="http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0">
+  <imsx_POXHeader>
+    <imsx_POXResponseHeaderInfo>
+      <imsx_version>V1.0</imsx_version>
+      <imsx_messageIdentifier>%(message_id)s</imsx_messageIdentifier>
+      <imsx_statusInfo>
+        <imsx_codeMajor>%(code)s</imsx_codeMajor>
+        <imsx_severity>status</imsx_severity>
+        <imsx_description>%(description)s</imsx_description>
+      </imsx_statusInfo>
+    </imsx_POXResponseHeaderInfo>
+  </imsx_POXHeader>
+  <imsx_POXBody><replaceResultResponse/></imsx_POXBody>
+</imsx_POXEnvelopeResponse>
+"""
+
+
+class _OutcomesHandler(web.RequestHandler):
+
+    def initialize(self, lms):
+        self.lms = lms
+
+    def respond(self, code, description):
+        self.set_header('Content-Type', 'application/xml')
+        self.write(OUTCOMES_RESPONSE % {'message_id': time.time(), 'code': code, 'description': description})
+
+    def verified(self):
+        """
+        Checks the OAuth signature and that the body hash matches the body
+        """
+        headers = dict(self.request.headers)
+        params = dict(signature.collect_parameters(headers=headers, exclude_oauth_signature=False))
+        secret = self.lms.secrets.get(params.get('oauth_consumer_key'))
+        if secret is None or 'oauth_signature' not in params:
+            return False
+        body_hash = base64.b64encode(hashlib.sha1(self.request.body).digest()).decode('ascii')
+        if params.get('oauth_body_hash') != body_hash:
+            return False
+        base = signature.signature_base_string(
+            'POST', signature.base_string_uri(self.request.full_url()),
+            signature.normalize_parameters(signature.collect_parameters(headers=headers)))
+        return hmac.compare_digest(signature.sign_hmac_sha1(base, secret, ''), params['oauth_signature'])
+
+    async def post(self):
+        lms = self.lms
+        with lms.lock:
+            lms.calls.append((self.request.method, self.request.path))
+            lms.peers.add(self.request.connection.stream.socket.getpeername())
+            fail = lms.fail_next > 0
+            if fail:
+                lms.fail_next -= 1
+        if lms.latency:
+            await asyncio.sleep(lms.latency)
+        if fail:
+            raise web.HTTPError(503)
+        if not self.verified():
+            self.set_status(401)
+            return self.respond('failure', 'Bad signature')
+        ns = {'ims': 'http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0'}
+        root = ElementTree.fromstring(self.request.body)
+        sourcedid = root.findtext('.//ims:sourcedId', namespaces=ns)
+        score = float(root.findtext('.//ims:resultScore/ims:textString', namespaces=ns))
+        if not 0 <= score <= 1:
+            return self.respond('failure', 'Score out of range')
+        with lms.lock:
+            lms.scores[sourcedid] = score
+        self.respond('success', 'Score for %s is now %s' % (sourcedid, score))
+
+
+class FakeOutcomes(StandIn):
+    """
+    An LMS's LTI 1.1 Outcomes service, at ``url + '/outcomes'``, which checks each
+    request's signature and body hash and records the scores it is sent
+    """
+
+    def __init__(self, secrets, latency=0.0):
+        """
+        :param secrets: A dict of {consumer key: secret}
+        :param latency: Seconds each response is delayed by, as a real LMS would be
+        """
+        super().__init__()
+        self.secrets = secrets
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.scores = {}
+        self.peers = set()
+        self.fail_next = 0
+
+    def handlers(self):
+        return [(r'/outcomes', _OutcomesHandler, {'lms': self})]
+
+    @property
+    def outcomes_url(self):
+        return self.url + '/outcomes'
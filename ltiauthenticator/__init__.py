@@ -1,3 +1,30 @@
-from .lti import LTIAuthenticator, LocalLTIAuthenticator
-from .nbgrader_authenticator import NBGraderAuthenticator, LocalNBGraderAuthenticator
-from .nbgrader import SubAuthenticator, SubAuthPlugin
\ No newline at end of file
+"""
+The authenticators are loaded on first use, so importing the package does not pull in
+JupyterHub, oauthenticator or nbgrader, and deployments without nbgrader never load it.
+"""
+import importlib
+
+# public name -> the submodule defining it
+_exports = {
+    'LTIAuthenticator': '.lti',
+    'LocalLTIAuthenticator': '.lti',
+    'NBGraderAuthenticator': '.nbgrader_authenticator',
+    'LocalNBGraderAuthenticator': '.nbgrader_authenticator',
+    'SubAuthenticator': '.nbgrader',
+    'SubAuthPlugin': '.nbgrader',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
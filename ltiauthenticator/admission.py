@@ -0,0 +1,102 @@
+"""
+Admission control for LTI launches.
+
+At the start of a class every student launches within a minute or so.  Rather than
+letting all of those launches into the hub at once, where they pile up on the
+database and the spawner until every one of them times out, at most ``max_in_flight``
+are processed at a time.  Up to ``max_queued`` more wait their turn for a short while,
+and anything beyond that is turned away straight away with a ``503`` and a
+``Retry-After`` header, which costs the hub almost nothing.
+"""
+import asyncio
+import threading
+
+
+class Overloaded(Exception):
+    """
+    Raised when a launch is shed because the hub is too busy to take it
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController(object):
+
+    def __init__(self, max_in_flight=32, max_queued=128, queue_timeout=10.0, retry_after=5):
+        """
+        :param max_in_flight: The most launches processed at once.  0 or less admits everything
+        :param max_queued: The most launches waiting for a slot.  Launches arriving when the
+            queue is full are shed
+        :param queue_timeout: Seconds a launch waits for a slot before it is shed
+        :param retry_after: Seconds clients are told to wait before trying again
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self._semaphore = None
+        # The counters are read by the metrics from other threads
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        """
+        Waits for a slot
+        :raises Overloaded: If the queue is full, or no slot came free in time
+        """
+        if self.max_in_flight <= 0:
+            with self._lock:
+                self.admitted += 1
+                self.in_flight += 1
+            return
+        if self._semaphore is None:
+            # Created here so it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queued:
+                self._shed()
+                raise Overloaded('The launch queue is full', self.retry_after)
+            with self._lock:
+                self.waiting += 1
+                self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._shed()
+                raise Overloaded('No launch slot came free within %ss' % self.queue_timeout, self.retry_after)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        with self._lock:
+            self.admitted += 1
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._semaphore is not None and self.max_in_flight > 0:
+            self._semaphore.release()
+
+    def _shed(self):
+        with self._lock:
+            self.shed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+            }
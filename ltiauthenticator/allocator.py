@@ -0,0 +1,56 @@
+"""
+Hands out unix names for new users in constant time.
+
+Numbers come from a counter row in the database, which is incremented atomically
+by a whole block at a time.  Each process then hands out the names in its block
+from memory, so two launches can never be given the same name, whichever process
+or thread they arrive on.  Names left unused in a block when the process stops are
+simply skipped.
+"""
+import threading
+
+
+class UnixNameAllocator(object):
+
+    def __init__(self, lti_db, prefix='user-', block_size=10, counter='unix_name'):
+        """
+        :param lti_db: The LtiDB holding the counter
+        :param prefix: Put in front of each number to make the unix name
+        :param block_size: How many numbers to reserve from the database at a time
+        :param counter: The name of the counter row
+        """
+        self.lti_db = lti_db
+        self.prefix = prefix
+        self.block_size = block_size
+        self.counter = counter
+        self._lock = threading.Lock()
+        self._block = iter(())
+
+    def reserve(self, count):
+        """
+        Reserves ``count`` consecutive unix names for the caller, e.g. for a bulk import
+        :return: A list of unix names
+        """
+        return [self.prefix + str(n) for n in self.lti_db.reserve_ids(self.counter, count, self._seed)]
+
+    def next_name(self):
+        """
+        :return: A unix name that has never been handed out before
+        """
+        with self._lock:
+            number = next(self._block, None)
+            if number is None:
+                self._block = iter(self.lti_db.reserve_ids(self.counter, self.block_size, self._seed))
+                number = next(self._block)
+        return self.prefix + str(number)
+
+    def _seed(self, unix_names):
+        """
+        Works out where the counter should start for a database created before it
+        existed, from the names that have already been handed out
+        """
+        highest = 0
+        for name in unix_names:
+            if name and name.startswith(self.prefix) and name[len(self.prefix):].isdigit():
+                highest = max(highest, int(name[len(self.prefix):]))
+        return highest
@@ -7,7 +7,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import and_
-from sqlalchemy import select, func, exists, case, literal_column
+from sqlalchemy import select, func, exists, case, literal_column, Index, bindparam
+from .dialects import insert_if_absent
+from .engines import get_session
 
 # Things for the timestamp and nonce validation
 Base = declarative_base()
@@ -17,14 +19,23 @@ class TimestampNonce(Base):
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     username = Column(String)
-    timestamp = Column(Integer)
+    timestamp = Column(Integer, index=True)
     nonce = Column(String)
 
+    __table_args__ = (
+        Index('ix_nonces_nonce_timestamp', 'nonce', 'timestamp', unique=True),
+    )
+
     def __repr__(self):
         return 'TimestampNonce(<id: %d username: %s timestamp: %d nonce: %s>)' \
                % (self.id, self.username, self.timestamp, self.nonce)
 
 
+# Built once, so SQLAlchemy compiles it once, and it stops at the first match
+_NONCE_SEEN = select(exists().where(TimestampNonce.__table__.c.nonce == bindparam('nonce'),
+                                    TimestampNonce.__table__.c.timestamp >= bindparam('since')))
+
+
 class NoncesDB(object):
 
     def __init__(self, db_url):
@@ -32,25 +43,84 @@ class NoncesDB(object):
         Initialize the connection to the database.
         :param db_url:The URL to the database, e.g. ``sqlite:///nonces.db``
         """
-        # create the connection to the database
-        engine = create_engine(db_url, echo=True)
-        self.db = scoped_session(sessionmaker(autoflush=True, bind=engine))
-
-
-        # this creates all the tables in the database if they don't already exist
-        Base.metadata.create_all(bind=engine)
-
+        # the engine, session and tables are shared by every NoncesDB using this URL
+        self.db = get_session(db_url, Base.metadata)
 
     def add_nonce(self, user, timestamp, nonce):
-
-        nonce = TimestampNonce(username=user, timestamp=timestamp, nonce=nonce)
-        self.db.add(nonce)
+        """
+        Records a nonce, doing nothing if it has already been recorded with this timestamp,
+        so several hub workers can store the same launch without tripping over each other.
+        :return: True if the nonce was new
+        """
         try:
+            inserted = insert_if_absent(self.db, TimestampNonce.__table__,
+                                        {'username': user, 'timestamp': timestamp, 'nonce': nonce},
+                                        index_elements=['nonce', 'timestamp'])
             self.db.commit()
         except (IntegrityError, FlushError) as e:
             self.db.rollback()
             raise ValueError(*e.args)
-        return nonce
+        return inserted != 0
+
+    def add_nonces(self, nonces):
+        """
+        Records several nonces in one transaction, skipping any already recorded
+        :param nonces: A list of (user, timestamp, nonce)
+        :return: The number of nonces that were new, or -1 if the driver does not report it
+        """
+        try:
+            inserted = insert_if_absent(self.db, TimestampNonce.__table__,
+                                        [{'username': user, 'timestamp': timestamp, 'nonce': nonce}
+                                         for user, timestamp, nonce in nonces],
+                                        index_elements=['nonce', 'timestamp'])
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        return inserted
+
+    def prune(self, older_than, batch_size=1000, max_batches=None):
+        """
+        Deletes nonces whose timestamp is before ``older_than``, committing after each
+        batch so no single transaction holds the table for long.
+        :param older_than: Timestamps before this are deleted
+        :param batch_size: The most rows deleted per transaction
+        :param max_batches: Stop after this many batches, or None to delete everything
+        :return: The number of rows deleted
+        """
+        table = TimestampNonce.__table__
+        pruned = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            # the ids are read first, as MySQL doesn't allow LIMIT in an IN subquery
+            try:
+                ids = [row.id for row in self.db.execute(
+                    select(table.c.id).where(table.c.timestamp < older_than).limit(batch_size))]
+                if ids:
+                    self.db.execute(table.delete().where(table.c.id.in_(ids)))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            pruned += len(ids)
+            batches += 1
+            if len(ids) < batch_size:
+                break
+        return pruned
+
+    def count(self):
+        """
+        :return: The number of nonces in the table
+        """
+        return self.db.query(func.count(TimestampNonce.id)).scalar()
+
+    def recent_nonces(self, since):
+        """
+        :param since: The oldest timestamp to return
+        :return: A list of (username, timestamp, nonce) tuples for every nonce at or after ``since``
+        """
+        return self.db.query(TimestampNonce.username, TimestampNonce.timestamp, TimestampNonce.nonce)\
+            .filter(TimestampNonce.timestamp >= since).all()
 
     def check_valid_timestamp_and_nonce(self, timestamp, nonce):
         """
@@ -74,8 +144,6 @@ class NoncesDB(object):
             valid_timestamp = 0
         elif now - timestamp < 0:
             valid_timestamp = 0
-        result = self.db.query(TimestampNonce)\
-                .filter(TimestampNonce.nonce == nonce)\
-                .filter(TimestampNonce.timestamp >= valid_timestamp).all()
+        seen = self.db.execute(_NONCE_SEEN, {'nonce': nonce, 'since': valid_timestamp}).scalar()
 
-        return len(result) == 0 and valid_timestamp > 0
+        return not seen and valid_timestamp > 0
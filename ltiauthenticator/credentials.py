@@ -0,0 +1,102 @@
+"""
+In-memory registry of LTI consumer keys and secrets.
+
+All rows of the ``keysecret`` table are read into a dict once, so checking a launch
+signature is a dictionary lookup rather than a database query.  Any number of
+consumers can be registered, e.g. one key per course or per LMS.  The registry is
+reloaded when its version is bumped, either by adding a key through it or by
+sending the hub the reload signal (SIGHUP by default) after changing the table.
+"""
+import os
+import signal
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def env_seed():
+    """
+    :return: The ``LTI_KEY``/``LTI_SECRET`` pair from the environment as a seed for
+        CredentialRegistry, so the hub and the command line tools sign with the same secret
+    """
+    return {os.environ.get('LTI_KEY', ''): os.environ.get('LTI_SECRET', '')}
+
+
+class CredentialRegistry(object):
+
+    def __init__(self, lti_db, seed=None):
+        """
+        :param lti_db: The LtiDB holding the ``keysecret`` table
+        :param seed: An optional dict of {key: secret}, e.g. the ``LTI_KEY``/``LTI_SECRET``
+            pair from the environment.  They are added to the table if missing, and take
+            precedence over the table, so a secret is rotated by changing the environment
+        """
+        self.lti_db = lti_db
+        self.version = 0
+        self._secrets = {}
+        self._seed = dict((key, secret) for key, secret in (seed or {}).items() if key)
+        self._stale = True
+        self._lock = threading.Lock()
+        for key, secret in self._seed.items():
+            self.lti_db.add_key_secret(key, secret)
+
+    def __contains__(self, key):
+        return key in self._current()
+
+    def __len__(self):
+        return len(self._current())
+
+    def get_secret(self, key):
+        """
+        :return: The secret for a consumer key, or None if the key is unknown
+        """
+        return self._current().get(key)
+
+    def _current(self):
+        if self._stale:
+            self.reload()
+        return self._secrets
+
+    def reload(self):
+        """
+        Re-reads every key/secret pair from the database, with the seed pairs on top, and
+        bumps the version
+        """
+        with self._lock:
+            secrets = self.lti_db.get_key_secrets()
+            secrets.update(self._seed)
+            # Readers keep using the old dict until the new one is swapped in whole
+            self._secrets = secrets
+            self._stale = False
+            self.version += 1
+        log.info('Loaded %d LTI consumer keys (version %d)' % (len(self._secrets), self.version))
+
+    def bump_version(self):
+        """
+        Marks the registry as stale, so the next lookup reloads it.  This is safe to
+        call from a signal handler.
+        """
+        self._stale = True
+
+    def add(self, key, secret):
+        """
+        Stores a new consumer key and makes it available straight away
+        """
+        self.lti_db.add_key_secret(key, secret)
+        self.bump_version()
+
+    def install_signal_handler(self, signum=signal.SIGHUP):
+        """
+        Reloads the registry whenever the process receives ``signum``.  Any handler
+        that was already installed is still called.
+        """
+        previous = signal.getsignal(signum)
+
+        def handler(received, frame):
+            log.info('Received signal %d, reloading LTI consumer keys' % received)
+            self.bump_version()
+            if callable(previous):
+                previous(received, frame)
+
+        signal.signal(signum, handler)
@@ -0,0 +1,34 @@
+"""
+Runs blocking database calls on a bounded thread pool, so a slow query or fsync
+never stalls the IOLoop.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DBExecutor(object):
+
+    def __init__(self, max_workers=4):
+        """
+        :param max_workers: The most database calls that can run at once
+        """
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lti-db')
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` on the pool and waits for the result without
+        blocking the event loop.  Anything ``fn`` returns crosses back to the IOLoop
+        thread, so it should be plain data rather than ORM objects that could still
+        lazy-load through the worker thread's session.  ``fn`` runs in a copy of the
+        caller's context, so it sees the caller's ContextVars, e.g. its request scope.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
@@ -0,0 +1,100 @@
+"""
+Helpers for statements whose best form depends on the database dialect.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+# What SQLite and PostgreSQL say when no unique index matches an ON CONFLICT target
+_NO_CONFLICT_TARGET = (
+    'ON CONFLICT clause does not match any PRIMARY KEY or UNIQUE constraint',
+    'there is no unique or exclusion constraint matching the ON CONFLICT specification',
+)
+
+
+def _dialect_insert(session, table):
+    name = session.get_bind().dialect.name
+    if name == 'sqlite':
+        return sqlite.insert(table)
+    if name == 'postgresql':
+        return postgresql.insert(table)
+    return None
+
+
+def missing_conflict_target(error):
+    """
+    :param error: An exception raised by ``insert_if_absent`` or ``upsert``
+    :return: True if it failed because the table has no unique index over ``index_elements``,
+        rather than for a reason such as a locked database
+    """
+    if not isinstance(error, (OperationalError, ProgrammingError)):
+        return False
+    message = str(getattr(error, 'orig', error))
+    return any(text in message for text in _NO_CONFLICT_TARGET)
+
+
+def insert_if_absent(session, table, rows, index_elements):
+    """
+    Inserts rows, silently skipping any that would violate the unique index over
+    ``index_elements``.  On SQLite and PostgreSQL this is a single
+    ``INSERT ... ON CONFLICT DO NOTHING``, so concurrent writers race safely.  The
+    caller is responsible for committing.
+    :param session: The session to execute in
+    :param table: The Table to insert into
+    :param rows: A dict, or a list of dicts, of column values
+    :param index_elements: The column names making up the unique index
+    :return: The number of rows actually inserted, or -1 if the driver does not report it
+    """
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not rows:
+        return 0
+
+    insert = _dialect_insert(session, table)
+    if insert is not None:
+        stmt = insert.on_conflict_do_nothing(index_elements=index_elements)
+        return session.execute(stmt, rows if len(rows) > 1 else rows[0]).rowcount
+
+    inserted = 0
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(table.insert(), row)
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def upsert(session, table, rows, index_elements, update_columns):
+    """
+    Inserts rows, or where a row would violate the unique index over ``index_elements``,
+    updates ``update_columns`` of the existing row instead.  On SQLite and PostgreSQL
+    this is a single ``INSERT ... ON CONFLICT DO UPDATE``.  The caller is responsible
+    for committing.
+    :param session: The session to execute in
+    :param table: The Table to write to
+    :param rows: A dict, or a list of dicts, of column values
+    :param index_elements: The column names making up the unique index
+    :param update_columns: The column names to overwrite when the row already exists
+    """
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not rows:
+        return
+
+    insert = _dialect_insert(session, table)
+    if insert is not None:
+        stmt = insert.on_conflict_do_update(
+            index_elements=index_elements,
+            set_=dict((column, insert.excluded[column]) for column in update_columns))
+        session.execute(stmt, rows if len(rows) > 1 else rows[0])
+        return
+
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(table.insert(), row)
+        except IntegrityError:
+            where = [table.c[column] == row[column] for column in index_elements]
+            session.execute(table.update().where(*where).values(
+                dict((column, row[column]) for column in update_columns)))
@@ -0,0 +1,148 @@
+"""
+A durable work queue kept in a database table.
+
+Producers ``put`` JSON payloads.  Consumers ``lease`` a batch, do the work and
+``ack`` it, which deletes the rows.  A leased item that is not acknowledged before
+its lease runs out, because the consumer crashed or called ``release``, is handed
+out again, so every item is delivered at least once and consumers must tolerate
+seeing an item twice.
+"""
+import json
+import time
+import uuid
+
+from sqlalchemy import Column, Integer, String, Text, Float, Index
+from sqlalchemy.ext.declarative import declarative_base
+
+from .engines import get_session
+
+Base = declarative_base()
+
+
+class QueueItem(Base):
+    __tablename__ = 'queue_items'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    queue = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
+    enqueued_at = Column(Float, nullable=False)
+    # Not handed out before this time; also the lease expiry while leased
+    available_at = Column(Float, nullable=False)
+    lease = Column(String(32))
+    attempts = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_queue_items_queue_available_at', 'queue', 'available_at'),
+        Index('ix_queue_items_lease', 'lease'),
+    )
+
+    def __repr__(self):
+        return 'QueueItem(<id: %d queue: %s attempts: %d>)' % (self.id, self.queue, self.attempts)
+
+
+class DurableQueue(object):
+
+    def __init__(self, db_url, name='default'):
+        """
+        :param db_url: The URL to the database, e.g. ``sqlite:///queue.db``
+        :param name: Several queues can share a table, each under its own name
+        """
+        self.db = get_session(db_url, Base.metadata)
+        self.name = name
+
+    def put(self, payload, delay=0):
+        """
+        Adds an item to the queue
+        :param payload: Anything that can be encoded as JSON
+        :param delay: Seconds before the item can be leased
+        """
+        self.put_many([payload], delay)
+
+    def put_many(self, payloads, delay=0):
+        """
+        Adds several items to the queue in one transaction
+        """
+        now = time.time()
+        rows = [{'queue': self.name, 'payload': json.dumps(payload), 'enqueued_at': now,
+                 'available_at': now + delay, 'attempts': 0} for payload in payloads]
+        if not rows:
+            return
+        try:
+            self.db.execute(QueueItem.__table__.insert(), rows)
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+
+    def lease(self, limit=100, lease_seconds=60):
+        """
+        Takes up to ``limit`` items, oldest first, out of circulation for ``lease_seconds``
+        :return: A list of (id, payload) tuples
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        table = QueueItem.__table__
+        ready = self.db.query(QueueItem.id) \
+            .filter(QueueItem.queue == self.name, QueueItem.available_at <= now) \
+            .order_by(QueueItem.id).limit(limit).subquery()
+        try:
+            # Claiming by token in one UPDATE means two consumers never get the same item
+            # from one lease; the available_at test stops them both claiming a row at once
+            self.db.execute(
+                table.update()
+                .where(table.c.id.in_(ready.select()))
+                .where(table.c.available_at <= now)
+                .values(lease=token, available_at=now + lease_seconds, attempts=table.c.attempts + 1))
+            rows = self.db.query(QueueItem.id, QueueItem.payload) \
+                .filter(QueueItem.lease == token).order_by(QueueItem.id).all()
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        return [(item_id, json.loads(payload)) for item_id, payload in rows]
+
+    def ack(self, ids):
+        """
+        Removes items whose work is done
+        """
+        if not ids:
+            return
+        try:
+            self.db.query(QueueItem).filter(QueueItem.id.in_(list(ids))).delete(synchronize_session=False)
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+
+    def release(self, ids, delay=0):
+        """
+        Gives items back to the queue to be tried again after ``delay`` seconds
+        """
+        if not ids:
+            return
+        try:
+            self.db.query(QueueItem).filter(QueueItem.id.in_(list(ids))) \
+                .update({'lease': None, 'available_at': time.time() + delay}, synchronize_session=False)
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+
+    def depth(self):
+        """
+        :return: The number of items not yet acknowledged, including leased ones
+        """
+        try:
+            return self.db.query(QueueItem).filter(QueueItem.queue == self.name).count()
+        finally:
+            self.db.commit()
+
+    def ready(self):
+        """
+        :return: The number of items that could be leased now
+        """
+        try:
+            return self.db.query(QueueItem) \
+                .filter(QueueItem.queue == self.name, QueueItem.available_at <= time.time()).count()
+        finally:
+            self.db.commit()
@@ -0,0 +1,216 @@
+"""
+Process-wide registry of SQLAlchemy engines and sessions.
+
+Every LtiDB and NoncesDB pointing at the same database URL shares one pooled engine
+and one ``scoped_session``, and the schema for each set of tables is only created
+once per process.  Constructing a database wrapper is therefore cheap, and a launch
+only costs connection checkouts from the pool.
+
+SQLite files can be opened with the ``concurrent`` profile, which puts them in WAL
+mode so launches read while another writes, only fsyncs at checkpoints, and has
+writers wait for the lock instead of failing with ``database is locked``::
+
+    c.EngineRegistry.sqlite_profile = 'concurrent'
+"""
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool, StaticPool
+from traitlets import Integer, Enum, observe
+from traitlets.config import SingletonConfigurable
+
+from .metrics import count_query
+
+
+class EngineRegistry(SingletonConfigurable):
+
+    pool_size = Integer(
+        5,
+        help="Number of connections to keep open in each engine's pool"
+    ).tag(config=True)
+
+    max_overflow = Integer(
+        10,
+        help="Number of connections allowed above pool_size when the pool is exhausted"
+    ).tag(config=True)
+
+    pool_recycle = Integer(
+        3600,
+        help="Seconds after which a pooled connection is replaced.  -1 disables recycling"
+    ).tag(config=True)
+
+    sqlite_profile = Enum(
+        ['default', 'concurrent'],
+        'default',
+        help="How SQLite database files are opened.  'default' leaves SQLite's rollback journal "
+             "settings alone.  'concurrent' sets WAL mode, synchronous=NORMAL and the sqlite_ "
+             "busy timeout, cache size and mmap size on every pooled connection"
+    ).tag(config=True)
+
+    sqlite_busy_timeout = Integer(
+        10000,
+        help="Milliseconds a connection waits for a locked SQLite database under the concurrent profile"
+    ).tag(config=True)
+
+    sqlite_cache_size = Integer(
+        16384,
+        help="KiB of page cache for each SQLite connection under the concurrent profile"
+    ).tag(config=True)
+
+    sqlite_mmap_size = Integer(
+        256 * 1024 * 1024,
+        help="Bytes of each SQLite database file memory mapped under the concurrent profile.  0 disables it"
+    ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.RLock()
+        self._engines = {}
+        self._sessions = {}
+        self._schemas = set()
+
+    @observe('pool_size', 'max_overflow', 'pool_recycle')
+    def _pool_changed(self, change):
+        """
+        Rebuilds the engines created before the pool settings changed, e.g. those created
+        at import, before the hub's config was loaded
+        """
+        if not getattr(self, '_engines', None):
+            return
+        with self._lock:
+            engines, self._engines = self._engines, {}
+            for db_url, session in self._sessions.items():
+                session.remove()
+                session.configure(bind=self.engine(db_url))
+            for engine in engines.values():
+                engine.dispose()
+
+    def _engine_options(self, db_url):
+        url = make_url(db_url)
+        if url.get_backend_name() != 'sqlite':
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'pool_recycle': self.pool_recycle,
+            }
+
+        # SQLite connections are handed between threads by the pool, so the
+        # same-thread check has to go.  An in-memory database only exists for
+        # the lifetime of its connection, so it must be a single shared one.
+        options = {'connect_args': {'check_same_thread': False}}
+        if url.database in (None, '', ':memory:'):
+            options['poolclass'] = StaticPool
+        else:
+            if self.sqlite_profile == 'concurrent':
+                # sqlite3 applies its own busy timeout, in seconds, before the pragma is set
+                options['connect_args']['timeout'] = self.sqlite_busy_timeout / 1000.0
+            options.update({
+                'poolclass': QueuePool,
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'pool_recycle': self.pool_recycle,
+            })
+        return options
+
+    def _sqlite_pragmas(self, dbapi_connection, connection_record):
+        """
+        Applies the concurrent profile to a new SQLite connection
+        """
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL is a property of the file, the rest only last for the connection
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute('PRAGMA busy_timeout=%d' % self.sqlite_busy_timeout)
+            cursor.execute('PRAGMA cache_size=%d' % -self.sqlite_cache_size)
+            cursor.execute('PRAGMA mmap_size=%d' % self.sqlite_mmap_size)
+        finally:
+            cursor.close()
+
+    def engine(self, db_url):
+        """
+        Gets the pooled engine for a database, creating it on first use
+        :param db_url: The URL to the database, e.g. ``sqlite:///lti.db``
+        :return: A SQLAlchemy Engine
+        """
+        engine = self._engines.get(db_url)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(db_url)
+            if engine is None:
+                self.log.debug('Creating engine for %s' % repr(make_url(db_url)))
+                engine = create_engine(db_url, **self._engine_options(db_url))
+                event.listen(engine, 'before_cursor_execute', count_query)
+                url = make_url(db_url)
+                if (self.sqlite_profile == 'concurrent' and url.get_backend_name() == 'sqlite'
+                        and url.database not in (None, '', ':memory:')):
+                    event.listen(engine, 'connect', self._sqlite_pragmas)
+                self._engines[db_url] = engine
+            return engine
+
+    def ensure_schema(self, db_url, metadata):
+        """
+        Creates the tables in ``metadata``, and any of their indexes, that don't already
+        exist.  This only talks to the database the first time it is called for a URL
+        and metadata.
+        """
+        key = (db_url, id(metadata))
+        if key in self._schemas:
+            return
+        with self._lock:
+            if key in self._schemas:
+                return
+            engine = self.engine(db_url)
+            metadata.create_all(bind=engine)
+            # create_all leaves tables that already exist alone, so indexes added
+            # since the table was first created have to be created separately
+            for table in metadata.sorted_tables:
+                for index in table.indexes:
+                    try:
+                        index.create(bind=engine, checkfirst=True)
+                    except SQLAlchemyError as e:
+                        self.log.warning('Could not create index %s: %s' % (index.name, e))
+            self._schemas.add(key)
+
+    def session(self, db_url, metadata=None):
+        """
+        Gets the thread-local session factory for a database
+        :param db_url: The URL to the database, e.g. ``sqlite:///lti.db``
+        :param metadata: If given, the tables in it are created on first use
+        :return: A ``scoped_session`` bound to the pooled engine
+        """
+        if metadata is not None:
+            self.ensure_schema(db_url, metadata)
+        session = self._sessions.get(db_url)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(db_url)
+            if session is None:
+                session = scoped_session(sessionmaker(autoflush=True, bind=self.engine(db_url)))
+                self._sessions[db_url] = session
+            return session
+
+    def dispose(self):
+        """
+        Closes every session and pooled connection, e.g. at shutdown or between tests
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.remove()
+            for engine in self._engines.values():
+                engine.dispose()
+            self._sessions.clear()
+            self._engines.clear()
+            self._schemas.clear()
+
+
+def get_session(db_url, metadata=None):
+    """
+    Shortcut for ``EngineRegistry.instance().session(db_url, metadata)``
+    """
+    return EngineRegistry.instance().session(db_url, metadata)
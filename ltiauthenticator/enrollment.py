@@ -0,0 +1,219 @@
+"""
+Background enrollment of students into nbgrader.
+
+``NBGraderAuthenticator.pre_spawn_start`` puts an enrollment record on a DurableQueue
+instead of the spawned server running ``enroll.py``.  A single long-running worker,
+started with ``lti-enrollment-worker``, leases the records in batches and writes each
+course's students to the Gradebook in one transaction, then adds them to the
+JupyterHub groups.  Records are only acknowledged once all of that has succeeded, so
+a crash part way through means the batch is applied again, which is harmless.
+
+    lti-enrollment-worker --queue sqlite:///enrollment.db --gradebook sqlite:///gradebook.db
+"""
+import argparse
+import logging
+import os
+import signal
+import time
+from collections import OrderedDict
+
+from traitlets import Unicode, Integer, Float, default
+from traitlets.config import LoggingConfigurable
+
+from .durable_queue import DurableQueue
+
+QUEUE_NAME = 'enrollment'
+STUDENT = 'student'
+INSTRUCTOR = 'instructor'
+
+
+def enrollment_record(unix_name, course, first_name='', last_name='', role=STUDENT):
+    """
+    :return: The payload queued for one enrollment
+    """
+    return {
+        'unix_name': unix_name,
+        'course': course,
+        'first_name': first_name,
+        'last_name': last_name,
+        'role': role,
+    }
+
+
+def enrollment_queue(db_url):
+    return DurableQueue(db_url, QUEUE_NAME)
+
+
+class EnrollmentWorker(LoggingConfigurable):
+
+    queue_url = Unicode(
+        help="URL of the database holding the enrollment queue.  Defaults to ENROLLMENT_QUEUE_DB"
+    ).tag(config=True)
+
+    @default('queue_url')
+    def _queue_url_default(self):
+        return os.environ.get('ENROLLMENT_QUEUE_DB', 'sqlite:///enrollment.db')
+
+    gradebook_url = Unicode(
+        help="URL of the nbgrader Gradebook database.  Defaults to GRADEBOOK_DB"
+    ).tag(config=True)
+
+    @default('gradebook_url')
+    def _gradebook_url_default(self):
+        return os.environ.get('GRADEBOOK_DB', 'sqlite:///gradebook.db')
+
+    batch_size = Integer(
+        200,
+        help="The most enrollments leased and applied together"
+    ).tag(config=True)
+
+    lease_seconds = Integer(
+        120,
+        help="Seconds a leased batch has to be applied before it is handed out again"
+    ).tag(config=True)
+
+    poll_interval = Float(
+        1.0,
+        help="Seconds to wait when the queue is empty before looking again"
+    ).tag(config=True)
+
+    retry_delay = Float(
+        30.0,
+        help="Seconds before a batch that failed is tried again"
+    ).tag(config=True)
+
+    def __init__(self, queue=None, authenticator=None, **kwargs):
+        """
+        :param queue: The DurableQueue to work from.  Defaults to one at queue_url
+        :param authenticator: The nbgrader Authenticator used to add users to the JupyterHub
+            groups.  Defaults to a SubAuthenticator with SubAuthPlugin
+        """
+        super().__init__(**kwargs)
+        self.queue = queue or enrollment_queue(self.queue_url)
+        self._authenticator = authenticator
+        # course -> open Gradebook, kept for the life of the worker
+        self._gradebooks = {}
+        self._stopping = False
+        self.applied = 0
+        self.failed = 0
+
+    @property
+    def authenticator(self):
+        if self._authenticator is None:
+            from traitlets.config import Config
+            from .nbgrader import SubAuthenticator, SubAuthPlugin
+            config = Config()
+            config.Authenticator.plugin_class = SubAuthPlugin
+            self._authenticator = SubAuthenticator(config=config)
+        return self._authenticator
+
+    def gradebook(self, course):
+        gradebook = self._gradebooks.get(course)
+        if gradebook is None:
+            from nbgrader.api import Gradebook
+            gradebook = Gradebook(self.gradebook_url, course, self.authenticator)
+            self._gradebooks[course] = gradebook
+        return gradebook
+
+    def apply_course(self, course, records):
+        """
+        Adds or updates the students of one course in a single Gradebook transaction,
+        then queues their group memberships
+        :param records: The enrollment records for the course, at most one per unix_name
+        """
+        from nbgrader.api import Student
+
+        gradebook = self.gradebook(course)
+        db = gradebook.db
+        try:
+            existing = dict((student.id, student) for student in
+                            db.query(Student).filter(Student.id.in_(list(records))))
+            for unix_name, record in records.items():
+                student = existing.get(unix_name)
+                if student is None:
+                    db.add(Student(id=unix_name, first_name=record['first_name'],
+                                   last_name=record['last_name'], email=''))
+                else:
+                    student.first_name = record['first_name']
+                    student.last_name = record['last_name']
+            db.commit()
+        except:
+            db.rollback()
+            raise
+
+        for unix_name, record in records.items():
+            self.authenticator.add_student_to_course(unix_name, course)
+            if record['role'] == INSTRUCTOR:
+                self.authenticator.add_grader_to_course(unix_name, course)
+
+    def process_batch(self):
+        """
+        Leases and applies one batch of enrollments
+        :return: The number of enrollments leased
+        """
+        items = self.queue.lease(self.batch_size, self.lease_seconds)
+        if not items:
+            return 0
+
+        courses = OrderedDict()
+        for _, record in items:
+            # Later records for the same user replace earlier ones
+            courses.setdefault(record['course'], OrderedDict())[record['unix_name']] = record
+
+        ids = [item_id for item_id, _ in items]
+        try:
+            for course, records in courses.items():
+                self.apply_course(course, records)
+            # Raises if any membership couldn't be sent, so the batch is released, not acknowledged
+            self.authenticator.plugin.flush_groups(raise_errors=True)
+        except Exception:
+            self.log.exception('Enrollment of %d records failed, retrying in %ds' % (len(ids), self.retry_delay))
+            self.failed += len(ids)
+            self.queue.release(ids, self.retry_delay)
+            return len(ids)
+
+        self.queue.ack(ids)
+        self.applied += len(ids)
+        self.log.info('Enrolled %d records across %d courses' % (len(ids), len(courses)))
+        return len(ids)
+
+    def run(self, once=False):
+        """
+        Applies batches until stopped, or until the queue is empty if ``once``
+        """
+        while not self._stopping:
+            if self.process_batch():
+                continue
+            if once:
+                break
+            time.sleep(self.poll_interval)
+        self.close()
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def close(self):
+        for gradebook in self._gradebooks.values():
+            gradebook.close()
+        self._gradebooks.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply queued enrollments to the nbgrader Gradebook')
+    parser.add_argument('--queue', default=os.environ.get('ENROLLMENT_QUEUE_DB', 'sqlite:///enrollment.db'),
+                        help="Enrollment queue database URL")
+    parser.add_argument('--gradebook', default=os.environ.get('GRADEBOOK_DB', 'sqlite:///gradebook.db'),
+                        help="nbgrader Gradebook database URL")
+    parser.add_argument('--batch-size', type=int, default=200, help="Enrollments applied per transaction")
+    parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    worker = EnrollmentWorker(queue_url=args.queue, gradebook_url=args.gradebook, batch_size=args.batch_size)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(once=args.once)
+
+
+if __name__ == '__main__':
+    main()
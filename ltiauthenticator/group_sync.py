@@ -0,0 +1,190 @@
+"""
+Coalesced JupyterHub group membership updates for the nbgrader plugin.
+
+The membership of every group is read from the Hub once and kept in memory, and is
+kept up to date with the changes made through this class, so users who are already
+in a group cost no API call at all.  Users still to be added are queued per group
+and sent together, in one ``POST /groups/{name}/users``, when the queue is flushed a
+short while after the first one arrives.  Batches for different groups are sent
+concurrently over the pooled connections of a HubAPIClient.  Users whose batch could
+not be sent are queued again, so a Hub outage delays memberships but never loses them.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from .hub_client import HubAPIClient, HubAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class GroupSync(object):
+
+    def __init__(self, query=None, refresh_interval=300, flush_delay=0.5, max_parallel=None, retry_delay=5.0):
+        """
+        :param query: Called as ``query(method, api_path, post_data=None)`` to talk to the Hub
+            API, returning the decoded JSON and raising HubAPIError on failure.  Defaults to a
+            HubAPIClient configured from the environment
+        :param refresh_interval: Seconds before the cached memberships are read from the Hub again
+        :param flush_delay: Seconds to wait after the first queued user before sending the batch.
+            0 or less means batches are only sent by calling ``flush``
+        :param max_parallel: The most groups sent to the Hub at once by ``flush``.  Defaults to
+            the client's ``max_concurrency``, or 1 for any other ``query``
+        :param retry_delay: Seconds before users that could not be sent are tried again, when
+            batches are sent on a timer
+        """
+        self.query = query or HubAPIClient()
+        self.max_parallel = max_parallel or getattr(self.query, 'max_concurrency', 1)
+        self.refresh_interval = refresh_interval
+        self.flush_delay = flush_delay
+        self.retry_delay = retry_delay
+        self.api_calls = 0
+        self._lock = threading.RLock()
+        # group name -> set of user names, or None when not loaded
+        self._groups = None
+        self._loaded_at = 0
+        # group name -> set of user names waiting to be added, in arrival order
+        self._pending = OrderedDict()
+        self._timer = None
+
+    def _call(self, method, api_path, post_data=None):
+        with self._lock:
+            self.api_calls += 1
+        return self.query(method, api_path, post_data=post_data)
+
+    def refresh(self):
+        """
+        Reads every group and its members from the Hub
+        """
+        groups = self._call('GET', '/groups')
+        with self._lock:
+            self._groups = dict((group['name'], set(group.get('users') or ())) for group in groups)
+            self._loaded_at = time.monotonic()
+
+    def _index(self):
+        if self._groups is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.refresh()
+        return self._groups
+
+    def members(self, group):
+        """
+        :return: The set of users in a group, or None if the group does not exist
+        """
+        with self._lock:
+            members = self._index().get(group)
+            return None if members is None else set(members)
+
+    def add(self, group, user):
+        """
+        Queues a user to be added to a group, creating the group if needed.  Nothing is
+        queued if the user is already known to be in the group.  If the memberships can't
+        be read from the Hub the user is queued anyway.
+        :return: True if the user was queued
+        """
+        with self._lock:
+            try:
+                members = self._index().get(group, ())
+            except HubAPIError as e:
+                logger.warning('Could not read the Jupyterhub groups, queueing %s for %s: %s' % (user, group, e))
+                members = ()
+            if user in members:
+                logger.debug('%s is already in %s' % (user, group))
+                return False
+            self._pending.setdefault(group, set()).add(user)
+            self._schedule(self.flush_delay)
+        return True
+
+    def _schedule(self, delay):
+        # Call with the lock held
+        if self.flush_delay > 0 and self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _requeue(self, group, users):
+        """
+        Puts users that could not be sent back in the queue
+        """
+        with self._lock:
+            self._pending.setdefault(group, set()).update(users)
+            self._schedule(self.retry_delay)
+
+    def pending(self):
+        """
+        :return: The number of users waiting to be added
+        """
+        with self._lock:
+            return sum(len(users) for users in self._pending.values())
+
+    def flush(self, raise_errors=False):
+        """
+        Sends every queued user to the Hub, one request per group, with up to
+        ``max_parallel`` groups in flight at once.  Users of groups that fail are queued again.
+        :param raise_errors: Raise HubAPIError if any group failed, rather than only logging it
+        :return: The number of users added
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, OrderedDict()
+            if not batch:
+                return 0
+            try:
+                groups = self._index()
+            except HubAPIError as e:
+                logger.error('Could not read the Jupyterhub groups, %d groups will be tried again: %s'
+                             % (len(batch), e))
+                for group, users in batch.items():
+                    self._requeue(group, users)
+                if raise_errors:
+                    raise
+                return 0
+
+        items = [(group, sorted(users)) for group, users in batch.items()]
+        if self.max_parallel > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(items))) as pool:
+                results = list(pool.map(lambda item: self._send(groups, *item), items))
+        else:
+            results = [self._send(groups, group, users) for group, users in items]
+
+        errors = [error for _, error in results if error is not None]
+        if errors and raise_errors:
+            raise HubAPIError('%d of %d groups could not be updated: %s' % (len(errors), len(items), errors[0]),
+                              errors[0].status)
+        return sum(added for added, _ in results)
+
+    def _send(self, groups, group, users):
+        """
+        Adds users to one group, creating it first if the Hub does not have it.  If that
+        fails the users are queued again.
+        :return: A tuple of (the number of users added, the HubAPIError or None)
+        """
+        try:
+            if group not in groups:
+                try:
+                    self._call('POST', '/groups/{name}'.format(name=group))
+                    logger.info("Jupyterhub group: {group_name} created.".format(group_name=group))
+                except HubAPIError as e:
+                    # 409 Conflict: the group exists already, e.g. another worker has just created it
+                    if e.status != 409:
+                        raise
+                    logger.debug('Jupyterhub group %s already exists' % group)
+                with self._lock:
+                    groups.setdefault(group, set())
+            self._call('POST', '/groups/{name}/users'.format(name=group), post_data={'users': users})
+        except HubAPIError as e:
+            logger.error('Users %s NOT added to the Jupyterhub group %s: %s' % (', '.join(users), group, e))
+            logger.error("Make sure you set a valid admin_user 'api_token' in your config file "
+                         "before starting the service")
+            with self._lock:
+                # Our picture of the Hub may be wrong, so read it again next time
+                self._groups = None
+            self._requeue(group, users)
+            return 0, e
+        with self._lock:
+            groups.setdefault(group, set()).update(users)
+        logger.info('Added %d users to the Jupyterhub group %s' % (len(users), group))
+        return len(users), None
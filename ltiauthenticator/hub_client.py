@@ -0,0 +1,120 @@
+"""
+Pooled HTTP client for the JupyterHub REST API.
+
+Requests go over a small pool of keep-alive connections instead of opening a new one
+each time, are retried with exponential backoff on connection errors and 5xx
+responses, and time out rather than hang.  The same client can be used from plain
+code with ``request`` or from asyncio with ``request_async``, which runs requests
+concurrently up to a configurable limit.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def pooled_session(pool_size=4, retries=3, backoff=0.2, pool_connections=1):
+    """
+    A requests Session keeping up to ``pool_size`` keep-alive connections per host, which
+    retries connection errors and 5xx responses, for every method, with exponential backoff
+    :param backoff: Retries wait ``backoff * 2 ** (retry - 1)`` seconds
+    :param pool_connections: How many hosts to keep pools for
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=None, raise_on_status=False)
+    # pool_block stops a pool growing past pool_size when requests run concurrently
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size, pool_block=True,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HubAPIError(Exception):
+    """
+    Raised when the Hub API cannot be reached or answers with an error status
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class HubAPIClient(object):
+
+    def __init__(self, api_url=None, token=None, pool_size=4, max_concurrency=8, timeout=10.0,
+                 retries=3, backoff=0.2):
+        """
+        :param api_url: The Hub API URL.  Defaults to ``JUPYTERHUB_API_URL``
+        :param token: An API token with access to the groups.  Defaults to ``JUPYTERHUB_API_TOKEN``
+        :param pool_size: The most connections kept open to the Hub
+        :param max_concurrency: The most requests in flight at once from ``request_async``
+        :param timeout: Seconds to wait to connect, and then for each read
+        :param retries: How many times to retry after a connection error or a 5xx response
+        :param backoff: Retries wait ``backoff * 2 ** (retry - 1)`` seconds
+        """
+        self.api_url = (api_url or os.environ.get('JUPYTERHUB_API_URL') or 'http://127.0.0.1:8081/hub/api').rstrip('/')
+        token = token or os.environ.get('JUPYTERHUB_API_TOKEN', '')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+
+        self.session = pooled_session(pool_size, retries, backoff)
+        self.session.headers['Authorization'] = 'token %s' % token
+        self._executor = None
+        self._semaphores = {}
+
+    def request(self, method, api_path, post_data=None):
+        """
+        Makes a request to the Hub API, blocking until it completes
+        :param method: The HTTP method, e.g. GET or POST
+        :param api_path: The path relative to the API URL, e.g. ``/groups``
+        :param post_data: An object to send as the JSON body
+        :return: The decoded JSON response, or None if it was empty
+        """
+        try:
+            response = self.session.request(method, self.api_url + api_path, json=post_data, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise HubAPIError('JupyterhubAPI request to %s failed: %s' % (api_path, e))
+        if not response.ok:
+            raise HubAPIError('JupyterhubAPI returned a status code of: %d for api_path: %s'
+                              % (response.status_code, api_path), response.status_code)
+        return response.json() if response.content else None
+
+    def __call__(self, method, api_path, post_data=None):
+        return self.request(method, api_path, post_data)
+
+    async def request_async(self, method, api_path, post_data=None):
+        """
+        The same as ``request``, but awaitable.  At most ``max_concurrency`` requests
+        are in flight at once, sharing the pooled connections.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='hub-api')
+        async with semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(self.request, method, api_path, post_data))
+
+    async def request_many(self, calls):
+        """
+        Makes many requests concurrently
+        :param calls: A list of (method, api_path, post_data) tuples
+        :return: A list of the responses, or of the HubAPIError for each that failed, in the same order
+        """
+        return await asyncio.gather(*(self.request_async(*call) for call in calls), return_exceptions=True)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
@@ -0,0 +1,97 @@
+"""
+A parsed LTI launch request.
+
+The form body of a launch is decoded and parsed exactly once, and the result is
+passed to signature validation, user mapping, the session upsert and the auth_state,
+instead of each of them reading the request again.
+"""
+from urllib.parse import parse_qsl
+
+INSTRUCTOR_ROLES = ('TEACHINGASSISTANT', 'INSTRUCTOR', 'CONTENTDEVELOPER')
+
+
+class LaunchRequest(object):
+
+    # The LTI fields read during a launch, each stored in its own slot
+    FIELDS = (
+        'user_id',
+        'roles',
+        'custom_course',
+        'custom_admin',
+        'lis_person_name_given',
+        'lis_person_name_family',
+        'lis_result_sourcedid',
+        'lis_outcome_service_url',
+        'resource_link_id',
+        'oauth_consumer_key',
+        'oauth_timestamp',
+        'oauth_nonce',
+    )
+
+    __slots__ = ('method', 'headers', 'params', 'db_queries', 'malformed') + FIELDS
+
+    def __init__(self, body, method='POST', headers=None):
+        """
+        :param body: The form-encoded body, as bytes or str
+        :param method: The HTTP method, needed for the signature
+        :param headers: The request headers, needed for the signature
+        """
+        # A body that isn't UTF-8 can't be a genuine launch.  It is treated as one with no
+        # parameters, which fails validation, rather than raising out of the handler
+        self.malformed = False
+        if isinstance(body, bytes):
+            try:
+                body = body.decode('utf-8')
+            except UnicodeDecodeError:
+                self.malformed = True
+                body = ''
+        self.method = method
+        self.headers = headers or {}
+        # Database queries made on behalf of this launch, for the metrics
+        self.db_queries = 0
+        # oauthlib takes the already-parsed pairs, so it does not parse the body again
+        self.params = parse_qsl(body, keep_blank_values=True)
+        for field in self.FIELDS:
+            setattr(self, field, '')
+        fields = set(self.FIELDS)
+        for name, value in self.params:
+            if name in fields:
+                # Like RequestHandler.get_argument, the last value wins
+                setattr(self, name, value.strip())
+
+    @classmethod
+    def from_handler(cls, handler):
+        """
+        Gets the launch for a request, parsing it the first time it is asked for
+        :param handler: A Tornado RequestHandler
+        """
+        launch = getattr(handler, '_lti_launch', None)
+        if launch is None:
+            request = handler.request
+            launch = cls(request.body, request.method, request.headers)
+            handler._lti_launch = launch
+        return launch
+
+    @property
+    def is_instructor(self):
+        """
+        True if the roles include a teaching role: TeachingAssistant, Instructor or ContentDeveloper
+        """
+        roles = self.roles.upper()
+        return any(role in roles for role in INSTRUCTOR_ROLES)
+
+    def validate(self, endpoint, url):
+        """
+        Checks the OAuth signature, timestamp and nonce
+        :param endpoint: An oauthlib SignatureOnlyEndpoint
+        :param url: The URL the launch was sent to, as the consumer saw it
+        :return: True if the launch is genuine
+        """
+        if self.malformed:
+            return False
+        valid, _ = endpoint.validate_request(url, self.method, self.params, self.headers)
+        return valid
+
+    def __repr__(self):
+        return 'LaunchRequest(<user_id: %s oauth_consumer_key: %s resource_link_id: %s>)' \
+            % (self.user_id, self.oauth_consumer_key, self.resource_link_id)
@@ -5,26 +5,28 @@ This does not implement OAuth 2.0, but rather uses the LTI standard.
 
 
 from tornado.auth import OAuthMixin
-from jupyterhub.auth import Authenticator, LocalAuthenticator
-from tornado import auth, gen, web
+from tornado import gen, web
 from jupyterhub.handlers import BaseHandler
 from jupyterhub.auth import LocalAuthenticator
 
-from traitlets import Unicode, Dict
-from .lti_validator import LTIValidator
+from traitlets import Unicode, Integer, Float, Bool, List, default
+from .admission import AdmissionController, Overloaded
+from .db_executor import DBExecutor
+from .engines import EngineRegistry, get_session
+from .launch import LaunchRequest
+from .lti_validator import LTIValidator, get_nonce_cache, get_credentials
+from .metrics import LaunchMetrics, call_counting_queries
+from .pruning import NoncePruner
+from .routing import begin_request, end_request
+from .singleflight import SingleFlight
 from .lti_db import LtiDB
+from .sharding import env_shard_urls, open_lti_db
 from oauthlib.oauth1 import SignatureOnlyEndpoint
 
-from oauthenticator.oauth2 import OAuthenticator, OAuthLoginHandler
-import requests
+from oauthenticator.oauth2 import OAuthenticator
 from jupyterhub.utils import url_path_join
-from lti import ToolProvider
 import os
-import pwd, grp
-import json
-
-connection_string = os.environ.get('LTI_DB', 'sqlite:///lti.db')
-db = LtiDB(connection_string)
+import time
 
 class LTIMixin(OAuthMixin):
     _OAUTH_VERSION = '1.0a'
@@ -36,20 +38,57 @@ class LTILoginHandler(BaseHandler):
     @gen.coroutine
     def post(self, *args, **kwargs):
         # TODO: Check if state argument needs to be checked
-        username = yield self.authenticator.get_authenticated_user(self, None)
+        admission = self.authenticator.admission
+        try:
+            yield admission.acquire()
+        except Overloaded as e:
+            self.log.warning('Shedding LTI launch: %s' % e)
+            self.set_status(503)
+            self.set_header('Retry-After', str(e.retry_after))
+            self.finish('<h1>Busy</h1><p>Too many people are logging in right now.  Please try again in a '
+                        'few seconds.</p>')
+            return
+
+        metrics = self.authenticator.metrics
+        launch = scope = None
+        # Everything after the slot is taken is inside the try, so the slot is always given back
+        try:
+            launch = LaunchRequest.from_handler(self)
+            # Reads may use a replica until the launch writes, see routing
+            scope = begin_request()
+            yield self._login(launch, metrics)
+        finally:
+            if scope is not None:
+                end_request(scope)
+            admission.release()
+            if launch is not None:
+                metrics.launch_finished(launch.db_queries)
+
+    @gen.coroutine
+    def _login(self, launch, metrics):
+        # login_user authenticates the request itself.  Authenticating it twice
+        # would have the second attempt rejected as a replay of the first nonce.
+        start = time.perf_counter()
         user = yield self.login_user()
+        metrics.observe('login_user', time.perf_counter() - start)
         self.log.debug('Got user from self.login_user %s' % user)
 
         if user:
-            params = self._get_lti_params()
-            self.log.debug('params %s' % str(params))
-            db.add_or_update_user_session(
-                key=params['oauth_consumer_key'],
-                user_id=params['user_id'],
-                lis_result_sourcedid=params.get('lis_result_sourcedid', ''),
-                lis_outcome_service_url=params['lis_outcome_service_url'],
-                resource_link_id=params['resource_link_id']
+            self.log.debug('launch %s' % launch)
+            start = time.perf_counter()
+            # Duplicate launches arriving together store the same session, so only one of them writes it
+            session = ('session', launch.oauth_consumer_key, launch.user_id, launch.resource_link_id,
+                       launch.lis_result_sourcedid, launch.lis_outcome_service_url)
+            yield self.authenticator.single_flight.do(
+                session, self.authenticator.run_db,
+                launch, self.authenticator.lti_db.add_or_update_user_session,
+                key=launch.oauth_consumer_key,
+                user_id=launch.user_id,
+                lis_result_sourcedid=launch.lis_result_sourcedid,
+                lis_outcome_service_url=launch.lis_outcome_service_url,
+                resource_link_id=launch.resource_link_id
             )
+            metrics.observe('session_upsert', time.perf_counter() - start)
 
             # username = self._map_username(username, assessment)
             self.log.debug('user: %s' % user)
@@ -81,71 +120,285 @@ class LTILoginHandler(BaseHandler):
                    '<p>You have been logged out, although your server may remain running for a few minutes. If you '
                    'wish to log in again, you will have to do so through the Canvas "Assignments page"</p>')
 
-    def _get_lti_params(self):
-        """
-        This method gets the parameters needed to create a proper ToolProvider
-        :param handler: A Tornado request
-        :return: A dictionary in the form {param_name: param_value, ....}
-        """
-        params = {}
-        lti_params = [
-            'lis_result_sourcedid',
-            'lis_outcome_service_url',
-            'resource_link_id',
-            'user_id',
-            'oauth_consumer_key'
-        ]
 
-        for lti in lti_params:
-            arg = self.get_argument(lti, False, True)
-            if arg:
-                params[lti] = arg
-                self.log.debug('Arg %s: %s' % (lti, arg))
-            else:
-                self.log.warning('Arg %s does not exist' % lti)
-        return params
+class LTIMetricsHandler(BaseHandler):
+    """
+    Serves the launch metrics in the Prometheus text format
+    """
+
+    def get(self):
+        if self.authenticator.metrics_require_admin:
+            user = self.current_user
+            if user is None or not user.admin:
+                raise web.HTTPError(403)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.authenticator.metrics.render())
 
 
 class LTIAuthenticator(OAuthenticator):
     login_handler = LTILoginHandler
+    _nonce_pruner = None
+    _db_executor = None
+    _signature_endpoint = None
+    _metrics = None
+    _admission = None
+    _single_flight = None
 
-    def _authenticate(self, handler, data=None):
-        self.log.debug("calling authenticate in LTIAuthenticator\n")
-        validator = LTIValidator()
-        signature_authenticate = SignatureOnlyEndpoint(validator)
+    db_thread_pool_size = Integer(
+        4,
+        help="Number of threads used to run database queries off the IOLoop"
+    ).tag(config=True)
+
+    metrics_require_admin = Bool(
+        True,
+        help="Only serve /hub/lti/metrics to admin users.  Disable to let Prometheus scrape it without a token"
+    ).tag(config=True)
+
+    admission_max_in_flight = Integer(
+        32,
+        help="The most LTI launches processed at once.  0 admits every launch straight away"
+    ).tag(config=True)
+
+    admission_max_queued = Integer(
+        128,
+        help="The most launches waiting for one of the admission_max_in_flight slots.  Launches "
+             "beyond that are turned away with a 503 and a Retry-After header"
+    ).tag(config=True)
+
+    admission_queue_timeout = Float(
+        10.0,
+        help="Seconds a launch waits for a slot before it is turned away"
+    ).tag(config=True)
+
+    admission_retry_after = Integer(
+        5,
+        help="Seconds clients that are turned away are told to wait before trying again"
+    ).tag(config=True)
+
+    lti_db_url = Unicode(
+        help="URL of the database holding users, courses, sessions and consumer keys.  Defaults to LTI_DB"
+    ).tag(config=True)
+
+    @default('lti_db_url')
+    def _lti_db_url_default(self):
+        return os.environ.get('LTI_DB', 'sqlite:///lti.db')
+
+    lti_db_replica_urls = List(
+        Unicode(),
+        help="URLs of read replicas of lti_db_url.  Launch reads go to them until the launch writes "
+             "something.  Cannot be combined with lti_db_shard_urls.  Defaults to the comma separated LTI_DB_REPLICAS"
+    ).tag(config=True)
+
+    @default('lti_db_replica_urls')
+    def _lti_db_replica_urls_default(self):
+        return [url.strip() for url in os.environ.get('LTI_DB_REPLICAS', '').split(',') if url.strip()]
+
+    lti_db_shard_urls = List(
+        Unicode(),
+        help="URLs of further databases to spread the users across, along with lti_db_url, which also "
+             "keeps the consumer keys and unix name counter.  Users are placed by each shard's position "
+             "in the list, so new shards go at the end.  Run lti-maintenance rebalance before "
+             "changing this.  Defaults to the comma separated LTI_DB_SHARDS"
+    ).tag(config=True)
+
+    @default('lti_db_shard_urls')
+    def _lti_db_shard_urls_default(self):
+        return env_shard_urls()
+
+    nonces_db_url = Unicode(
+        help="URL of the database holding the nonces of recent launches.  Defaults to NONCES_DB"
+    ).tag(config=True)
+
+    @default('nonces_db_url')
+    def _nonces_db_url_default(self):
+        return os.environ.get('NONCES_DB', 'sqlite:///timestamp.db')
+
+    merge_sqlite_stores = Bool(
+        False,
+        help="Keep the nonces in the LTI database rather than nonces_db_url, when that is a SQLite "
+             "file.  One file means one WAL and one connection pool instead of two.  Databases created "
+             "before sessions moved to user_session must first be migrated with "
+             "lti-maintenance migrate-sessions --drop-legacy"
+    ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # c.EngineRegistry settings, such as the SQLite profile, apply to the engines created from here on
+        EngineRegistry.instance().update_config(self.config)
+        if self.lti_db_shard_urls:
+            if self.lti_db_replica_urls:
+                raise ValueError('lti_db_replica_urls are the replicas of a single LTI database, '
+                                 'and cannot be used with lti_db_shard_urls')
+            self.lti_db = open_lti_db(self.lti_db_url, self.lti_db_shard_urls)
+        else:
+            self.lti_db = LtiDB(self.lti_db_url, replica_urls=self.lti_db_replica_urls)
+        if self.nonce_store_url == self.lti_db_url:
+            self._check_mergeable()
+
+    def _check_mergeable(self):
+        """
+        Refuses to keep the nonces, merged or configured so, in an LTI database whose ``nonces`` table still holds
+        the user sessions of older versions, which the nonce table can't be created over
+        """
+        from .maintenance import legacy_session_table
+        if legacy_session_table(get_session(self.lti_db_url).get_bind()) is not None:
+            raise ValueError('merge_sqlite_stores is set, but the nonces table in %s still holds legacy user '
+                             'sessions.  Run lti-maintenance migrate-sessions --db %s --drop-legacy first'
+                             % (self.lti_db_url, self.lti_db_url))
+
+    @property
+    def nonce_cache(self):
+        return get_nonce_cache(self.nonce_store_url)
+
+    @property
+    def nonce_store_url(self):
+        """
+        Where the nonces are kept: the LTI database if merge_sqlite_stores applies, otherwise nonces_db_url
+        """
+        if self.merge_sqlite_stores and self.lti_db_url.startswith('sqlite:'):
+            return self.lti_db_url
+        return self.nonces_db_url
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            metrics = LaunchMetrics()
+            metrics.add_collector('user_cache_hits_total', 'counter', 'User lookups served from the cache',
+                                  lambda: self.lti_db.counters()['user_cache_hits'])
+            metrics.add_collector('user_cache_misses_total', 'counter', 'User lookups that went to the database',
+                                  lambda: self.lti_db.counters()['user_cache_misses'])
+            metrics.add_collector('session_writes_avoided_total', 'counter',
+                                  'Launches whose outcome details were already stored',
+                                  lambda: self.lti_db.counters()['session_writes_avoided'])
+            metrics.add_collector('course_writes_avoided_total', 'counter',
+                                  'Launches whose user was already enrolled on the course',
+                                  lambda: self.lti_db.counters()['course_writes_avoided'])
+            metrics.add_collector('db_primary_reads_total', 'counter', 'LtiDB reads served by the primary',
+                                  lambda: self.lti_db.counters()['primary_reads'])
+            metrics.add_collector('db_replica_reads_total', 'counter', 'LtiDB reads served by a read replica',
+                                  lambda: self.lti_db.counters()['replica_reads'])
+            metrics.add_collector('nonce_cache_entries', 'gauge', 'Nonces held in the replay cache',
+                                  lambda: len(self.nonce_cache))
+            metrics.add_collector('launches_coalesced_total', 'counter',
+                                  'Duplicate launches that shared the user mapping or session write of another',
+                                  lambda: self.single_flight.shared)
+            admission = self.admission
+            metrics.add_collector('admission_admitted_total', 'counter', 'Launches let in to be processed',
+                                  lambda: admission.admitted)
+            metrics.add_collector('admission_queued_total', 'counter', 'Launches that had to wait for a slot',
+                                  lambda: admission.queued)
+            metrics.add_collector('admission_shed_total', 'counter', 'Launches turned away with a 503',
+                                  lambda: admission.shed)
+            metrics.add_collector('admission_in_flight', 'gauge', 'Launches being processed',
+                                  lambda: admission.in_flight)
+            metrics.add_collector('admission_waiting', 'gauge', 'Launches waiting for a slot',
+                                  lambda: admission.waiting)
+            self._metrics = metrics
+        return self._metrics
+
+    @property
+    def admission(self):
+        if self._admission is None:
+            self._admission = AdmissionController(self.admission_max_in_flight, self.admission_max_queued,
+                                                  self.admission_queue_timeout, self.admission_retry_after)
+        return self._admission
+
+    @property
+    def single_flight(self):
+        if self._single_flight is None:
+            self._single_flight = SingleFlight()
+        return self._single_flight
+
+    @property
+    def db_executor(self):
+        if self._db_executor is None:
+            self._db_executor = DBExecutor(self.db_thread_pool_size)
+        return self._db_executor
+
+    def _start_background_tasks(self):
+        """
+        Starts the periodic jobs, which need a running IOLoop, when the first launch arrives
+        """
+        if self._nonce_pruner is None:
+            self._nonce_pruner = NoncePruner(self.nonce_cache.nonces_db, parent=self)
+            self._nonce_pruner.start()
 
-        request = handler.request
-        body = request.body.decode('utf-8')
-        for p in body.split('&'):
-            self.log.debug('%s' % p)
-        self.log.debug('\nFinished self.log.debugging body.split\n')
+    @property
+    def signature_endpoint(self):
+        if self._signature_endpoint is None:
+            self._signature_endpoint = SignatureOnlyEndpoint(LTIValidator(
+                nonce_cache=self.nonce_cache, credentials=get_credentials(self.lti_db), metrics=self.metrics))
+        return self._signature_endpoint
+
+    def _authenticate(self, handler, data=None):
+        """
+        Checks the OAuth signature, timestamp and nonce of the launch
+        :return: The LaunchRequest if the launch is genuine, otherwise None
+        """
+        launch = LaunchRequest.from_handler(handler)
+        self.log.debug('Validating %s' % launch)
 
         # Since we're behind a proxy we need to hardcode the URL here for the signature
         url = '%s://%s/hub/login' % (os.environ.get('PROTO', 'http'), os.environ.get('DOMAIN', 'localhost'))
-        self.log.info('url: %s' % url)
-        x = signature_authenticate.validate_request(url, request.method, request.body.decode('utf-8'), request.headers)
-        self.log.debug("Authenticated? %s\n\n" % str(x[0]))
+        self.log.debug('url: %s' % url)
+        start = time.perf_counter()
+        valid = launch.validate(self.signature_endpoint, url)
+        self.metrics.observe('signature', time.perf_counter() - start)
+        self.log.debug("Authenticated? %s" % valid)
+        if not valid:
+            self.metrics.inc('signature_failures_total')
+            return None
+        return launch
 
-        if x[0]:
-            user = db.get_user(handler.get_argument("user_id"))
-            if not user:
-                user = db.add_user(handler.get_argument('user_id'))
-            return user
+    async def run_db(self, launch, fn, *args, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` on the db_executor, counting the queries it makes against the launch
+        """
+        result, queries = await self.db_executor.run(call_counting_queries, fn, *args, **kwargs)
+        launch.db_queries += queries
+        return result
 
-        return None
+    def _map_user(self, user_id, course_name=None):
+        """
+        Gets the user, creating them if they do not exist, and optionally adds them to a course.
+        This blocks on the database, so run it on the db_executor.
+        :return: The user's unix name
+        """
+        db = self.lti_db.for_user(user_id)
+        start = time.perf_counter()
+        user = db.lookup_user(user_id)
+        if user is None:
+            # add_user returns the existing user if another hub process has just created them
+            user = db.add_user(user_id)
+        self.metrics.observe('user_mapping', time.perf_counter() - start)
+        if course_name is not None:
+            start = time.perf_counter()
+            user = db.add_user_course(user_id, course_name, user)
+            self.metrics.observe('course_append', time.perf_counter() - start)
+        return user.unix_name
 
-    @gen.coroutine
-    def authenticate(self, handler, data=None):
-        user = self._authenticate(handler, data)
-        if user:
-            return user.unix_name
-        return None
+    async def map_launch_user(self, launch, course_name=None):
+        """
+        Maps the user of a genuine launch to their unix name, enrolling them on a course if given.
+        Duplicate launches of the same user that arrive while this is in progress share its result.
+        """
+        key = (launch.oauth_consumer_key, launch.user_id, course_name)
+        return await self.single_flight.do(key, self.run_db, launch, self._map_user, launch.user_id, course_name)
+
+    async def authenticate(self, handler, data=None):
+        self._start_background_tasks()
+        # Every copy of a launch has its signature and nonce checked, so a replay never shares a result
+        launch = self._authenticate(handler, data)
+        if launch is None:
+            return None
+        return await self.map_launch_user(launch)
 
     def get_handlers(self, app):
         return [
             (r'/hub/login', self.login_handler),
             (r"/login", self.login_handler),
-            (r"/hub/oauth_login", self.login_handler)
+            (r"/hub/oauth_login", self.login_handler),
+            (r"/lti/metrics", LTIMetricsHandler)
         ]
 
 
@@ -1,5 +1,4 @@
-from pprint import pprint
-from subprocess import Popen, PIPE
+import threading
 
 from oauthlib.oauth1 import RequestValidator
 from sqlalchemy import (create_engine, ForeignKey, Column, String, Text,
@@ -8,21 +7,22 @@ from sqlalchemy.orm import sessionmaker, scoped_session, relationship, column_pr
 from sqlalchemy.orm.exc import NoResultFound, FlushError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.sql import and_
-from sqlalchemy import select, func, exists, case, literal_column
+from sqlalchemy import select, func, exists, case, literal_column, Index, bindparam
 from traitlets.config import LoggingConfigurable
-import os
-from nbgrader import api
-from nbgrader.api import InvalidEntry, Gradebook, Student
-from nbgrader.auth import Authenticator
-from ltiauthenticator.nbgrader import SubAuthPlugin, SubAuthenticator
-from traitlets.config import Config
-
-nbgrader_db = os.environ.get('GRADEBOOK_DB', 'sqlite:////home/instructor/gradebook.db')
+from .allocator import UnixNameAllocator
+from .dialects import insert_if_absent, missing_conflict_target, upsert
+from .engines import get_session
+from .routing import ReplicaSet, mark_write, replica_allowed
+from .user_cache import LRUCache, UserCache, UserRecord
+
 # Things for the timestamp and nonce validation
 Base = declarative_base()
 
+# The columns identifying a user session
+SESSION_INDEX = ['user_id', 'key', 'resource_link_id']
+
 
 class LtiUser(Base):
     """
@@ -34,8 +34,20 @@ class LtiUser(Base):
     unix_name = Column(String)
     courses = relationship('LtiUserCourse')
 
+    __table_args__ = (
+        Index('ix_usermap_unix_name', 'unix_name', unique=True),
+    )
+
+    @property
+    def course_names(self):
+        """
+        The names of the user's courses, for membership checks such as ``course in user.course_names``
+        """
+        return frozenset(c.course for c in self.courses)
+
     def __repr__(self):
-        return 'User(<user_id: %s unix_name: %s courses: "%s">)' % (self.user_id, self.unix_name, str(self.courses))
+        return 'User(<user_id: %s unix_name: %s courses: "%s">)' \
+            % (self.user_id, self.unix_name, ', '.join(sorted(self.course_names)))
 
 
 class LtiUserCourse(Base):
@@ -44,16 +56,31 @@ class LtiUserCourse(Base):
     user_id = Column(String, ForeignKey('usermap.user_id'))
     course = Column(String)
 
+    __table_args__ = (
+        # Databases from before this index may hold duplicates, which stop it being
+        # created until they are removed with ``lti-maintenance compact-courses``
+        Index('ix_user_course_user_id_course', 'user_id', 'course', unique=True),
+    )
+
 
 class LtiUserSession(Base):
-    __tablename__ = 'nonces'
+    """
+    The outcome service details of a user's latest launch of one resource link, i.e.
+    one assignment, needed to send their grade back to the consumer
+    """
+    __tablename__ = 'user_session'
 
     id = Column(Integer, autoincrement=True, primary_key=True)
-    key = Column(String)
-    user_id = Column(String)
+    key = Column(String, nullable=False, default='')
+    user_id = Column(String, nullable=False)
     lis_result_sourcedid = Column(String)
     lis_outcome_service_url = Column(String)
-    resource_link_id = Column(String)
+    resource_link_id = Column(String, nullable=False, default='')
+
+    __table_args__ = (
+        # user_id first, so a user's sessions can be found without the key and resource link
+        Index('ix_user_session_user_id_key_resource_link_id', 'user_id', 'key', 'resource_link_id', unique=True),
+    )
 
     def __repr__(self):
         return 'LtiUserSession(<key: %s, user_id %s, lis_result_sourcedid: %s, lis_outcome: %s resource_link_id: %s>)' \
@@ -71,88 +98,274 @@ class LtiKeySecret(Base):
         return '<KeySecret object %d>' % self.key_secret_id
 
 
+class LtiCounter(Base):
+    """
+    A named counter, incremented atomically to hand out unique numbers such as those in unix names
+    """
+    __tablename__ = 'counters'
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return 'LtiCounter(<name: %s value: %d>)' % (self.name, self.value)
+
+
+class SessionRecord(object):
+    """
+    A user session as read by the launch path, without the ORM's bookkeeping
+    """
+    __slots__ = ('key', 'user_id', 'lis_result_sourcedid', 'lis_outcome_service_url', 'resource_link_id')
+
+    def __init__(self, key, user_id, lis_result_sourcedid, lis_outcome_service_url, resource_link_id):
+        self.key = key
+        self.user_id = user_id
+        self.lis_result_sourcedid = lis_result_sourcedid
+        self.lis_outcome_service_url = lis_outcome_service_url
+        self.resource_link_id = resource_link_id
+
+    def __repr__(self):
+        return 'SessionRecord(<key: %s, user_id %s, lis_result_sourcedid: %s, lis_outcome: %s resource_link_id: %s>)' \
+            % (self.key, self.user_id, self.lis_result_sourcedid, self.lis_outcome_service_url, self.resource_link_id)
+
+
+# Core statements for the lookups every launch makes.  They are built once, so
+# SQLAlchemy compiles each of them once and reuses it from its statement cache, and
+# they return plain rows instead of ORM instances that go through the identity map.
+_usermap = LtiUser.__table__
+_user_course = LtiUserCourse.__table__
+_user_session = LtiUserSession.__table__
+
+# One row per course, or a single row with a NULL course if the user has none
+_USER_COURSES = select(_usermap.c.unix_name, _user_course.c.course) \
+    .select_from(_usermap.outerjoin(_user_course, _user_course.c.user_id == _usermap.c.user_id)) \
+    .where(_usermap.c.user_id == bindparam('user_id'))
+
+_ENROLLED = select(exists().where(_user_course.c.user_id == bindparam('user_id'),
+                                  _user_course.c.course == bindparam('course')))
+
+_SESSION_FINGERPRINT = select(_user_session.c.lis_result_sourcedid, _user_session.c.lis_outcome_service_url) \
+    .where(_user_session.c.key == bindparam('key'),
+           _user_session.c.user_id == bindparam('user_id'),
+           _user_session.c.resource_link_id == bindparam('resource_link_id')) \
+    .limit(1)
+
+
+def _latest_session(by_key, by_link):
+    stmt = select(_user_session.c.key, _user_session.c.user_id, _user_session.c.lis_result_sourcedid,
+                  _user_session.c.lis_outcome_service_url, _user_session.c.resource_link_id) \
+        .where(_user_session.c.user_id == bindparam('user_id'))
+    if by_key:
+        stmt = stmt.where(_user_session.c.key == bindparam('key'))
+    if by_link:
+        stmt = stmt.where(_user_session.c.resource_link_id == bindparam('resource_link_id'))
+    return stmt.order_by(_user_session.c.id.desc()).limit(1)
+
+
+# (filter by key, filter by resource link) -> statement
+_LATEST_SESSION = dict(((by_key, by_link), _latest_session(by_key, by_link))
+                       for by_key in (False, True) for by_link in (False, True))
+
+
 class LtiDB(LoggingConfigurable):
 
-    def __init__(self, db_url):
+    def __init__(self, db_url, unix_name_block_size=10, user_cache_size=10000, user_cache_ttl=3600,
+                 session_cache_ttl=300, replica_urls=None, allocator=None):
         """Initialize the connection to the database.
 
         Parameters
         ----------
         db_url : string
             The URL to the database, e.g. ``sqlite:///nonces.db``
+        unix_name_block_size : int
+            How many unix names this process reserves from the database at a time
+        user_cache_size : int
+            The most user mappings kept in memory by lookup_user
+        user_cache_ttl : int
+            Seconds a cached user mapping is trusted before being read again
+        session_cache_ttl : int
+            Seconds the stored outcome details of a session are trusted before being read
+            again.  Keep this short when several hubs write to the same database
+        replica_urls : list
+            URLs of read replicas of ``db_url``.  Reads made by a launch that hasn't
+            written anything yet are spread across them, see ``routing``
+        allocator : UnixNameAllocator
+            Hands out the unix names of new users.  Defaults to one reserving them from
+            this database, but the shards of a ShardedLtiDB share the designated shard's
 
         """
-        # create the connection to the database
-        engine = create_engine(db_url)
-        self.db = scoped_session(sessionmaker(autoflush=True, bind=engine))
+        # the engine, session and tables are shared by every LtiDB using this URL
+        self.db = get_session(db_url, Base.metadata)
+        # replicas are read only, so their schema is left to replication
+        self.replicas = ReplicaSet(get_session(url) for url in replica_urls or [])
+        self.reads = {'primary': 0, 'replica': 0}
+        self._reads_lock = threading.Lock()
+        self.allocator = allocator or UnixNameAllocator(self, block_size=unix_name_block_size)
+        self.user_cache = UserCache(user_cache_size, user_cache_ttl)
+        # (key, user_id, resource_link_id) -> (lis_result_sourcedid, lis_outcome_service_url) as stored
+        self.session_cache = LRUCache(user_cache_size, session_cache_ttl)
+        # Writes skipped because the database already held what the launch sent
+        self.writes_avoided = {'session': 0, 'course': 0}
+        self._writes_avoided_lock = threading.Lock()
+
+    def for_user(self, user_id):
+        """
+        :return: The LtiDB holding ``user_id``, which is this one unless it is sharded
+        """
+        return self
 
-        # this creates all the tables in the database if they don't already exist
-        Base.metadata.create_all(bind=engine)
+    def counters(self):
+        """
+        :return: A dict of the user cache, avoided write and read routing counters
+        """
+        return {
+            'user_cache_hits': self.user_cache.hits,
+            'user_cache_misses': self.user_cache.misses,
+            'session_writes_avoided': self.writes_avoided['session'],
+            'course_writes_avoided': self.writes_avoided['course'],
+            'primary_reads': self.reads['primary'],
+            'replica_reads': self.reads['replica'],
+        }
+
+    def _count_read(self, target):
+        with self._reads_lock:
+            self.reads[target] += 1
+
+    def _read(self, fn):
+        """
+        Runs ``fn(session)`` on a replica if the current request may read from one,
+        otherwise on the primary.  If the replica fails the read is retried on the primary.
+        """
+        if self.replicas and replica_allowed():
+            replica = self.replicas.next()
+            try:
+                # start a new transaction, so the read sees everything replicated so far
+                replica.rollback()
+                self._count_read('replica')
+                return fn(replica)
+            except OperationalError as e:
+                replica.rollback()
+                self.log.warning('Read replica failed, reading from the primary: %s' % e)
+        self._count_read('primary')
+        return fn(self.db)
 
     def get_key_secret(self):
         """
-        Gets the key and secret from the database.
-        Assumes that there is only one, which exists.
-        If it does not exist an exception is raised
-        :return:
+        Gets the first key and secret from the database.
+        If there are none, None is returned
+        :return: A dict in the form {'get_key': key, key: secret}
         """
-        try:
-            key_secret = self.db.query(LtiKeySecret).one()
-            return_value = {'get_key': key_secret.key_value, key_secret.key_value: key_secret.secret}
-            print(str(return_value))
-            return return_value
-
-        except:
+        key_secret = self._read(lambda db: db.query(LtiKeySecret).order_by(LtiKeySecret.key_secret_id).first())
+        if key_secret is None:
             self.log.warn('There is no key/secret pair in the database.  Returning None')
             return None
+        return {'get_key': key_secret.key_value, key_secret.key_value: key_secret.secret}
+
+    def get_key_secrets(self):
+        """
+        Gets every consumer key and its secret from the database
+        :return: A dict in the form {key: secret, ...}
+        """
+        return self._read(lambda db: dict(db.query(LtiKeySecret.key_value, LtiKeySecret.secret).all()))
 
     def add_key_secret(self, key, secret):
-        if not(self.get_key_secret()):
+        """
+        Adds a consumer key and secret, unless the key is already in the database
+        """
+        exists = self.db.query(LtiKeySecret.key_secret_id).filter(LtiKeySecret.key_value == key).first()
+        if exists is None:
+            mark_write()
             self.db.add(LtiKeySecret(key_value=key, secret=secret))
             self.db.commit()
             self.log.info('New key/secret added to the database')
         else:
-            self.log.warn('IGNORED attempt to add a new key/secret when one already exists')
+            self.log.debug('IGNORED attempt to add key %s, which already exists' % key)
 
     def add_or_update_user_session(self, key, user_id, lis_result_sourcedid, lis_outcome_service_url, resource_link_id):
         """
-        We assume that for each application we have a single secret.  We need to identify the users
-        based on their ID and key, so we can return the correct assignment
-        If the user session does not exist, add it.  If the user session does exist, update it
-        :param params: A dict of the parameters passed by the LTI Consumer
-
-        :return:
+        Stores the outcome service details of a launch.  There is one session for each
+        consumer key, user and resource link, so launches of different assignments keep
+        their own ``lis_result_sourcedid``.  The session is inserted, or updated if it
+        already exists, in a single statement.  Nothing is written if the stored session
+        already has these details, so repeat launches of the same assignment only read.
+        :param key: The OAuth consumer key the launch was signed with
+        :param user_id: The User ID sent across from Canvas
+        :param lis_result_sourcedid: Identifies the user's result for this assignment
+        :param lis_outcome_service_url: Where the grade is sent
+        :param resource_link_id: Identifies the assignment
         """
-
-        user_session = self.get_user_session(user_id)
-        if not user_session:
-            self.db.add(LtiUserSession(key=key,
-                                       user_id=user_id,
-                                       lis_result_sourcedid=lis_result_sourcedid,
-                                       lis_outcome_service_url=lis_outcome_service_url,
-                                       resource_link_id=resource_link_id))
-        else:
-            setattr(user_session, 'lis_result_sourcedid', lis_result_sourcedid)
-            setattr(user_session, 'resource_link_id', resource_link_id)
-
+        cache_key = (key or '', user_id, resource_link_id or '')
+        fingerprint = (lis_result_sourcedid, lis_outcome_service_url)
+        stored = self.session_cache.get(cache_key)
+        if stored is None:
+            stored = self.db.execute(_SESSION_FINGERPRINT, {
+                'key': cache_key[0], 'user_id': user_id, 'resource_link_id': cache_key[2]}).first()
+            # End the read transaction, which would otherwise hold a SQLite snapshot open
+            self.db.commit()
+            if stored is not None:
+                stored = tuple(stored)
+                self.session_cache.set(cache_key, stored)
+        if stored == fingerprint:
+            self._avoided_write('session')
+            return
+
+        mark_write()
+        row = {
+            'key': cache_key[0],
+            'user_id': user_id,
+            'lis_result_sourcedid': lis_result_sourcedid,
+            'lis_outcome_service_url': lis_outcome_service_url,
+            'resource_link_id': cache_key[2],
+        }
         try:
+            upsert(self.db, LtiUserSession.__table__, row, index_elements=SESSION_INDEX,
+                   update_columns=['lis_result_sourcedid', 'lis_outcome_service_url'])
             self.db.commit()
         except (IntegrityError, FlushError) as e:
             self.db.rollback()
+            self.session_cache.invalidate(cache_key)
             raise ValueError(*e.args)
-        return user_session
+        self.session_cache.set(cache_key, fingerprint)
 
-    def get_user_session(self, user_id):
-        user_session = \
-            self.db.query(LtiUserSession).filter(LtiUserSession.user_id == user_id).all()
-        if len(user_session) > 0:
-            return user_session[0]
-        else:
-            return None
+    def get_user_session(self, user_id, key=None, resource_link_id=None):
+        """
+        Gets a user's session, for one consumer key and resource link if given
+        :return: A SessionRecord, or None if there is none
+        """
+        stmt = _LATEST_SESSION[key is not None, resource_link_id is not None]
+        params = {'user_id': user_id, 'key': key, 'resource_link_id': resource_link_id}
+        row = self._read(lambda db: db.execute(stmt, params).first())
+        return SessionRecord(*row) if row is not None else None
+
+    def outcome_targets(self, unix_names, resource_link_id=None):
+        """
+        Finds where to send the grades of several users, in one query
+        :param unix_names: The users' unix names
+        :param resource_link_id: The assignment's resource link.  If None, each user's
+            most recently created session is used
+        :return: A dict of {unix_name: (key, lis_result_sourcedid, lis_outcome_service_url)}
+            for the users with a session to send to
+        """
+        def read(db):
+            query = db.query(LtiUser.unix_name, LtiUserSession.key, LtiUserSession.lis_result_sourcedid,
+                             LtiUserSession.lis_outcome_service_url) \
+                .join(LtiUserSession, LtiUserSession.user_id == LtiUser.user_id) \
+                .filter(LtiUser.unix_name.in_(list(unix_names)),
+                        LtiUserSession.lis_result_sourcedid != None,
+                        LtiUserSession.lis_outcome_service_url != None)
+            if resource_link_id is not None:
+                query = query.filter(LtiUserSession.resource_link_id == resource_link_id)
+            try:
+                # later sessions replace earlier ones
+                return dict((row.unix_name, (row.key, row.lis_result_sourcedid, row.lis_outcome_service_url))
+                            for row in query.order_by(LtiUserSession.id))
+            finally:
+                db.commit()
+        return self._read(read)
 
     def get_user_by_unix_name(self, unix_name):
         try:
-            return self.db.query(LtiUser).filter(LtiUser.unix_name == unix_name).one()
+            return self._read(lambda db: db.query(LtiUser).filter(LtiUser.unix_name == unix_name).one())
         except:
             self.log.error('No user by the UNIX name %s' % unix_name)
 
@@ -163,15 +376,84 @@ class LtiDB(LoggingConfigurable):
         The firstname and surname are optional.  If they are there and we are creating a
         user, put them into the CSV file.
         :param user_id: The User ID sent across from Canvas.
-        :return: A unix username, or None if they do not exist
+        :return: A UserRecord with the user's unix name and courses, or None if they do not exist
         """
-        try:
-            user_obj = self.db.query(LtiUser).filter(LtiUser.user_id == user_id).one()
-        # if user_obj:
-            print('User already exists, getting user %s' % user_obj.unix_name)
-            return user_obj
-        except NoResultFound:
+        rows = self._read(lambda db: db.execute(_USER_COURSES, {'user_id': user_id}).all())
+        if not rows:
             return None
+        self.log.debug('User already exists, getting user %s' % rows[0].unix_name)
+        return UserRecord(user_id, rows[0].unix_name, (row.course for row in rows if row.course is not None))
+
+    def lookup_user(self, user_id):
+        """
+        Gets a user's unix name and courses, from the user cache if possible.
+        Returning users are resolved without a database query.
+        :param user_id: The User ID sent across from Canvas.
+        :return: A UserRecord, or None if the user does not exist
+        """
+        record = self.user_cache.get(user_id)
+        if record is not None:
+            return record
+        record = self.get_user(user_id)
+        if record is None:
+            return None
+        self.user_cache.put(record)
+        return record
+
+    def add_user_course(self, user_id, course, record=None):
+        """
+        Enrols a user on a course, doing nothing if they are already enrolled, and updates
+        the cached copy of the user as well
+        :param record: The user's UserRecord, if the caller already has it.  Nothing is
+            written if it already holds the course
+        :return: The UserRecord with the course
+        """
+        if record is not None and course in record.courses:
+            self._avoided_write('course')
+            return record
+        mark_write()
+        row = {'user_id': user_id, 'course': course}
+        try:
+            insert_if_absent(self.db, LtiUserCourse.__table__, row, index_elements=['user_id', 'course'])
+            self.db.commit()
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            raise ValueError(*e.args)
+        except (OperationalError, ProgrammingError) as e:
+            self.db.rollback()
+            if not missing_conflict_target(e):
+                raise
+            # The unique index is missing because the table still holds duplicates
+            self.log.warning('Enrolling without the user_course unique index, run lti-maintenance '
+                             'compact-courses to create it: %s' % e)
+            self._add_user_course_unindexed(row)
+        record = self.user_cache.get(user_id)
+        if record is None:
+            self.user_cache.invalidate(user_id)
+            return self.lookup_user(user_id)
+        record = record.with_course(course)
+        self.user_cache.put(record)
+        return record
+
+    def _avoided_write(self, kind):
+        with self._writes_avoided_lock:
+            self.writes_avoided[kind] += 1
+
+    def _add_user_course_unindexed(self, row):
+        try:
+            if not self.db.execute(_ENROLLED, row).scalar():
+                self.db.execute(LtiUserCourse.__table__.insert(), row)
+            self.db.commit()
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            raise ValueError(*e.args)
+
+    def invalidate_user(self, user_id=None):
+        """
+        Drops a user, or every user if ``user_id`` is None, from the user cache.  Call this
+        after changing the usermap or user_course tables other than through this LtiDB.
+        """
+        self.user_cache.invalidate(user_id)
 
     def add_user(self, user_id, firstname='', surname=''):
         """
@@ -179,18 +461,91 @@ class LtiDB(LoggingConfigurable):
         :param user_id: The User ID sent from Canvas
         :param firstname: The first name sent from Canvas
         :param surname: The surname sent from Canvas
-        :return: The unix name of the new user
+        :return: A UserRecord of the new user, or of the existing one if another process
+            created them first
         """
-        total_users = len(self.db.query(LtiUser).all())
-        username = 'user-%d' % (total_users + 1)
+        username = self.allocator.next_name()
         self.log.info('Adding new user %s' % username)
         # self.add_user(user_id, username, firstname, surname)
         user = LtiUser(user_id=user_id, unix_name=username)
+        mark_write()
         self.db.add(user)
         try:
             self.db.commit()
             self.log.info('Added new user %s to the database' % username)
-            return user
+            record = UserRecord(user_id, username)
+            self.user_cache.put(record)
+            return record
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            # Another process may have created the same user since we looked
+            existing = self.get_user(user_id)
+            if existing is None:
+                raise ValueError(*e.args)
+            self.log.info('User %s was added concurrently as %s' % (user_id, existing.unix_name))
+            return existing
+
+    def import_users(self, enrolments):
+        """
+        Adds many users and course enrolments at once, in a single transaction, skipping
+        any that already exist so the same roster can be imported again safely.
+        :param enrolments: A list of (user_id, course) pairs.  course may be None or ''
+            to only create the user
+        :return: A tuple of (users added, enrolments added)
+        """
+        user_ids = list(dict.fromkeys(user_id for user_id, _ in enrolments))
+        wanted = set((user_id, course) for user_id, course in enrolments if course)
+        if not user_ids:
+            return 0, 0
+
+        existing = set(row.user_id for row in
+                       self.db.query(LtiUser.user_id).filter(LtiUser.user_id.in_(user_ids)))
+        new_ids = [user_id for user_id in user_ids if user_id not in existing]
+        names = self.allocator.reserve(len(new_ids)) if new_ids else []
+
+        enrolled = set(self.db.query(LtiUserCourse.user_id, LtiUserCourse.course)
+                       .filter(LtiUserCourse.user_id.in_(user_ids)))
+        courses = [{'user_id': user_id, 'course': course} for user_id, course in sorted(wanted - enrolled)]
+        mark_write()
+        try:
+            # a launch may have created some of the users since they were looked up
+            added = insert_if_absent(self.db, LtiUser.__table__,
+                                     [{'user_id': u, 'unix_name': n} for u, n in zip(new_ids, names)],
+                                     index_elements=['user_id'])
+            # and so may a launch have enrolled some of them
+            courses_added = insert_if_absent(self.db, LtiUserCourse.__table__, courses,
+                                            index_elements=['user_id', 'course'])
+            self.db.commit()
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            raise ValueError(*e.args)
+
+        for user_id in user_ids:
+            self.user_cache.invalidate(user_id)
+        return (len(new_ids) if added < 0 else added), (len(courses) if courses_added < 0 else courses_added)
+
+    def reserve_ids(self, name, count, seed=None):
+        """
+        Atomically adds ``count`` to a counter and returns the numbers skipped over.
+        The update and the read happen in one transaction, which holds the counter's
+        row (or, on SQLite, the database) until it commits, so no two callers can ever
+        get the same numbers.
+        :param name: The name of the counter
+        :param count: How many numbers to reserve
+        :param seed: If the counter does not exist yet, it starts at ``seed(unix_names)``,
+            called with an iterable of every existing unix name.  Otherwise it starts at 0
+        :return: A range of the reserved numbers
+        """
+        table = LtiCounter.__table__
+        mark_write()
+        try:
+            if self.db.query(LtiCounter.value).filter(LtiCounter.name == name).scalar() is None:
+                start = seed(row.unix_name for row in self.db.query(LtiUser.unix_name)) if seed else 0
+                insert_if_absent(self.db, table, {'name': name, 'value': start}, index_elements=['name'])
+            self.db.execute(table.update().where(table.c.name == name).values(value=table.c.value + count))
+            value = self.db.query(LtiCounter.value).filter(LtiCounter.name == name).scalar()
+            self.db.commit()
         except (IntegrityError, FlushError) as e:
             self.db.rollback()
             raise ValueError(*e.args)
+        return range(value - count + 1, value + 1)
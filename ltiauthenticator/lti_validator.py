@@ -1,12 +1,72 @@
 from oauthlib.oauth1 import RequestValidator
 from .authenticator_db import NoncesDB
 from .lti_db import LtiDB
+from .credentials import CredentialRegistry, env_seed
+from .nonce_cache import NonceCache
 import os
+import threading
+import time
+import uuid
+import logging
+
+log = logging.getLogger(__name__)
+
+_nonce_cache = None
+_nonce_cache_lock = threading.Lock()
+
+
+def get_nonce_cache(db_url=None):
+    """
+    The replay cache shared by every LTIValidator in the process, created on first use
+    :param db_url: The nonces database used when the cache is created.  Defaults to ``NONCES_DB``
+    """
+    global _nonce_cache
+    if _nonce_cache is None:
+        with _nonce_cache_lock:
+            if _nonce_cache is None:
+                cache = NonceCache(NoncesDB(db_url or os.environ.get('NONCES_DB', 'sqlite:///timestamp.db')))
+                cache.load()
+                _nonce_cache = cache
+    return _nonce_cache
+
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+
+def get_credentials(lti_db=None):
+    """
+    The consumer key registry shared by every LTIValidator in the process, created on first use.
+    The ``LTI_KEY``/``LTI_SECRET`` pair from the environment is added to it if set.
+    :param lti_db: The LtiDB holding the keys, used when the registry is created.  Defaults to
+        one at ``LTI_DB``
+    """
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                if lti_db is None:
+                    lti_db = LtiDB(os.environ.get('LTI_DB', 'sqlite:///lti.db'))
+                credentials = CredentialRegistry(lti_db, env_seed())
+                try:
+                    credentials.install_signal_handler()
+                except ValueError:
+                    # Signal handlers can only be installed from the main thread
+                    pass
+                _credentials = credentials
+    return _credentials
 
-connection_string = os.environ.get('LTI_DB', 'sqlite:///lti.db')
 
 class LTIValidator(RequestValidator):
 
+    # Used to compute a signature for unknown keys, so the response takes as long as for known ones
+    _dummy_secret = uuid.uuid4().hex
+
+    def __init__(self, nonce_cache=None, credentials=None, metrics=None):
+        super().__init__()
+        self.nonce_cache = get_nonce_cache() if nonce_cache is None else nonce_cache
+        self.credentials = get_credentials() if credentials is None else credentials
+        self.metrics = metrics
 
     @property
     def client_key_length(self):
@@ -20,30 +80,25 @@ class LTIValidator(RequestValidator):
     def enforce_ssl(self):
         return False
 
-    @property
-    def authentication_information(self):
-        key = os.environ.get('LTI_KEY', '')
-        secret = os.environ.get('LTI_SECRET', '')
-        lti_db = LtiDB(connection_string)
-        lti_db.add_key_secret(key, secret)
-        return {'get_key': key, key: secret}
-
     def get_client_secret(self, client_key, request):
-        return self.authentication_information[client_key]
+        secret = self.credentials.get_secret(client_key)
+        return self._dummy_secret if secret is None else secret
 
     def validate_client_key(self, client_key, request):
-        return client_key == self.authentication_information.get('get_key', '')
+        return client_key in self.credentials
 
     def validate_timestamp_and_nonce(self, client_key, timestamp, nonce,
                                      request, request_token=None, access_token=None):
 
-        db = NoncesDB(os.environ.get('NONCES_DB', 'sqlite:///timestamp.db'))
-
-        valid_nonce = db.check_valid_timestamp_and_nonce(timestamp, nonce)
+        start = time.perf_counter()
+        valid_nonce = self.nonce_cache.check_and_add(client_key, timestamp, nonce)
+        if self.metrics is not None:
+            self.metrics.observe('nonce', time.perf_counter() - start)
+            if not valid_nonce:
+                self.metrics.inc('nonce_rejects_total')
         if not valid_nonce:
-            print('Invalid nonce!')
+            log.warning('Rejected a stale or replayed nonce from consumer %s' % client_key)
         return valid_nonce
-        # return True
 
     def validate_redirect_uri(self, client_key, redirect_uri, request):
         return True
@@ -54,24 +109,7 @@ class LTIValidator(RequestValidator):
 
         :returns: The dummy client key string.
 
-        The dummy client should be associated with either a client secret,
-        a rsa key or both depending on which signature methods are supported.
-        Providers should make sure that
-
-        get_client_secret(dummy_client)
-        get_rsa_key(dummy_client)
-
-        return a valid secret or key for the dummy client.
-
-        This method is used by
-
-        * AccessTokenEndpoint
-        * RequestTokenEndpoint
-        * ResourceEndpoint
-        * SignatureOnlyEndpoint
+        get_client_secret returns a random secret for it, so a request signed with an
+        unknown key goes through the same signature check as a real one and fails.
         """
-        raise NotImplementedError("TODO: Implement this")
-
-
-
-
+        return 'dummy_client'
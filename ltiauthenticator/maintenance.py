@@ -0,0 +1,254 @@
+"""
+One-off maintenance of the LTI database.
+
+``compact-courses`` removes the duplicate ``user_course`` rows left by versions that
+enrolled a user on their course again at every launch, keeping the oldest row of each
+(user_id, course) pair, then creates the unique index that stops them coming back.
+
+``migrate-sessions`` copies the user sessions from the ``nonces`` table, where versions
+before sessions were kept per resource link stored them, into ``user_session``.
+
+``rebalance`` moves each user, with their courses and sessions, to the shard the hash
+ring gives them for ``--db`` and the ``--shard`` databases, in the order the hubs are
+given them.  Run it after adding a shard at the end of the list and before the hubs
+are given the new list, while no launches arrive.  Users
+are moved a batch at a time, copied and committed on their new shard before they are
+deleted from the old one, so an interrupted rebalance can just be run again.
+
+    lti-maintenance compact-courses --db sqlite:///lti.db
+    lti-maintenance migrate-sessions --db sqlite:///lti.db --drop-legacy
+    lti-maintenance rebalance --db postgresql://db0/lti --shard postgresql://db1/lti --shard postgresql://db2/lti
+"""
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+from sqlalchemy import func, inspect, select, MetaData, Table
+
+from .dialects import insert_if_absent, upsert
+from .lti_db import LtiDB, LtiUser, LtiUserCourse, LtiUserSession, SESSION_INDEX
+from .sharding import env_shard_urls, open_lti_db
+
+LEGACY_SESSION_TABLE = 'nonces'
+
+
+def compact_user_courses(lti_db, batch_size=10000):
+    """
+    Deletes duplicate enrolments, in batches of ``batch_size`` rows per transaction,
+    and creates the unique (user_id, course) index
+    :return: The number of rows deleted
+    """
+    db = lti_db.db
+    keep = db.query(func.min(LtiUserCourse.id)).group_by(LtiUserCourse.user_id, LtiUserCourse.course)
+    deleted = 0
+    while True:
+        try:
+            ids = [row.id for row in db.query(LtiUserCourse.id)
+                   .filter(LtiUserCourse.id.notin_(keep.subquery().select()))
+                   .limit(batch_size)]
+            if ids:
+                db.query(LtiUserCourse).filter(LtiUserCourse.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+
+    for index in LtiUserCourse.__table__.indexes:
+        index.create(bind=db.get_bind(), checkfirst=True)
+    lti_db.invalidate_user()
+    return deleted
+
+
+def legacy_session_table(engine):
+    """
+    :return: The legacy ``nonces`` table holding user sessions, or None if the database
+        has none.  A ``nonces`` table holding the nonces of a NoncesDB isn't legacy
+    """
+    if LEGACY_SESSION_TABLE not in inspect(engine).get_table_names():
+        return None
+    legacy = Table(LEGACY_SESSION_TABLE, MetaData(), autoload_with=engine)
+    if 'lis_result_sourcedid' not in legacy.c:
+        return None
+    return legacy
+
+
+def migrate_user_sessions(lti_db, batch_size=10000, drop_legacy=False):
+    """
+    Copies the sessions in the legacy ``nonces`` table into ``user_session``.  Where the
+    legacy table has several rows for one session the newest wins, and sessions already
+    in ``user_session`` are overwritten, so the migration can be run again.
+    :param drop_legacy: Drop the legacy table once it has been copied
+    :return: The number of legacy rows copied, leaving out those without a user_id, or None
+        if there is no legacy table
+    """
+    db = lti_db.db
+    engine = db.get_bind()
+    legacy = legacy_session_table(engine)
+    if legacy is None:
+        return None
+
+    columns = ['key', 'user_id', 'lis_result_sourcedid', 'lis_outcome_service_url', 'resource_link_id']
+    copied = 0
+    last_id = 0
+    while True:
+        rows = db.execute(legacy.select().where(legacy.c.id > last_id)
+                          .order_by(legacy.c.id).limit(batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        sessions = [dict((column, row._mapping[column] or '') if column in ('key', 'resource_link_id')
+                         else (column, row._mapping[column]) for column in columns)
+                    for row in rows if row._mapping['user_id']]
+        try:
+            # rows are written in id order, so the newest of any duplicates is left
+            upsert(db, LtiUserSession.__table__, sessions, index_elements=SESSION_INDEX,
+                   update_columns=['lis_result_sourcedid', 'lis_outcome_service_url'])
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        copied += len(sessions)
+    lti_db.session_cache.invalidate()
+
+    if drop_legacy:
+        legacy.drop(bind=engine)
+    return copied
+
+
+def _move_users(source, target, user_ids):
+    """
+    Copies users, their courses and their sessions from one shard to another, then
+    deletes them from the first.  Rows the target already has are left alone, as they
+    are at least as new as the source's.
+    """
+    users = LtiUser.__table__
+    courses = LtiUserCourse.__table__
+    sessions = LtiUserSession.__table__
+    columns = ['key', 'user_id', 'lis_result_sourcedid', 'lis_outcome_service_url', 'resource_link_id']
+
+    user_rows = [dict(row._mapping) for row in
+                 source.db.execute(select(users.c.user_id, users.c.unix_name).where(users.c.user_id.in_(user_ids)))]
+    course_rows = [dict(row._mapping) for row in
+                   source.db.execute(select(courses.c.user_id, courses.c.course)
+                                     .where(courses.c.user_id.in_(user_ids)))]
+    session_rows = [dict(row._mapping) for row in
+                    source.db.execute(select(*[sessions.c[column] for column in columns])
+                                      .where(sessions.c.user_id.in_(user_ids)))]
+    source.db.commit()
+
+    try:
+        insert_if_absent(target.db, users, user_rows, index_elements=['user_id'])
+        insert_if_absent(target.db, courses, course_rows, index_elements=['user_id', 'course'])
+        insert_if_absent(target.db, sessions, session_rows, index_elements=SESSION_INDEX)
+        target.db.commit()
+    except:
+        target.db.rollback()
+        raise
+
+    try:
+        source.db.execute(sessions.delete().where(sessions.c.user_id.in_(user_ids)))
+        source.db.execute(courses.delete().where(courses.c.user_id.in_(user_ids)))
+        source.db.execute(users.delete().where(users.c.user_id.in_(user_ids)))
+        source.db.commit()
+    except:
+        source.db.rollback()
+        raise
+
+    for user_id in user_ids:
+        source.invalidate_user(user_id)
+        target.invalidate_user(user_id)
+    source.session_cache.invalidate()
+    target.session_cache.invalidate()
+    return len(user_rows)
+
+
+def rebalance_shards(sharded, batch_size=1000, log=None):
+    """
+    Moves every user that isn't on the shard the ring gives them, reading each shard's
+    users ``batch_size`` at a time in user_id order
+    :param sharded: A ShardedLtiDB over the new list of shards
+    :param log: Called with a progress message after each batch
+    :return: A dict of {(from shard, to shard): users moved}, by shard_name
+    """
+    users = LtiUser.__table__
+    moved = OrderedDict()
+    for name, source in sharded.shards.items():
+        last = None
+        while True:
+            query = select(users.c.user_id).order_by(users.c.user_id).limit(batch_size)
+            if last is not None:
+                query = query.where(users.c.user_id > last)
+            user_ids = [row.user_id for row in source.db.execute(query)]
+            source.db.commit()
+            if not user_ids:
+                break
+            last = user_ids[-1]
+
+            by_target = OrderedDict()
+            for user_id in user_ids:
+                target = sharded.ring.node_for(user_id)
+                if target != name:
+                    by_target.setdefault(target, []).append(user_id)
+            for target, target_ids in by_target.items():
+                count = _move_users(source, sharded.shards[target], target_ids)
+                moved[name, target] = moved.get((name, target), 0) + count
+            if log is not None:
+                log('%s: read %d users up to %s, moved %d'
+                    % (name, len(user_ids), last, sum(len(ids) for ids in by_target.values())))
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='One-off maintenance of the LTI database')
+    # after the command, as in the examples above
+    database = argparse.ArgumentParser(add_help=False)
+    database.add_argument('--db', default=os.environ.get('LTI_DB', 'sqlite:///lti.db'), help="LTI database URL")
+    commands = parser.add_subparsers(dest='command')
+    compact = commands.add_parser('compact-courses', parents=[database], help="Remove duplicate course enrolments")
+    compact.add_argument('--batch-size', type=int, default=10000, help="Rows deleted per transaction")
+    migrate = commands.add_parser('migrate-sessions', parents=[database], help="Copy user sessions out of the legacy nonces table")
+    migrate.add_argument('--batch-size', type=int, default=10000, help="Rows copied per transaction")
+    migrate.add_argument('--drop-legacy', action='store_true', help="Drop the legacy table afterwards")
+    rebalance = commands.add_parser('rebalance', parents=[database], help="Move users to the shards the hash ring gives them")
+    rebalance.add_argument('--shard', action='append',
+                           help="Further shard of the LTI database.  May be given several times.  "
+                                "Defaults to LTI_DB_SHARDS")
+    rebalance.add_argument('--batch-size', type=int, default=1000, help="Users read per batch")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        sys.exit(2)
+
+    if args.command == 'rebalance':
+        shard_urls = args.shard or env_shard_urls()
+        if not shard_urls:
+            print('There is only one shard, so there is nothing to rebalance')
+            sys.exit(2)
+        sharded = open_lti_db(args.db, shard_urls)
+        moved = rebalance_shards(sharded, args.batch_size, log=lambda message: print(message, file=sys.stderr))
+        for (source, target), count in moved.items():
+            print('Moved %d users from %s to %s' % (count, source, target))
+        print('Moved %d users in total' % sum(moved.values()))
+        return
+
+    lti_db = LtiDB(args.db)
+    if args.command == 'compact-courses':
+        before = lti_db.db.query(LtiUserCourse).count()
+        deleted = compact_user_courses(lti_db, args.batch_size)
+        print('Removed %d duplicate enrolments, %d remain' % (deleted, before - deleted))
+    elif args.command == 'migrate-sessions':
+        copied = migrate_user_sessions(lti_db, args.batch_size, args.drop_legacy)
+        if copied is None:
+            print('There is no legacy session table in %s' % args.db)
+        else:
+            print('Copied %d legacy sessions, %d sessions now stored'
+                  % (copied, lti_db.db.query(LtiUserSession).count()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Launch latency metrics, served in the Prometheus text format.
+
+Every stage of a launch records its duration in a histogram whose buckets are
+allocated once, up front, so recording a sample is a bisect and two additions.
+Database queries are counted per thread by an engine event, which lets the work a
+launch does on the DB thread pool be attributed back to it.
+"""
+import bisect
+import threading
+
+# Seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+# The stages of a launch, in the order they happen
+STAGES = (
+    'signature',       # the whole oauthlib validate_request, including the nonce check
+    'nonce',           # the replay check on its own
+    'user_mapping',    # finding or creating the LtiUser
+    'course_append',   # enrolling the user on the course
+    'session_upsert',  # storing the outcome service details
+    'login_user',      # JupyterHub's login_user, which includes all of the above but the session
+)
+
+_local = threading.local()
+
+
+def count_query(*args, **kwargs):
+    """
+    SQLAlchemy ``before_cursor_execute`` listener counting queries made by the current thread
+    """
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def queries_in_thread():
+    """
+    :return: The number of queries the current thread has made so far
+    """
+    return getattr(_local, 'queries', 0)
+
+
+def call_counting_queries(fn, *args, **kwargs):
+    """
+    Calls ``fn(*args, **kwargs)``
+    :return: A tuple of what it returned and how many queries it made
+    """
+    before = queries_in_thread()
+    result = fn(*args, **kwargs)
+    return result, queries_in_thread() - before
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus one for everything larger
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=''):
+        lines = []
+        cumulative = 0
+        sep = ',' if labels else ''
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s%sle="%s"} %d' % (name, labels, sep, bound, cumulative))
+        lines.append('%s_bucket{%s%sle="+Inf"} %d' % (name, labels, sep, self.count))
+        braces = '{%s}' % labels if labels else ''
+        lines.append('%s_sum%s %s' % (name, braces, repr(self.sum)))
+        lines.append('%s_count%s %d' % (name, braces, self.count))
+        return lines
+
+
+class LaunchMetrics(object):
+
+    def __init__(self, prefix='ltiauthenticator'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.stages = dict((stage, Histogram(LATENCY_BUCKETS)) for stage in STAGES)
+        self.queries_per_launch = Histogram(QUERY_BUCKETS)
+        self.counters = {
+            'launches_total': 0,
+            'signature_failures_total': 0,
+            'nonce_rejects_total': 0,
+            'db_queries_total': 0,
+        }
+        # Extra gauges and counters from other components, as (name, kind, help, collect)
+        self._collectors = []
+
+    def observe(self, stage, seconds):
+        """
+        Records how long a stage of a launch took
+        """
+        histogram = self.stages[stage]
+        with self._lock:
+            histogram.observe(seconds)
+
+    def inc(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def launch_finished(self, db_queries):
+        """
+        Records a finished launch and how many database queries it made
+        """
+        with self._lock:
+            self.counters['launches_total'] += 1
+            self.counters['db_queries_total'] += db_queries
+            self.queries_per_launch.observe(db_queries)
+
+    def add_collector(self, name, kind, help, collect):
+        """
+        Adds a metric whose value is read when the metrics are rendered
+        :param name: The metric name, without the prefix
+        :param kind: ``gauge`` or ``counter``
+        :param help: The help text
+        :param collect: Called with no arguments, returns the current value
+        """
+        self._collectors.append((name, kind, help, collect))
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text exposition format
+        """
+        p = self.prefix
+        with self._lock:
+            lines = [
+                '# HELP %s_launch_stage_seconds Time taken by each stage of an LTI launch' % p,
+                '# TYPE %s_launch_stage_seconds histogram' % p,
+            ]
+            for stage in STAGES:
+                lines.extend(self.stages[stage].render('%s_launch_stage_seconds' % p, 'stage="%s"' % stage))
+            lines.extend([
+                '# HELP %s_launch_db_queries Database queries made by each LTI launch' % p,
+                '# TYPE %s_launch_db_queries histogram' % p,
+            ])
+            lines.extend(self.queries_per_launch.render('%s_launch_db_queries' % p))
+            for counter, value in self.counters.items():
+                lines.append('# TYPE %s_%s counter' % (p, counter))
+                lines.append('%s_%s %d' % (p, counter, value))
+        for name, kind, help, collect in self._collectors:
+            lines.append('# HELP %s_%s %s' % (p, name, help))
+            lines.append('# TYPE %s_%s %s' % (p, name, kind))
+            lines.append('%s_%s %s' % (p, name, collect()))
+        return '\n'.join(lines) + '\n'
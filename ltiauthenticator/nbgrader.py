@@ -0,0 +1,123 @@
+from nbgrader.auth import JupyterHubAuthPlugin, Authenticator
+from traitlets import Integer, Float
+import os
+
+import logging
+
+from .group_sync import GroupSync
+from .hub_client import HubAPIClient, HubAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class SubAuthenticator(Authenticator):
+    def add_grader_to_course(self, student_id: str, course_id: str) -> None:
+        logger.debug('Calling add_grader_to_course in SubAuthenticator')
+        self.plugin.add_grader_to_course(student_id, course_id)
+
+    def add_student_to_course(self, student_id: str, course_id: str) -> None:
+        logger.debug('Calling add_student')
+        self.plugin.add_student_to_course(student_id, course_id)
+
+
+class SubAuthPlugin(JupyterHubAuthPlugin):
+
+    # Shared by every plugin in the process, so group memberships are only read from the Hub once
+    group_sync = None
+
+    hub_pool_size = Integer(
+        4,
+        help="The most connections kept open to the JupyterHub API"
+    ).tag(config=True)
+
+    hub_max_concurrency = Integer(
+        8,
+        help="The most JupyterHub API requests in flight at once, e.g. one per group when flushing"
+    ).tag(config=True)
+
+    hub_timeout = Float(
+        10.0,
+        help="Seconds to wait to connect to the JupyterHub API, and then for each read"
+    ).tag(config=True)
+
+    hub_retries = Integer(
+        3,
+        help="How many times a JupyterHub API request is retried after a connection error or a 5xx response"
+    ).tag(config=True)
+
+    hub_backoff = Float(
+        0.2,
+        help="Retries of a JupyterHub API request wait hub_backoff * 2 ** (retry - 1) seconds"
+    ).tag(config=True)
+
+    group_refresh_interval = Float(
+        300,
+        help="Seconds before the cached group memberships are read from the Hub again"
+    ).tag(config=True)
+
+    group_flush_delay = Float(
+        0.5,
+        help="Seconds to wait after a user is queued for a group before sending the batch to the Hub"
+    ).tag(config=True)
+
+    group_retry_delay = Float(
+        5.0,
+        help="Seconds before users that could not be added to their group are tried again"
+    ).tag(config=True)
+
+    def get_group_sync(self):
+        """
+        The GroupSync shared by every plugin in the process, built from the settings of the first
+        plugin to use it
+        """
+        if SubAuthPlugin.group_sync is None:
+            client = HubAPIClient(pool_size=self.hub_pool_size, max_concurrency=self.hub_max_concurrency,
+                                  timeout=self.hub_timeout, retries=self.hub_retries, backoff=self.hub_backoff)
+            SubAuthPlugin.group_sync = GroupSync(client, refresh_interval=self.group_refresh_interval,
+                                                 flush_delay=self.group_flush_delay,
+                                                 retry_delay=self.group_retry_delay)
+        return SubAuthPlugin.group_sync
+
+    def add_student_to_course(self, student_id: str, course_id: str) -> None:
+        logger.debug('Calling add_student_to_course in plugin')
+        logger.debug('JUPYTERHUB_API_URL: %s' % os.environ.get('JUPYTERHUB_API_URL'))
+        if not course_id:
+            logger.error(
+                "Could not add student to course because the course_id has not "
+                "been provided. Has it been set in the nbgrader_config.py?")
+            return
+
+        self._add_to_group("nbgrader-{}".format(course_id), student_id)
+
+    def add_grader_to_course(self, student_id: str, course_id: str) -> None:
+        logger.debug('Adding grader to course')
+        if not course_id:
+            logger.error(
+                "Could not add grader to course because the course_id has not "
+                "been provided. Has it been set in the nbgrader_config.py?")
+            return
+
+        self._add_to_group("formgrader-{}".format(course_id), student_id)
+
+    def _add_to_group(self, group_name: str, user: str) -> None:
+        # The user is queued and sent to the Hub together with everyone else
+        # added to the group shortly before or after them
+        try:
+            if self.get_group_sync().add(group_name, user):
+                logger.debug('Queued {user} for the Jupyterhub group: {group_name}'.format(
+                    user=user, group_name=group_name))
+        except HubAPIError as e:
+            # We assume user might be using Jupyterhub but something is not working
+            logger.error("{user} NOT added to the Jupyterhub group {group_name}: {error}".format(
+                user=user, group_name=group_name, error=e))
+            logger.error(
+                "Make sure you set a valid admin_user 'api_token' in your config file before starting the service")
+
+    def flush_groups(self, raise_errors: bool = False) -> int:
+        """
+        Sends every queued group membership to the Hub straight away.  Memberships that
+        could not be sent stay queued.
+        :param raise_errors: Raise HubAPIError if any could not be sent
+        :return: The number of users added
+        """
+        return self.get_group_sync().flush(raise_errors)
@@ -1,74 +1,90 @@
 import os
 
-from oauthlib.oauth1 import SignatureOnlyEndpoint
 from tornado import gen
-from ltiauthenticator.lti_db import LtiDB, LtiUserCourse
-from ltiauthenticator import LocalLTIAuthenticator, LTIAuthenticator
-from ltiauthenticator.lti_validator import LTIValidator
-
-connection_string = os.environ.get('LTI_DB', 'sqlite:///lti.db')
-db = LtiDB(connection_string)
+from tornado.ioloop import IOLoop, PeriodicCallback
+from traitlets import Unicode, Integer, default
+from .lti import LocalLTIAuthenticator, LTIAuthenticator
+from .enrollment import enrollment_queue, enrollment_record, INSTRUCTOR, STUDENT
 
 
 class NBGraderAuthenticator(LTIAuthenticator):
+    _enrollment_queue = None
+    _enrollment_queue_depth = 0
+    _depth_callback = None
+
+    enrollment_queue_url = Unicode(
+        help="URL of the enrollment queue database.  When set, spawns queue their enrollment for "
+             "lti-enrollment-worker instead of the server running enroll.py.  Defaults to ENROLLMENT_QUEUE_DB"
+    ).tag(config=True)
+
+    @default('enrollment_queue_url')
+    def _enrollment_queue_url_default(self):
+        return os.environ.get('ENROLLMENT_QUEUE_DB', '')
+
+    enrollment_queue_depth_interval = Integer(
+        15,
+        help="Seconds between readings of the enrollment queue depth served in the metrics"
+    ).tag(config=True)
+
+    @property
+    def enrollment_queue(self):
+        if self._enrollment_queue is None and self.enrollment_queue_url:
+            self._enrollment_queue = enrollment_queue(self.enrollment_queue_url)
+        return self._enrollment_queue
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            metrics = super().metrics
+            if self.enrollment_queue is not None:
+                # read in the background, so a scrape never queries the database on the IOLoop
+                metrics.add_collector('enrollment_queue_depth', 'gauge',
+                                      'Enrollments waiting to be applied to the Gradebook',
+                                      lambda: self._enrollment_queue_depth)
+        return self._metrics
+
+    def _start_background_tasks(self):
+        super()._start_background_tasks()
+        if self._depth_callback is None and self.enrollment_queue is not None:
+            self._depth_callback = PeriodicCallback(self._read_queue_depth,
+                                                    self.enrollment_queue_depth_interval * 1000)
+            self._depth_callback.start()
+            IOLoop.current().spawn_callback(self._read_queue_depth)
+
+    async def _read_queue_depth(self):
+        """
+        Reads the enrollment queue depth on the db_executor, for the metrics to serve
+        """
+        try:
+            self._enrollment_queue_depth = await self.db_executor.run(self.enrollment_queue.depth)
+        except Exception:
+            self.log.exception('Could not read the enrollment queue depth')
 
     # @gen.coroutine
     async def authenticate(self, handler, data=None):
-        self.log.debug("calling authenticate in LTIAuthenticator\n")
-        validator = LTIValidator()
-        signature_authenticate = SignatureOnlyEndpoint(validator)
+        self.log.debug("calling authenticate in NBGraderAuthenticator\n")
+        self._start_background_tasks()
 
         request = handler.request
+        self.log.debug('%s://%s%s', request.protocol, request.host, request.uri)
 
-        self.log.debug('self.enable_auth_state: %s' % self.enable_auth_state)
-        self.log.debug('self: %s' % self)
-        self.log.debug('%s://%s%s\n' % (request.protocol, request.host, request.uri))
-        self.log.debug('%s\n\n' % str(dict(request.headers)))
-        # self.log.debug('%s\n\n' % request.body.decode('utf-8'))
-        body = request.body.decode('utf-8')
-        for p in body.split('&'):
-            self.log.debug('%s' % p)
-        self.log.debug('\nFinished self.log.debugging body.split\n')
-
-        # Since we're behind a proxy we need to hardcode the URL here for the signature
-        url = '%s://%s/hub/login' % (os.environ.get('PROTO', 'http'), os.environ.get('DOMAIN', 'localhost'))
-        self.log.info('url: %s' % url)
-        x = signature_authenticate.validate_request(url, request.method, request.body.decode('utf-8'), request.headers)
-        self.log.debug("Authenticated? %s\n\n" % str(x[0]))
-
-        if x[0]:
-
-            user = db.get_user(handler.get_argument("user_id"))
-
-            if not user:
-                user = db.add_user(handler.get_argument('user_id'))
-
-        else:
+        launch = self._authenticate(handler, data)
+        if launch is None:
             return None
 
-        username = user.unix_name
-        role = handler.get_argument('roles')
-
-        upper_r = role.upper()
-        self.log.debug('upper_r: %s', upper_r)
-        allow_admin = 'TeachingAssistant'.upper() in upper_r or 'Instructor'.upper() in upper_r or 'ContentDeveloper'.upper() in upper_r
+        course_name = launch.custom_course
+        username = await self.map_launch_user(launch, course_name)
 
-        is_admin = bool(allow_admin and handler.get_argument('custom_admin', ''))
+        is_admin = bool(launch.is_instructor and launch.custom_admin)
         if is_admin:
             username = 'instructor'
 
-        course_name = handler.get_argument('custom_course', '')
-        if course_name not in user.courses:
-            user.courses.append(LtiUserCourse(user_id=user.user_id, course=course_name))
-            db.db.commit()
-
-        firstname = handler.get_argument('lis_person_name_given', '')
-        surname = handler.get_argument('lis_person_name_family', '')
-        env = os.environ.copy()
+        firstname = launch.lis_person_name_given
+        surname = launch.lis_person_name_family
 
         auth_state = {'course': course_name}
         for var in ['JUPYTERHUB_API_URL', 'JUPYTERHUB_API_TOKEN', 'GRADEBOOK_DB', 'MONGO_PW']:
-            auth_state[var] = env[var]
+            auth_state[var] = os.environ[var]
 
         auth_state['first_name'] = firstname
         auth_state['surname'] = surname
@@ -105,7 +121,16 @@ class NBGraderAuthenticator(LTIAuthenticator):
         spawner.environment['LAST_NAME'] = auth_state['surname']
         spawner.environment['USERNAME'] = user.name
         spawner.environment['ADMIN_API_TOKEN'] = spawner.environment['JUPYTERHUB_API_TOKEN']
-       
+
+        if self.enrollment_queue is not None:
+            role = INSTRUCTOR if user.name == 'instructor' else STUDENT
+            record = enrollment_record(user.name, spawner.environment['COURSE'], auth_state['first_name'],
+                                       auth_state['surname'], role)
+            yield self.db_executor.run(self.enrollment_queue.put, record)
+            # Tells enroll.py in the spawned server that there is nothing left for it to do
+            spawner.environment['ENROLLMENT_QUEUED'] = '1'
+            self.log.debug('Queued enrollment %s' % record)
+
         self.log.debug('spawner.environment: %s\n\n\n' % spawner.environment)
 
 
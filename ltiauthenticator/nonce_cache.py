@@ -0,0 +1,185 @@
+"""
+In-process replay cache for OAuth nonces.
+
+Every nonce accepted during the timestamp window is remembered in memory, keyed by
+(consumer key, nonce), and written through to the NoncesDB on a background thread
+so the launch itself never waits for the database.  The writer inserts whatever has
+queued up in one transaction.  The queue is bounded: when it is full, the launch
+writes its own nonce, so a storm slows launches down rather than growing the backlog.  Entries are grouped into time
+buckets, and whole buckets are dropped once they fall out of the window, so memory
+stays flat however many launches arrive.
+"""
+import atexit
+import queue
+import threading
+import time
+from collections import OrderedDict
+import logging
+
+log = logging.getLogger(__name__)
+
+# Matches the window NoncesDB.check_valid_timestamp_and_nonce has always used
+TIMESTAMP_WINDOW = 900
+
+
+class NonceCache(object):
+
+    def __init__(self, nonces_db=None, window=TIMESTAMP_WINDOW, bucket_width=60, max_entries=100000,
+                 max_pending=10000, write_batch=500):
+        """
+        :param nonces_db: A NoncesDB to write accepted nonces to, and to fall back to for
+            timestamps whose bucket had to be evicted early.  May be None for a purely
+            in-memory cache.
+        :param window: How many seconds old a timestamp may be before it is rejected
+        :param bucket_width: The number of seconds covered by each eviction bucket
+        :param max_entries: The most nonces held in memory at once
+        :param max_pending: The most nonces waiting to be written to the database
+        :param write_batch: The most nonces written in one transaction
+        """
+        self.nonces_db = nonces_db
+        self.window = window
+        self.bucket_width = bucket_width
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # (client_key, nonce) -> timestamp
+        self._entries = {}
+        # bucket number -> [(client_key, nonce), ...], oldest bucket first
+        self._buckets = OrderedDict()
+        # Buckets before this one were evicted to honour max_entries rather than expiry
+        self._floor = 0
+        self.write_batch = write_batch
+        self._pending = queue.Queue(max_pending)
+        self._writer = None
+        if nonces_db is not None:
+            self._writer = threading.Thread(target=self._write_pending, name='nonce-writer', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def valid_timestamp(self, timestamp, now=None):
+        """
+        :return: The timestamp as an int if it is within the window, otherwise 0
+        """
+        try:
+            timestamp = int(timestamp)
+        except (TypeError, ValueError):
+            return 0
+        now = time.time() if now is None else now
+        if timestamp <= 0 or now - timestamp > self.window or now - timestamp < 0:
+            return 0
+        return timestamp
+
+    def load(self, now=None):
+        """
+        Fills the cache with the nonces the database has seen inside the window, so a
+        restarted hub still rejects replays of launches made before it went down.
+        """
+        if self.nonces_db is None:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            for client_key, timestamp, nonce in self.nonces_db.recent_nonces(int(now) - self.window):
+                self._remember((client_key, nonce), timestamp)
+            self._evict(now)
+        log.info('Loaded %d nonces into the replay cache' % len(self._entries))
+
+    def check_and_add(self, client_key, timestamp, nonce, now=None):
+        """
+        Checks that the timestamp is within the window and the nonce has not been seen
+        before for this consumer key, and records it if so.  The check and the record
+        happen under one lock, so two copies of the same launch cannot both pass.
+        :return: True if the launch is fresh, False if it is stale or a replay
+        """
+        now = time.time() if now is None else now
+        timestamp = self.valid_timestamp(timestamp, now)
+        if not timestamp:
+            return False
+
+        key = (client_key, nonce)
+        with self._lock:
+            if key in self._entries:
+                return False
+            self._evict(now)
+            if timestamp // self.bucket_width < self._floor and self.nonces_db is not None:
+                # This part of the window is no longer held in memory
+                if not self.nonces_db.check_valid_timestamp_and_nonce(timestamp, nonce):
+                    return False
+            self._remember(key, timestamp)
+
+        if self._writer is not None:
+            try:
+                self._pending.put_nowait((client_key, timestamp, nonce))
+            except queue.Full:
+                log.warning('Nonce write queue is full, writing the nonce for %s during the launch' % client_key)
+                self._persist([(client_key, timestamp, nonce)])
+        return True
+
+    def _remember(self, key, timestamp):
+        bucket = timestamp // self.bucket_width
+        if bucket not in self._buckets:
+            newest = next(reversed(self._buckets), None)
+            self._buckets[bucket] = []
+            if newest is not None and bucket < newest:
+                # Timestamps arrive slightly out of order, so keep the buckets sorted
+                self._buckets = OrderedDict(sorted(self._buckets.items()))
+        self._buckets[bucket].append(key)
+        self._entries[key] = timestamp
+
+    def _drop_bucket(self, bucket):
+        for key in self._buckets.pop(bucket):
+            timestamp = self._entries.get(key)
+            if timestamp is not None and timestamp // self.bucket_width == bucket:
+                del self._entries[key]
+
+    def _evict(self, now):
+        expired = (int(now) - self.window) // self.bucket_width
+        while self._buckets:
+            oldest = next(iter(self._buckets))
+            if oldest < expired:
+                self._drop_bucket(oldest)
+            elif len(self._entries) >= self.max_entries and len(self._buckets) > 1:
+                log.warning('Nonce cache is full, falling back to the database for bucket %d' % oldest)
+                self._drop_bucket(oldest)
+                self._floor = max(self._floor, oldest + 1)
+            else:
+                break
+
+    def _write_pending(self):
+        """
+        Runs on the writer thread, writing the queued nonces a batch at a time until ``close``
+        """
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._pending.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.write_batch:
+                    break
+                try:
+                    item = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            # None is queued by close
+            stopping = item is None
+            if batch:
+                self._persist(batch)
+
+    def _persist(self, nonces):
+        try:
+            self.nonces_db.add_nonces(nonces)
+        except Exception:
+            log.exception('Could not write %d nonces to the database' % len(nonces))
+
+    def close(self):
+        """
+        Waits for any pending writes to reach the database
+        """
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._pending.put(None)
+            writer.join()
+            atexit.unregister(self.close)
@@ -0,0 +1,389 @@
+"""
+LTI 1.1 Outcomes grade passback.
+
+Grades are streamed out of the nbgrader Gradebook, matched to the outcome service
+details stored by each user's launch, and sent to the consumer as signed
+``replaceResult`` requests.  Requests go out concurrently over pooled keep-alive
+connections, limited to a steady rate per LMS host, and are retried with backoff on
+connection errors and 5xx responses.  Grades that still fail are put on a
+DurableQueue to be sent again later with ``lti-passback --retry``.
+
+    lti-passback --gradebook sqlite:///gradebook.db --course data_science --assignment ps1 \
+        --resource-link 4f2a...
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import requests
+from oauthlib.oauth1 import Client
+
+from .hub_client import pooled_session, RETRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = 'outcomes'
+OUTCOMES_NS = 'http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0'
+
+REPLACE_RESULT = '''<?xml version="1.0" encoding="UTF-8"?>
+<imsx_POXEnvelopeRequest xmlns="%(ns)s">
+  <imsx_POXHeader>
+    <imsx_POXRequestHeaderInfo>
+      <imsx_version>V1.0</imsx_version>
+      <imsx_messageIdentifier>%(message_id)s</imsx_messageIdentifier>
+    </imsx_POXRequestHeaderInfo>
+  </imsx_POXHeader>
+  <imsx_POXBody>
+    <replaceResultRequest>
+      <resultRecord>
+        <sourcedGUID>
+          <sourcedId>%(sourcedid)s</sourcedId>
+        </sourcedGUID>
+        <result>
+          <resultScore>
+            <language>en</language>
+            <textString>%(score)s</textString>
+          </resultScore>
+        </result>
+      </resultRecord>
+    </replaceResultRequest>
+  </imsx_POXBody>
+</imsx_POXEnvelopeRequest>
+'''
+
+
+def replace_result_xml(sourcedid, score, message_id=None):
+    """
+    :param sourcedid: The ``lis_result_sourcedid`` of the user's launch
+    :param score: The grade, between 0 and 1
+    :return: The body of a replaceResult request
+    """
+    return REPLACE_RESULT % {
+        'ns': OUTCOMES_NS,
+        'message_id': escape(message_id or uuid.uuid4().hex),
+        'sourcedid': escape(sourcedid),
+        'score': repr(round(float(score), 6)),
+    }
+
+
+def parse_response(body):
+    """
+    :return: A tuple of (True if the consumer reported success, its description)
+    """
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError as e:
+        return False, 'Unreadable response: %s' % e
+    ns = {'ims': OUTCOMES_NS}
+    code = root.findtext('.//ims:imsx_statusInfo/ims:imsx_codeMajor', namespaces=ns)
+    description = root.findtext('.//ims:imsx_statusInfo/ims:imsx_description', namespaces=ns) or ''
+    return code == 'success', description
+
+
+class Grade(object):
+    __slots__ = ('key', 'url', 'sourcedid', 'score', 'attempts')
+
+    def __init__(self, key, url, sourcedid, score, attempts=0):
+        self.key = key
+        self.url = url
+        self.sourcedid = sourcedid
+        self.score = score
+        self.attempts = attempts
+
+    def to_payload(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(**payload)
+
+    def __repr__(self):
+        return 'Grade(<sourcedid: %s score: %s url: %s>)' % (self.sourcedid, self.score, self.url)
+
+
+class RateLimiter(object):
+    """
+    A token bucket allowing ``rate`` requests a second, in bursts of up to ``burst``
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request is allowed
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class OutcomesClient(object):
+
+    def __init__(self, credentials, max_concurrency=16, pool_size=8, rate=20.0, burst=None, timeout=10.0,
+                 retries=3, backoff=0.5):
+        """
+        :param credentials: The CredentialRegistry holding each consumer key's secret
+        :param max_concurrency: The most requests in flight at once, across every LMS
+        :param pool_size: The most connections kept open to each LMS
+        :param rate: The most requests a second sent to each LMS host
+        :param burst: How many requests may go to one host at once after it has been idle.
+            Defaults to ``rate``
+        :param timeout: Seconds to wait to connect, and then for each read
+        :param retries: How many times to retry after a connection error or a 5xx response
+        :param backoff: Retries wait ``backoff * 2 ** (retry - 1)`` seconds
+        """
+        self.credentials = credentials
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Retries are made here rather than by the pool, as each needs a fresh nonce
+        self.session = pooled_session(pool_size, retries=0, pool_connections=16)
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(host, RateLimiter(self.rate, self.burst))
+        return limiter
+
+    def send(self, grade):
+        """
+        Sends one grade, blocking until the consumer answers
+        :return: A tuple of (True if the consumer accepted it, a description of the outcome)
+        """
+        secret = self.credentials.get_secret(grade.key)
+        if secret is None:
+            return False, 'Unknown consumer key %s' % grade.key
+        xml = replace_result_xml(grade.sourcedid, grade.score)
+        limiter = self._limiter(grade.url)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            limiter.acquire()
+            # oauthlib adds the oauth_body_hash the Outcomes service requires for non-form bodies
+            client = Client(grade.key, client_secret=secret)
+            url, headers, body = client.sign(grade.url, 'POST', body=xml, headers={'Content-Type': 'application/xml'})
+            try:
+                response = self.session.post(url, data=body.encode('utf-8'), headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                outcome = False, str(e)
+                continue
+            if response.status_code in RETRY_STATUSES:
+                outcome = False, 'HTTP %d' % response.status_code
+                continue
+            if not response.ok:
+                return False, 'HTTP %d' % response.status_code
+            return parse_response(response.content)
+        return outcome
+
+    def _send_stream(self, grades):
+        """
+        Sends a stream of grades, up to ``max_concurrency`` at once.  The stream is only
+        read as fast as the grades are sent.
+        :return: A tuple of the report and the list of grades that failed
+        """
+        report = {'sent': 0, 'failed': 0}
+        lock = threading.Lock()
+        failed = []
+        # bounds how far ahead of the requests the stream is read
+        slots = threading.BoundedSemaphore(self.max_concurrency * 2)
+
+        def send(grade):
+            try:
+                try:
+                    ok, description = self.send(grade)
+                except Exception as e:
+                    # e.g. the LTI database failing to give the secret; the grade is retried like any other
+                    logger.exception('Error sending the grade for %s' % grade.sourcedid)
+                    ok, description = False, str(e)
+                with lock:
+                    if ok:
+                        report['sent'] += 1
+                    else:
+                        report['failed'] += 1
+                        failed.append(grade)
+                        logger.warning('Grade for %s not accepted: %s' % (grade.sourcedid, description))
+            finally:
+                slots.release()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='lti-outcomes') as pool:
+            for grade in grades:
+                slots.acquire()
+                pool.submit(send, grade)
+        report['seconds'] = time.perf_counter() - start
+        report['grades_per_sec'] = report['sent'] / report['seconds'] if report['seconds'] else 0.0
+        return report, failed
+
+    def send_all(self, grades, queue=None, retry_delay=60):
+        """
+        Sends a stream of grades, up to ``max_concurrency`` at once
+        :param grades: An iterable of Grade
+        :param queue: A DurableQueue for the grades that fail, to be sent again by ``retry``
+        :param retry_delay: Seconds before a failed grade is sent again
+        :return: A report of the grades sent, failed and queued, the time taken and the rate
+        """
+        report, failed = self._send_stream(grades)
+        report['queued'] = 0
+        if queue is not None and failed:
+            for grade in failed:
+                grade.attempts += 1
+            queue.put_many([grade.to_payload() for grade in failed], delay=retry_delay)
+            report['queued'] = len(failed)
+        return report
+
+    def retry(self, queue, batch_size=500, max_attempts=5, retry_delay=60):
+        """
+        Sends the queued grades that are due.  Those that fail again go back on the queue,
+        waiting twice as long each time, until they have been tried ``max_attempts`` times.
+        :return: A report like ``send_all``'s, plus the number of grades given up on
+        """
+        totals = {'sent': 0, 'failed': 0, 'queued': 0, 'dropped': 0, 'seconds': 0.0}
+        while True:
+            items = queue.lease(batch_size, lease_seconds=max(300, batch_size))
+            if not items:
+                break
+            report, failed = self._send_stream(Grade.from_payload(payload) for _, payload in items)
+            requeue = []
+            for grade in failed:
+                grade.attempts += 1
+                if grade.attempts < max_attempts:
+                    requeue.append(grade)
+                else:
+                    logger.error('Giving up on the grade for %s after %d attempts' % (grade.sourcedid, grade.attempts))
+            # the failures are queued again before the batch is acknowledged, so none are lost
+            for grade in requeue:
+                queue.put(grade.to_payload(), delay=retry_delay * 2 ** (grade.attempts - 1))
+            queue.ack([item_id for item_id, _ in items])
+            totals['sent'] += report['sent']
+            totals['failed'] += report['failed']
+            totals['queued'] += len(requeue)
+            totals['dropped'] += len(failed) - len(requeue)
+            totals['seconds'] += report['seconds']
+        totals['grades_per_sec'] = totals['sent'] / totals['seconds'] if totals['seconds'] else 0.0
+        return totals
+
+    def close(self):
+        self.session.close()
+
+
+def gradebook_grades(gradebook, assignment, lti_db, resource_link_id, chunk_size=500, skipped=None):
+    """
+    Streams the grades of an assignment out of the Gradebook, a chunk of submissions at a time
+    :param gradebook: An open nbgrader Gradebook for the course
+    :param assignment: The name of the assignment
+    :param lti_db: The LtiDB holding the users' sessions
+    :param resource_link_id: The assignment's resource link.  Each link is its own column in
+        the LMS gradebook, so the grades are only sent to the sessions launched from it
+    :param skipped: A list to which the unix names of students without a session are added
+    :return: A generator of Grade, with scores between 0 and 1
+    """
+    if not resource_link_id:
+        raise ValueError('The resource link of assignment %s is needed to send its grades' % assignment)
+    from nbgrader.api import Assignment, SubmittedAssignment
+
+    query = gradebook.db.query(SubmittedAssignment) \
+        .join(Assignment, Assignment.id == SubmittedAssignment.assignment_id) \
+        .filter(Assignment.name == assignment, Assignment.course_id == gradebook.course_id) \
+        .order_by(SubmittedAssignment.student_id)
+    chunk = []
+    for submission in query.yield_per(chunk_size):
+        chunk.append((submission.student_id, submission.score, submission.max_score))
+        if len(chunk) >= chunk_size:
+            for grade in _grades_for(chunk, lti_db, resource_link_id, skipped):
+                yield grade
+            chunk = []
+    for grade in _grades_for(chunk, lti_db, resource_link_id, skipped):
+        yield grade
+
+
+def _grades_for(submissions, lti_db, resource_link_id, skipped):
+    if not submissions:
+        return
+    targets = lti_db.outcome_targets([student for student, _, _ in submissions], resource_link_id)
+    for student, score, max_score in submissions:
+        target = targets.get(student)
+        if target is None:
+            if skipped is not None:
+                skipped.append(student)
+            continue
+        key, sourcedid, url = target
+        yield Grade(key, url, sourcedid, min(1.0, max(0.0, (score or 0) / max_score)) if max_score else 0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Send nbgrader grades back to the LMS')
+    parser.add_argument('--gradebook', default=os.environ.get('GRADEBOOK_DB', 'sqlite:///gradebook.db'),
+                        help="nbgrader Gradebook database URL")
+    parser.add_argument('--course', help="The course in the Gradebook")
+    parser.add_argument('--assignment', help="The assignment whose grades are sent")
+    parser.add_argument('--resource-link', help="The assignment's LTI resource_link_id, "
+                                                "which picks its column in the LMS gradebook")
+    parser.add_argument('--db', default=os.environ.get('LTI_DB', 'sqlite:///lti.db'), help="LTI database URL")
+    parser.add_argument('--shard', action='append',
+                        help="Further shard of the LTI database.  May be given several times.  "
+                             "Defaults to LTI_DB_SHARDS")
+    parser.add_argument('--queue', default=os.environ.get('OUTCOMES_QUEUE_DB', 'sqlite:///outcomes.db'),
+                        help="Database URL of the queue of grades to retry")
+    parser.add_argument('--retry', action='store_true', help="Only send the queued grades that are due")
+    parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once")
+    parser.add_argument('--rate', type=float, default=20.0, help="Requests a second to each LMS host")
+    args = parser.parse_args(argv)
+
+    from .credentials import CredentialRegistry, env_seed
+    from .durable_queue import DurableQueue
+    from .sharding import env_shard_urls, open_lti_db
+
+    logging.basicConfig(level=logging.INFO)
+    lti_db = open_lti_db(args.db, args.shard or env_shard_urls())
+    queue = DurableQueue(args.queue, QUEUE_NAME)
+    # the environment's secret overrides the stored one, as it does for the hub's launches
+    client = OutcomesClient(CredentialRegistry(lti_db, env_seed()), max_concurrency=args.concurrency, rate=args.rate)
+    try:
+        if args.retry:
+            report = client.retry(queue)
+            print('Sent %(sent)d queued grades in %(seconds).2fs (%(grades_per_sec).0f grades/sec): '
+                  '%(queued)d queued again, %(dropped)d given up on' % report)
+            return
+        if not (args.course and args.assignment and args.resource_link):
+            parser.error('--course, --assignment and --resource-link are needed unless --retry is given')
+
+        from nbgrader.api import Gradebook
+        skipped = []
+        with Gradebook(args.gradebook, args.course) as gradebook:
+            grades = gradebook_grades(gradebook, args.assignment, lti_db, args.resource_link, skipped=skipped)
+            report = client.send_all(grades, queue)
+        report['skipped'] = len(skipped)
+        print('Sent %(sent)d grades in %(seconds).2fs (%(grades_per_sec).0f grades/sec): %(failed)d failed '
+              'and queued for retry, %(skipped)d students had no LTI session' % report)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Periodic clean-up of nonces that have fallen out of the replay window.
+"""
+import time
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from traitlets import Integer
+from traitlets.config import LoggingConfigurable
+
+from .nonce_cache import TIMESTAMP_WINDOW
+
+
+class NoncePruner(LoggingConfigurable):
+
+    interval = Integer(
+        300,
+        help="Seconds between pruning runs"
+    ).tag(config=True)
+
+    batch_size = Integer(
+        1000,
+        help="The most nonces deleted in one transaction"
+    ).tag(config=True)
+
+    max_batches = Integer(
+        50,
+        help="The most batches deleted in one run.  Anything left over waits for the next run"
+    ).tag(config=True)
+
+    def __init__(self, nonces_db, window=TIMESTAMP_WINDOW, **kwargs):
+        """
+        :param nonces_db: The NoncesDB to prune
+        :param window: Nonces older than this many seconds can no longer be replayed and are deleted
+        """
+        super().__init__(**kwargs)
+        self.nonces_db = nonces_db
+        self.window = window
+        self._callback = None
+
+    def prune_once(self, now=None):
+        """
+        Deletes expired nonces in bounded batches
+        :return: A dict with the number of rows ``pruned`` and the number ``remaining`` in the table
+        """
+        now = time.time() if now is None else now
+        pruned = self.nonces_db.prune(int(now) - self.window, self.batch_size, self.max_batches)
+        report = {'pruned': pruned, 'remaining': self.nonces_db.count()}
+        self.log.info('Pruned %(pruned)d expired nonces, %(remaining)d remaining' % report)
+        return report
+
+    async def run(self):
+        try:
+            return await IOLoop.current().run_in_executor(None, self.prune_once)
+        except Exception:
+            self.log.exception('Pruning nonces failed')
+
+    def start(self):
+        """
+        Runs the pruning every ``interval`` seconds on the current IOLoop
+        """
+        if self._callback is None:
+            self._callback = PeriodicCallback(self.run, self.interval * 1000)
+            self._callback.start()
+
+    def stop(self):
+        if self._callback is not None:
+            self._callback.stop()
+            self._callback = None
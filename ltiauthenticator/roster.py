@@ -0,0 +1,101 @@
+"""
+Bulk import of course rosters, so students have a unix name before their first launch.
+
+The roster is a CSV file with a header row, or a JSON-lines file, with a ``user_id``
+and optionally a ``course`` for each student.  It is read as a stream and written in
+chunks, each one a single transaction, and rows that already exist are skipped, so a
+roster can be imported again after it changes.
+
+    lti-import-roster roster.csv --course data_science
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+from .sharding import env_shard_urls, open_lti_db
+
+
+def read_roster(stream, fmt='csv', default_course=None):
+    """
+    Reads a roster one row at a time
+    :param stream: A text file object
+    :param fmt: ``csv`` or ``jsonl``
+    :param default_course: Used for rows without a course
+    :return: A generator of (user_id, course) pairs
+    """
+    if fmt == 'csv':
+        rows = csv.DictReader(stream)
+    else:
+        rows = (json.loads(line) for line in stream if line.strip())
+    for row in rows:
+        user_id = (row.get('user_id') or '').strip()
+        if not user_id:
+            continue
+        yield user_id, (row.get('course') or default_course or '').strip() or None
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_roster(lti_db, rows, chunk_size=1000, log=None):
+    """
+    Imports (user_id, course) pairs into the database in chunks
+    :return: A dict with the number of ``rows`` read, ``users`` and ``enrolments`` added,
+        the ``seconds`` taken and the ``rows_per_sec``
+    """
+    start = time.perf_counter()
+    report = {'rows': 0, 'users': 0, 'enrolments': 0}
+    for chunk in chunks(rows, chunk_size):
+        users, enrolments = lti_db.import_users(chunk)
+        report['rows'] += len(chunk)
+        report['users'] += users
+        report['enrolments'] += enrolments
+        if log:
+            log('%(rows)d rows read, %(users)d users and %(enrolments)d enrolments added' % report)
+    report['seconds'] = time.perf_counter() - start
+    report['rows_per_sec'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create LTI users and course enrolments from a roster file')
+    parser.add_argument('roster', help="CSV or JSON-lines file with user_id and course fields, or - for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="File format.  Guessed from the file extension if not given")
+    parser.add_argument('--course', help="Course for rows that don't name one")
+    parser.add_argument('--db', default=os.environ.get('LTI_DB', 'sqlite:///lti.db'), help="LTI database URL")
+    parser.add_argument('--shard', action='append',
+                        help="Further shard of the LTI database.  May be given several times.  "
+                             "Defaults to LTI_DB_SHARDS")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Rows written per transaction")
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.roster.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+    lti_db = open_lti_db(args.db, args.shard or env_shard_urls(), unix_name_block_size=args.chunk_size)
+    if args.roster == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    else:
+        stream = open(args.roster, newline='', encoding='utf-8')
+    with stream:
+        report = import_roster(lti_db, read_roster(stream, fmt, args.course), args.chunk_size,
+                               log=lambda message: print(message, file=sys.stderr))
+    print('Imported %(rows)d rows in %(seconds).2fs (%(rows_per_sec).0f rows/sec): '
+          '%(users)d new users, %(enrolments)d new enrolments' % report)
+
+
+if __name__ == '__main__':
+    main()
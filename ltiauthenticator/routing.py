@@ -0,0 +1,85 @@
+"""
+Read-your-writes routing between a primary database and its read replicas.
+
+Each LTI launch runs inside ``request_scope()``.  Until the launch writes anything,
+its reads may be served by a replica.  Once it has written, every later read of the
+same launch goes to the primary, so it never sees a replica that hasn't caught up
+with its own write yet.  Reads made outside a request scope, e.g. by the command line
+tools, always go to the primary.
+
+The scope is held in a ContextVar, which DBExecutor carries into its worker threads.
+"""
+import contextlib
+import itertools
+import threading
+from contextvars import ContextVar
+
+_request = ContextVar('lti_db_request', default=None)
+
+
+class RequestRouting(object):
+    __slots__ = ('wrote',)
+
+    def __init__(self):
+        self.wrote = False
+
+
+@contextlib.contextmanager
+def request_scope():
+    """
+    Routes the reads inside the block as one request
+    """
+    token = _request.set(RequestRouting())
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def begin_request():
+    """
+    Starts a request scope lasting until ``end_request`` is called with the returned token
+    """
+    return _request.set(RequestRouting())
+
+
+def end_request(token):
+    _request.reset(token)
+
+
+def mark_write():
+    """
+    Records that the current request has written to the primary
+    """
+    routing = _request.get()
+    if routing is not None:
+        routing.wrote = True
+
+
+def replica_allowed():
+    """
+    :return: True if the current request may read from a replica
+    """
+    routing = _request.get()
+    return routing is not None and not routing.wrote
+
+
+class ReplicaSet(object):
+    """
+    Hands out the replicas' sessions in turn
+    """
+
+    def __init__(self, sessions):
+        """
+        :param sessions: The replicas' scoped sessions
+        """
+        self.sessions = list(sessions)
+        self._next = itertools.cycle(self.sessions)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def next(self):
+        with self._lock:
+            return next(self._next)
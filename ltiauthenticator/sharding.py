@@ -0,0 +1,205 @@
+"""
+Spreads the user map across several databases.
+
+Each user, with their courses and sessions, lives on the shard a consistent hash
+ring picks for their user_id.  Every shard has many points on the ring, so users
+spread evenly, and adding a shard only takes over the points next to its own: about
+1/N of the users move, the rest stay where they are.  ``lti-maintenance rebalance``
+moves them, and should be run before the hubs are given the new list of shards.
+
+Shards are placed on the ring by their position in the list, not their URL, so a
+shard's URL can change, e.g. for a new password or host, without moving any users.
+New shards go at the end of the list; reordering or removing shards moves users.
+
+The first shard is the designated one.  It holds the consumer keys and the counter
+unix names are reserved from, so names stay unique across every shard.
+
+    c.LTIAuthenticator.lti_db_url = 'postgresql://db0/lti'
+    c.LTIAuthenticator.lti_db_shard_urls = ['postgresql://db1/lti', 'postgresql://db2/lti']
+"""
+import bisect
+import hashlib
+import os
+from collections import OrderedDict
+
+from traitlets.config import LoggingConfigurable
+
+from .lti_db import LtiDB, LtiUser
+
+# Points each shard has on the ring.  Changing this moves users, like changing the shards
+VNODES = 128
+
+
+def env_shard_urls():
+    """
+    :return: The comma separated URLs in ``LTI_DB_SHARDS``
+    """
+    return [url.strip() for url in os.environ.get('LTI_DB_SHARDS', '').split(',') if url.strip()]
+
+
+def open_lti_db(db_url, shard_urls=None, **kwargs):
+    """
+    :param db_url: The LTI database, which is the designated shard if there are others
+    :param shard_urls: Further shards
+    :param kwargs: Passed to each LtiDB
+    :return: A ShardedLtiDB over ``db_url`` and ``shard_urls`` if there are any, otherwise an LtiDB
+    """
+    if shard_urls:
+        return ShardedLtiDB([db_url] + list(shard_urls), **kwargs)
+    return LtiDB(db_url, **kwargs)
+
+
+def shard_name(position):
+    """
+    :return: The name on the hash ring of the shard at ``position`` in the list
+    """
+    return 'shard-%d' % position
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        """
+        :param nodes: The names of the nodes, e.g. from ``shard_name``
+        :param vnodes: Points on the ring for each node
+        """
+        self.vnodes = vnodes
+        self.nodes = []
+        # sorted hashes, and the node owning each
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.vnodes):
+            point = _hash('%s#%d' % (node, replica))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key):
+        """
+        :return: The node owning ``key``, the first clockwise from its hash
+        """
+        if not self._points:
+            raise LookupError('The hash ring is empty')
+        index = bisect.bisect(self._points, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardedLtiDB(LoggingConfigurable):
+    """
+    The LtiDB interface over several shards.  Calls about one user go to that user's
+    shard, consumer keys and unix name counters to the designated shard, and lookups
+    by unix name or across users to every shard.
+    """
+
+    def __init__(self, shard_urls, vnodes=VNODES, **kwargs):
+        """
+        :param shard_urls: The shards' database URLs, the designated shard first
+        :param kwargs: Passed to the LtiDB of each shard
+        """
+        super().__init__()
+        if not shard_urls:
+            raise ValueError('ShardedLtiDB needs at least one shard')
+        self.names_db = LtiDB(shard_urls[0], **kwargs)
+        # keyed by shard_name
+        self.shards = OrderedDict([(shard_name(0), self.names_db)])
+        for position, url in enumerate(shard_urls[1:], 1):
+            # every shard hands out names reserved from the designated shard's counter
+            self.shards[shard_name(position)] = LtiDB(url, allocator=self.names_db.allocator, **kwargs)
+        self.ring = HashRing(self.shards, vnodes)
+
+    def for_user(self, user_id):
+        """
+        :return: The LtiDB of the shard holding ``user_id``
+        """
+        return self.shards[self.ring.node_for(user_id)]
+
+    def get_key_secret(self):
+        return self.names_db.get_key_secret()
+
+    def get_key_secrets(self):
+        return self.names_db.get_key_secrets()
+
+    def add_key_secret(self, key, secret):
+        return self.names_db.add_key_secret(key, secret)
+
+    def reserve_ids(self, name, count, seed=None):
+        return self.names_db.reserve_ids(name, count, seed)
+
+    def add_or_update_user_session(self, key, user_id, lis_result_sourcedid, lis_outcome_service_url, resource_link_id):
+        return self.for_user(user_id).add_or_update_user_session(
+            key, user_id, lis_result_sourcedid, lis_outcome_service_url, resource_link_id)
+
+    def get_user_session(self, user_id, key=None, resource_link_id=None):
+        return self.for_user(user_id).get_user_session(user_id, key, resource_link_id)
+
+    def get_user(self, user_id):
+        return self.for_user(user_id).get_user(user_id)
+
+    def lookup_user(self, user_id):
+        return self.for_user(user_id).lookup_user(user_id)
+
+    def add_user(self, user_id, firstname='', surname=''):
+        return self.for_user(user_id).add_user(user_id, firstname, surname)
+
+    def add_user_course(self, user_id, course, record=None):
+        return self.for_user(user_id).add_user_course(user_id, course, record)
+
+    def invalidate_user(self, user_id=None):
+        if user_id is not None:
+            self.for_user(user_id).invalidate_user(user_id)
+            return
+        for shard in self.shards.values():
+            shard.invalidate_user()
+
+    def get_user_by_unix_name(self, unix_name):
+        for shard in self.shards.values():
+            user = shard.db.query(LtiUser).filter(LtiUser.unix_name == unix_name).first()
+            if user is not None:
+                return user
+        self.log.error('No user by the UNIX name %s' % unix_name)
+        return None
+
+    def outcome_targets(self, unix_names, resource_link_id=None):
+        unix_names = list(unix_names)
+        targets = {}
+        for shard in self.shards.values():
+            targets.update(shard.outcome_targets(unix_names, resource_link_id))
+        return targets
+
+    def import_users(self, enrolments):
+        by_shard = OrderedDict()
+        for user_id, course in enrolments:
+            by_shard.setdefault(self.ring.node_for(user_id), []).append((user_id, course))
+        users_added = courses_added = 0
+        for name, shard_enrolments in by_shard.items():
+            users, courses = self.shards[name].import_users(shard_enrolments)
+            users_added += users
+            courses_added += courses
+        return users_added, courses_added
+
+    def counters(self):
+        totals = {}
+        for shard in self.shards.values():
+            for name, value in shard.counters().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
@@ -0,0 +1,51 @@
+"""
+Coalescing of duplicate concurrent work.
+
+A double click, or an LMS re-sending a launch, brings the same user in several times
+within a second.  Each copy still has its own signature and nonce checked, but the
+user mapping and database writes behind them are only done once: the first copy does
+the work, and the copies that arrive while it is in progress wait for and share its
+result.
+"""
+import asyncio
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        # key -> Future of the call in progress
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Awaits ``fn(*args, **kwargs)``, unless a call with the same key is already in
+        progress, in which case its result, or exception, is shared instead
+        :param key: Identifies calls that are interchangeable
+        :param fn: A coroutine function
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shielded so a cancelled waiter does not cancel the call everyone else is waiting for
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            # the caller sees the exception, so don't warn if no other caller retrieves it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
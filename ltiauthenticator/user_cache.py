@@ -0,0 +1,110 @@
+"""
+Bounded LRU caches of what the database holds about LTI users, so returning users
+are resolved, and their unchanged launches stored, without touching the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserRecord(object):
+    """
+    What a launch needs to know about a user: their LTI user_id, unix name and the
+    set of course names they are enrolled on
+    """
+    __slots__ = ('user_id', 'unix_name', 'courses')
+
+    def __init__(self, user_id, unix_name, courses=frozenset()):
+        self.user_id = user_id
+        self.unix_name = unix_name
+        self.courses = frozenset(courses)
+
+    def with_course(self, course):
+        return UserRecord(self.user_id, self.unix_name, self.courses | {course})
+
+    def __eq__(self, other):
+        return isinstance(other, UserRecord) and \
+            (self.user_id, self.unix_name, self.courses) == (other.user_id, other.unix_name, other.courses)
+
+    def __repr__(self):
+        return 'UserRecord(<user_id: %s unix_name: %s courses: %s>)' % (self.user_id, self.unix_name, sorted(self.courses))
+
+
+class LRUCache(object):
+    """
+    A bounded mapping with a time to live, which drops the least recently used entry when full
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        :param max_size: The most entries held at once.  The least recently used is dropped first
+        :param ttl: Seconds an entry is kept before it has to be read from the database again.
+            0 keeps entries until they are evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (value, expiry time)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """
+        :return: The cached value, or None if it isn't cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if not expires or expires > (time.monotonic() if now is None else now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, now=None):
+        """
+        Stores a value, replacing any older copy of it
+        """
+        expires = ((time.monotonic() if now is None else now) + self.ttl) if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        Forgets an entry, or every entry if ``key`` is None, so it is read from the database next time
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        :return: A dict of the hit, miss and eviction counters and the current size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+
+class UserCache(LRUCache):
+    """
+    UserRecords by user_id
+    """
+
+    def put(self, record, now=None):
+        """
+        Stores a UserRecord, replacing any older copy of it
+        """
+        self.set(record.user_id, record, now)
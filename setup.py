@@ -54,6 +54,14 @@ setup_args = dict(
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
     ],
+    entry_points        = {
+        'console_scripts': [
+            'lti-import-roster = ltiauthenticator.roster:main',
+            'lti-enrollment-worker = ltiauthenticator.enrollment:main',
+            'lti-maintenance = ltiauthenticator.maintenance:main',
+            'lti-passback = ltiauthenticator.outcomes:main',
+        ],
+    },
 )
 
 if 'bdist_wheel' in sys.argv: